@@ -0,0 +1,55 @@
+"""Time and peak memory of ExpenseModel.export_to_pdf for growing row counts.
+
+Run from the repository root:
+
+    python benchmarks/bench_pdf_export.py [ROWS ...]
+
+Defaults to 10k and 100k rows. Each size gets a fresh temporary database.
+Rendering time should grow linearly with the number of rows and the process's
+peak resident memory should stay roughly flat (Unix only, it relies on the
+resource module).
+"""
+import os
+import resource
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from data import ExpenseModel  # noqa: E402
+
+CATEGORIES = ['Groceries', 'Utilities', 'Entertainment', 'Transport', 'Dining',
+              'Health', 'Education', 'Shopping', 'Insurance', 'Miscellaneous']
+
+
+def fill(model, rows):
+    rng = random.Random(rows)
+    model.add_expenses_bulk(
+        ((round(rng.uniform(1, 300), 2), rng.choice(CATEGORIES),
+          f'20{rng.randint(20, 24)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}', f'Expense {i}')
+         for i in range(rows)),
+        batch_size=10000)
+
+
+def main(sizes):
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            model = ExpenseModel(os.path.join(tmpdir, 'expenses.db'))
+            fill(model, rows)
+
+            start = time.perf_counter()
+            model.export_to_pdf(os.path.join(tmpdir, 'report.pdf'))
+            elapsed = time.perf_counter() - start
+            # ru_maxrss is in KiB on Linux
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+            size = os.path.getsize(os.path.join(tmpdir, 'report.pdf'))
+            model.close_connection()
+        print(f'{rows:>8} rows  {elapsed:8.2f} s  {rows / elapsed:8.0f} rows/s  '
+              f'peak RSS {peak / 2**20:6.1f} MiB  file {size / 2**20:6.1f} MiB')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,131 @@
+"""Startup cost of the app: module import times and time to first frame.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py [--runs N] [--json]
+
+Import times are parsed from `python -X importtime`, each in a fresh
+interpreter, and the best of --runs is kept. Time to first frame starts the
+real main() with a patched tk.Tk that records when the first window was drawn
+and when the full GUI was ready; it needs a display and is skipped without one.
+
+The script exits with status 1 when a module in HEAVY_MODULES is imported
+before the window is up or a measurement exceeds its entry in BUDGETS, so it
+can run as a regression guard.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Only needed once a chart, report or export is requested
+HEAVY_MODULES = ('pandas', 'matplotlib', 'numpy', 'ttkthemes', 'pdf_report', 'multiprocessing')
+
+# Milliseconds; generous enough for a slow machine, tight enough to catch a
+# heavy module sneaking back into the startup path
+BUDGETS = {
+    'import main': 150,
+    'import gui': 400,
+    'first frame': 500,
+    'ready': 2000,
+}
+
+FIRST_FRAME_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import tkinter as tk
+
+class ProbeTk(tk.Tk):
+    first_frame = None
+
+    def update(self):
+        super().update()
+        if ProbeTk.first_frame is None:
+            ProbeTk.first_frame = time.perf_counter() - start
+            ProbeTk.heavy = [name for name in sys.argv[1:] if name in sys.modules]
+
+    def mainloop(self, n=0):
+        self.update()
+        ready = time.perf_counter() - start
+        print(json.dumps({'first frame': ProbeTk.first_frame * 1000, 'ready': ready * 1000,
+                          'heavy': ProbeTk.heavy}))
+        self.destroy()
+
+tk.Tk = ProbeTk
+import main
+main.main()
+'''
+
+
+def import_times(statement):
+    """Return ({module: cumulative microseconds}, total milliseconds) for statement."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=SRC, capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name[1:]] = int(cumulative)
+    # Nested imports are indented below the module that triggered them
+    total = sum(value for name, value in modules.items() if not name.startswith(' ')) / 1000
+    return {name.strip(): value for name, value in modules.items()}, total
+
+
+def first_frame():
+    result = subprocess.run([sys.executable, '-c', FIRST_FRAME_PROBE, *HEAVY_MODULES],
+                            cwd=SRC, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='repetitions; the fastest run counts')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {}
+    failures = []
+    for statement in ('import main', 'import gui'):
+        runs = [import_times(statement) for _ in range(args.runs)]
+        modules, total = min(runs, key=lambda run: run[1])
+        results[statement] = total
+        slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:5]
+        results[statement + ' slowest'] = {name: value / 1000 for name, value in slowest}
+        heavy = [name for name in HEAVY_MODULES if name in modules]
+        if heavy:
+            failures.append(f"'{statement}' imports {', '.join(heavy)}")
+
+    frames = [frame for frame in (first_frame() for _ in range(args.runs)) if frame is not None]
+    if frames:
+        best = min(frames, key=lambda frame: frame['first frame'])
+        results['first frame'] = best['first frame']
+        results['ready'] = min(frame['ready'] for frame in frames)
+        if best['heavy']:
+            failures.append(f"{', '.join(best['heavy'])} imported before the first frame")
+    else:
+        print("No display available, time to first frame skipped.", file=sys.stderr)
+
+    for name, budget in BUDGETS.items():
+        if name in results and results[name] > budget:
+            failures.append(f"{name} took {results[name]:.0f} ms, budget {budget} ms")
+    results['failures'] = failures
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, value in results.items():
+            if isinstance(value, float):
+                print(f"{name:<14} {value:8.1f} ms  (budget {BUDGETS.get(name, '-')} ms)")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""Benchmark suite for the model, controller and export paths.
+
+Run from the repository root:
+
+    python benchmarks/bench_suite.py [--sizes 10k 100k 1M] [--repeat N] [--only TEXT ...]
+                                     [--skip TEXT ...] [--store] [--output FILE] [--compare FILE]
+
+Each size gets a fresh database in a temporary directory, filled with rows
+from synthetic.py. Every operation runs --repeat times and the fastest run
+counts; the bulk insert that fills the database runs once. The model's result
+cache is emptied before every run, so repeats measure the queries; --warm
+keeps it and measures cache hits instead. --only and --skip
+select operations whose name contains one of the given strings, e.g.
+--skip pdf for the 1M-row size. --store answers the reads from the
+ExpenseStore instead of SQL.
+
+Results are printed as a table. With --output they are also written as JSON,
+together with the git commit and the Python, SQLite and platform versions, so
+runs from different commits can be compared. --compare FILE prints the ratio of
+each time to the same operation in FILE and exits with status 1 if any is
+more than --tolerance slower.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from data import ExpenseModel  # noqa: E402
+from controller import ExpenseTrackerController  # noqa: E402
+from snapshot import Snapshot  # noqa: E402
+from synthetic import generate_expenses, parse_size  # noqa: E402
+
+DEFAULT_SIZES = ['10k', '100k', '1M']
+
+# Rows per write by the controller benchmarks, which run last so the reads see exactly `size` rows
+CONTROLLER_BULK_ROWS = 10000
+SINGLE_ADDS = 100
+
+
+def operations(controller, tmpdir):
+    """(name, callable) pairs; a callable returns the number of rows it handled, or None."""
+    path = lambda name: os.path.join(tmpdir, name)  # noqa: E731
+
+    def first_page():
+        return len(controller.get_expense_pages().page(limit=200))
+
+    def add_single():
+        for i in range(SINGLE_ADDS):
+            controller.add_expense(12.5, 'Dining', '2024-06-01', f'Benchmark {i}')
+        return SINGLE_ADDS
+
+    def open_snapshot():
+        # Per-category totals straight off the mapped columns
+        snapshot = Snapshot(path('snapshot'))
+        np.bincount(snapshot.category_ids, weights=np.nan_to_num(snapshot.amounts))
+        return snapshot.rows
+
+    def add_bulk():
+        rows = generate_expenses(CONTROLLER_BULK_ROWS, seed=1)
+        return controller.add_expenses_bulk(rows, batch_size=CONTROLLER_BULK_ROWS)[0]
+
+    return [
+        ('load first page', first_page),
+        ('load count', lambda: controller.get_expense_pages().count()),
+        ('load all', lambda: len(controller.load_expenses())),
+        ('filter category', lambda: len(controller.filter_expenses('Dining', '', '', '', ''))),
+        ('filter date range', lambda: len(controller.filter_expenses('All', '2023-01-01', '2023-03-31', '', ''))),
+        ('filter combined', lambda: len(controller.filter_expenses('Groceries', '2022-01-01', '2022-12-31', '20', '100'))),
+        ('search', lambda: len(controller.search_expenses('uber'))),
+        ('aggregate distribution', lambda: sum(controller.plot_expense_distribution().counts)),
+        ('aggregate distribution filtered',
+         lambda: sum(controller.plot_expense_distribution(start_date='2023-01-01', end_date='2023-12-31').counts)),
+        ('aggregate monthly', lambda: sum(controller.plot_monthly_expenses().counts)),
+        ('aggregate weekly by category', lambda: len(controller.get_expense_timeseries('week', by_category=True).periods)),
+        ('export csv', lambda: controller.export_to_csv(path('export.csv'))),
+        ('export csv gzip', lambda: controller.export_to_csv(path('export.csv.gz'))),
+        ('export pdf', lambda: controller.export_to_pdf(path('export.pdf'))),
+        ('export sqlite', lambda: controller.export_to_sqlite(path('export.db'))),
+        ('export sqlite filtered', lambda: controller.export_to_sqlite(path('filtered.db'), category='Dining')),
+        ('snapshot write', lambda: controller.refresh_snapshot(path('snapshot'), full=True)),
+        ('snapshot refresh', lambda: controller.refresh_snapshot(path('snapshot'))),
+        ('snapshot open', open_snapshot),
+        ('insert controller single', add_single),
+        ('insert controller bulk', add_bulk),
+    ]
+
+
+def selected(name, only, skip):
+    if only and not any(text in name for text in only):
+        return False
+    return not any(text in name for text in skip)
+
+
+def timed(fn, repeat, before=None):
+    """Run fn repeat times with its output silenced; return (best seconds, fn's result).
+
+    before, if given, runs ahead of every run, untimed.
+    """
+    best = result = None
+    for _ in range(repeat):
+        if before:
+            before()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_size(rows, args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = ExpenseModel(os.path.join(tmpdir, 'expenses.db'))
+        try:
+            # The database is filled either way; the fill is only reported when selected
+            seconds, _ = timed(lambda: model.add_expenses_bulk(generate_expenses(rows), batch_size=10000), 1)
+            if selected('insert model bulk', args.only, args.skip):
+                results['insert model bulk'] = {'seconds': seconds, 'rows': rows}
+                report(rows, 'insert model bulk', results['insert model bulk'])
+
+            controller = ExpenseTrackerController(model, use_store=args.store)
+            try:
+                for name, fn in operations(controller, tmpdir):
+                    if not selected(name, args.only, args.skip):
+                        continue
+                    # Writes change the data, so they run once
+                    repeat = 1 if name.startswith('insert') else args.repeat
+                    seconds, handled = timed(fn, repeat, None if args.warm else model.result_cache.clear)
+                    results[name] = {'seconds': seconds, 'rows': handled if isinstance(handled, int) else None}
+                    report(rows, name, results[name])
+            finally:
+                if controller.store is not None:
+                    controller.store.close()
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                model.close_connection()
+    return results
+
+
+def report(size, name, result):
+    line = f"{size:>9} rows  {name:<32} {result['seconds'] * 1000:10.1f} ms"
+    if result['rows'] and result['seconds']:
+        line += f"  {result['rows'] / result['seconds']:12.0f} rows/s"
+    print(line, flush=True)
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'store': args.store,
+        'warm': args.warm,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print every operation's ratio to baseline; return the ones beyond tolerance."""
+    regressions = []
+    for size, operations_ in results.items():
+        for name, result in operations_.items():
+            old = baseline.get('results', {}).get(size, {}).get(name)
+            if old is None or not old['seconds']:
+                continue
+            ratio = result['seconds'] / old['seconds']
+            print(f"{size:>9} rows  {name:<32} x{ratio:5.2f}{'  SLOWER' if ratio > 1 + tolerance else ''}")
+            if ratio > 1 + tolerance:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='row counts, e.g. 10k 100k 1M')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per read operation; the fastest counts')
+    parser.add_argument('--only', nargs='+', default=[], help='run only operations whose name contains one of these')
+    parser.add_argument('--skip', nargs='+', default=[], help='skip operations whose name contains one of these')
+    parser.add_argument('--store', action='store_true', help='answer reads from the columnar ExpenseStore')
+    parser.add_argument('--warm', action='store_true', help="keep the model's result cache between runs")
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown in --compare, 0.2 = 20%%')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        rows = parse_size(size)
+        results[str(rows)] = run_size(rows, args)
+
+    document = {'meta': metadata(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {baseline.get('meta', {}).get('commit')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        for size, name, ratio in regressions:
+            print(f"FAIL: {name} at {size} rows is {ratio:.2f}x slower")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""Deterministic synthetic expenses for the benchmarks.
+
+Rows look like what the app stores: a handful of categories with their own
+share of the expenses, amount range and merchants; dates spread over several
+years with more spending on weekends and in December; descriptions built from
+a merchant and a short note, so full-text search has realistic words to match.
+The same seed and row count always give the same rows.
+"""
+import random
+from datetime import date, timedelta
+
+# name: (share of expenses, median amount, merchants)
+CATEGORIES = {
+    'Groceries': (0.22, 45.0, ['Aldi', 'Lidl', 'Tesco', 'Whole Foods', 'Farmers Market']),
+    'Dining': (0.16, 25.0, ['Pizza Place', 'Sushi Bar', 'Cafe Central', 'Burger Joint', 'Uber Eats']),
+    'Transport': (0.14, 15.0, ['Uber', 'Metro', 'Shell', 'Parking', 'Train']),
+    'Utilities': (0.06, 90.0, ['Electricity', 'Water', 'Internet', 'Phone', 'Gas']),
+    'Rent': (0.02, 1200.0, ['Landlord']),
+    'Entertainment': (0.10, 30.0, ['Cinema', 'Netflix', 'Concert', 'Spotify', 'Bowling']),
+    'Shopping': (0.12, 60.0, ['Amazon', 'Ikea', 'Zara', 'Apple Store', 'Decathlon']),
+    'Health': (0.06, 40.0, ['Pharmacy', 'Dentist', 'Gym', 'Clinic']),
+    'Education': (0.04, 80.0, ['Bookshop', 'Online Course', 'School Supplies']),
+    'Insurance': (0.02, 150.0, ['Car Insurance', 'Health Insurance', 'Home Insurance']),
+    'Travel': (0.06, 250.0, ['Airline', 'Hotel', 'Airbnb', 'Car Rental']),
+}
+
+NOTES = ['weekly', 'monthly', 'with friends', 'gift', 'refill', 'subscription', 'trip', 'family',
+         'lunch', 'dinner', 'home', 'work', 'ride', 'order', 'repair', 'tickets']
+
+FIRST_DAY = date(2020, 1, 1)
+DAYS = 5 * 365
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000, '2500' -> 2500."""
+    text = text.strip().lower()
+    factor = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor != 1 else text) * factor)
+
+
+def generate_expenses(rows, seed=0):
+    """Yield rows (amount, category, 'YYYY-MM-DD' date, description) lazily."""
+    rng = random.Random(f'{seed}:{rows}')
+    names = list(CATEGORIES)
+    weights = [CATEGORIES[name][0] for name in names]
+    days = [FIRST_DAY + timedelta(days=offset) for offset in range(DAYS)]
+    # Weekends count double, December half as much again
+    day_weights = [(2.0 if day.weekday() >= 5 else 1.0) * (1.5 if day.month == 12 else 1.0) for day in days]
+    dates = [day.isoformat() for day in days]
+
+    chunk = 10000
+    for start in range(0, rows, chunk):
+        count = min(chunk, rows - start)
+        for category, day in zip(rng.choices(names, weights, k=count), rng.choices(dates, day_weights, k=count)):
+            _, median, merchants = CATEGORIES[category]
+            amount = round(median * rng.lognormvariate(0, 0.6), 2)
+            yield amount, category, day, f'{rng.choice(merchants)} {rng.choice(NOTES)}'
@@ -1,3 +1,14 @@
-from .gui import ExpenseTrackerView
-from .controller import ExpenseTrackerController
-from .data import ExpenseModel
\ No newline at end of file
+# Resolved on first access, so importing the package (the test runner does)
+# does not pull in Tk, the theme and calendar widgets or the database layer
+_EXPORTS = {
+    'ExpenseTrackerView': 'gui',
+    'ExpenseTrackerController': 'controller',
+    'ExpenseModel': 'data',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    return getattr(import_module('.' + _EXPORTS[name], __name__), name)
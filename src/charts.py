@@ -0,0 +1,144 @@
+"""The chart panel of the Reports tab, and downsampling for long time series.
+
+Imported when the first chart is shown: matplotlib takes a while to load.
+One Figure and canvas serve every chart for the life of the window, so
+opening charts repeatedly does not use more memory, and time series are
+cut down to at most max_points points before drawing, so a redraw costs
+about the same for a month of daily totals as for ten years of them.
+"""
+from tkinter import ttk
+
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter, MaxNLocator
+
+from reports import TimeSeries
+
+# Most points a time series is drawn with; about one per horizontal pixel of the canvas
+MAX_POINTS = 800
+
+# datetime64 unit and step between consecutive periods of each reports.BUCKETS
+PERIOD_STEPS = {'day': ('D', 1), 'week': ('D', 7), 'month': ('M', 1), 'year': ('Y', 1)}
+
+TITLES = {
+    'day': 'Daily Expenses',
+    'week': 'Weekly Expenses',
+    'month': 'Monthly Expenses',
+    'year': 'Yearly Expenses',
+}
+
+
+def lttb(y, threshold):
+    """Indices of the points of y that Largest-Triangle-Three-Buckets keeps.
+
+    y is plotted against its index. The first and last points are always
+    kept; the points in between are split into threshold - 2 equal buckets
+    and from each the one forming the largest triangle with the point kept
+    from the previous bucket and the average of the next bucket is chosen.
+    That preserves peaks and dips, which averaging would flatten.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    x = np.arange(n, dtype=float)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+
+    # Bucket i covers [edges[i], edges[i + 1]); the last one ends before the final point
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        keep[i + 1] = previous
+    return keep
+
+
+def fill_periods(series):
+    """series with the periods between its first and last that had no expenses added, at zero.
+
+    The chart's x axis is the index into the periods, so without them a gap
+    of months would be drawn as narrow as a single month.
+    """
+    if len(series.periods) < 2 or series.bucket not in PERIOD_STEPS:
+        return series
+    unit, step = PERIOD_STEPS[series.bucket]
+    try:
+        known = np.array(series.periods, dtype=f'datetime64[{unit}]')
+    except ValueError:
+        return series
+    index = (known - known[0]).astype(np.int64) // step
+    totals = np.zeros(int(index[-1]) + 1)
+    counts = np.zeros(len(totals), dtype=np.int64)
+    totals[index] = series.totals
+    counts[index] = series.counts
+    periods = known[0] + np.arange(len(totals)) * np.timedelta64(step, unit)
+    return TimeSeries(series.bucket, np.datetime_as_string(periods).tolist(), totals.tolist(), counts.tolist())
+
+
+class ChartPanel(ttk.Frame):
+    """A matplotlib canvas showing a reports.Distribution or a reports.TimeSeries.
+
+    A time series is a single line, updated in place from one series to the
+    next; a distribution is a pie, redrawn since its number of wedges varies.
+    """
+
+    def __init__(self, parent, max_points=MAX_POINTS):
+        super().__init__(parent)
+        self.max_points = max_points
+        self.periods = []
+        self.line = None
+
+        self.figure = Figure(figsize=(8, 4.5), layout='constrained')
+        self.axes = self.figure.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().grid(row=0, column=0, sticky='nsew')
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+    def show_distribution(self, distribution):
+        self.line = None
+        self.axes.clear()
+        pie = distribution.positive()
+        if pie.labels:
+            self.axes.pie(pie.totals, labels=pie.labels, autopct='%1.1f%%', startangle=140)
+            self.axes.set_aspect('equal')
+        else:
+            self.axes.text(0.5, 0.5, 'No expenses', ha='center', va='center', transform=self.axes.transAxes)
+            self.axes.set_axis_off()
+        self.axes.set_title('Expense Distribution by Category')
+        self.canvas.draw_idle()
+
+    def show_timeseries(self, series):
+        if self.line is None:
+            self.axes.clear()
+            # A pie drawn before left the aspect equal, which squashes a line chart
+            self.axes.set_aspect('auto')
+            self.line, = self.axes.plot([], [], linewidth=1.2, marker='.', markersize=3)
+            # Ticks at whole periods only, labelled with the period's name
+            self.axes.xaxis.set_major_locator(MaxNLocator(nbins=10, integer=True))
+            self.axes.xaxis.set_major_formatter(FuncFormatter(self.period_label))
+            self.axes.tick_params(axis='x', labelrotation=30)
+            self.axes.set_ylabel('Total Expenses')
+
+        series = fill_periods(series)
+        keep = lttb(series.totals, self.max_points)
+        self.periods = series.periods
+        self.line.set_data(keep, np.asarray(series.totals, dtype=float)[keep])
+        self.axes.set_title(TITLES.get(series.bucket, 'Expenses'))
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.canvas.draw_idle()
+
+    def period_label(self, position, _):
+        index = int(round(position))
+        return self.periods[index] if 0 <= index < len(self.periods) else ''
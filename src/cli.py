@@ -0,0 +1,312 @@
+# src/cli.py
+"""Command-line interface for scripted and batch work, no display needed.
+
+    python src/cli.py [--db PATH] [--json] [--verbose] COMMAND ...
+    python -m src.cli ...
+
+Commands:
+    add AMOUNT CATEGORY [--date D] [--description TEXT]
+    bulk-import FILE                       CSV, gzipped CSV or SQLite export
+    filter [FILTERS] [--search QUERY] [--limit N]
+    report {distribution,monthly,timeseries} [FILTERS] [--bucket B] [--by-category] [--chart FILE]
+    export {csv,pdf,sqlite} FILE [FILTERS] [--incremental]
+    archive [YEAR ...] [--compact]         move past years to archive files, list the archives
+    snapshot DIR [--full]                  write or refresh a memory-mapped columnar snapshot
+
+FILTERS are --category, --start-date, --end-date, --min-amount and --max-amount.
+Results go to stdout as tab-separated lines, or one JSON object per line
+with --json, and are written as they are produced. Messages from the model go
+to stderr: always with --verbose, otherwise only when the command fails.
+Exit status is 0 on success, 1 on failure and 2 on bad arguments.
+--profile FILE writes the timings, counters and slow queries of the run (see
+instrumentation.py) to FILE.
+
+Only the model and controller are loaded; matplotlib is imported just for
+--chart and for PDF exports, tkinter never.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+from itertools import islice
+
+if __package__:
+    # Run as `python -m src.cli`: the modules import each other by their plain names
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from controller import ExpenseTrackerController
+import instrumentation
+from reports import CategoryTimeSeries, Distribution
+
+# Rows fetched per query while streaming filter results
+PAGE_SIZE = 1000
+
+EXPENSE_FIELDS = ('id', 'amount', 'category', 'date', 'description')
+# Search results are keyed by their position in the ranking instead of the id
+SEARCH_FIELDS = ('rank', 'amount', 'category', 'date', 'description')
+
+
+class Output:
+    """Writes records to a stream as tab-separated values or JSON lines."""
+
+    def __init__(self, stream, json_lines=False):
+        self.stream = stream
+        self.json_lines = json_lines
+
+    def write(self, record):
+        if self.json_lines:
+            line = json.dumps(record, ensure_ascii=False)
+        else:
+            line = '\t'.join(self.format(value) for value in record.values())
+        self.stream.write(line + '\n')
+
+    @staticmethod
+    def format(value):
+        if value is None:
+            return ''
+        if isinstance(value, float):
+            return f'{value:.2f}'
+        return str(value)
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--category', help='only this category')
+    parser.add_argument('--start-date', help='first date, YYYY-MM-DD')
+    parser.add_argument('--end-date', help='last date, YYYY-MM-DD')
+    parser.add_argument('--min-amount', type=float, help='smallest amount')
+    parser.add_argument('--max-amount', type=float, help='largest amount')
+
+
+def filters_of(args):
+    return {'category': args.category, 'start_date': args.start_date, 'end_date': args.end_date,
+            'min_amount': args.min_amount, 'max_amount': args.max_amount}
+
+
+def stream_pages(pages, page_size=PAGE_SIZE):
+    """Yield every row of an ExpensePages or SearchPages, one page query at a time."""
+    key = None
+    while True:
+        rows = pages.page(after_key=key, limit=page_size)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        key = rows[-1][0]
+
+
+def cmd_add(controller, args, out):
+    # Both raise ValueError for invalid input, reported by main()
+    date = controller.validate_date(args.date or '')
+    if not controller.add_expense(args.amount, args.category, date, args.description):
+        return 1
+    out.write({'amount': float(args.amount), 'category': args.category, 'date': date,
+               'description': args.description})
+    return 0
+
+
+def cmd_bulk_import(controller, args, out):
+    result = controller.import_expenses(args.file)
+    if result is None:
+        return 1
+    for error in result.errors:
+        out.write({'error': error.message, 'index': error.index, 'row': list(error.row)})
+    out.write({'imported': result.imported, 'duplicates': result.duplicates, 'rejected': len(result.errors)})
+    return 0
+
+
+def cmd_filter(controller, args, out):
+    filters = filters_of(args)
+    if args.search:
+        pages, fields = controller.get_search_pages(args.search, **filters), SEARCH_FIELDS
+    else:
+        pages, fields = controller.get_expense_pages(**filters), EXPENSE_FIELDS
+    for row in islice(stream_pages(pages), args.limit):
+        out.write(dict(zip(fields, row)))
+    return 0
+
+
+def cmd_report(controller, args, out):
+    filters = filters_of(args)
+    if args.kind == 'distribution':
+        report = controller.plot_expense_distribution(**filters)
+    elif args.kind == 'monthly':
+        report = controller.plot_monthly_expenses(**filters)
+    else:
+        report = controller.get_expense_timeseries(args.bucket, args.by_category, **filters)
+    if report is None:
+        return 1
+
+    if isinstance(report, Distribution):
+        for label, total, count, share in zip(report.labels, report.totals, report.counts, report.shares()):
+            out.write({'category': label, 'total': total, 'count': count, 'share': share})
+    elif isinstance(report, CategoryTimeSeries):
+        for category, series in zip(report.categories, report.totals):
+            for period, total in zip(report.periods, series):
+                out.write({'period': period, 'category': category, 'total': total})
+    else:
+        for period, total, count in zip(report.periods, report.totals, report.counts):
+            out.write({'period': period, 'total': total, 'count': count})
+
+    if args.chart:
+        write_chart(args.chart, report)
+    return 0
+
+
+def cmd_export(controller, args, out):
+    filters = filters_of(args)
+    if args.format == 'csv':
+        count = controller.export_to_csv(args.file, **filters)
+    elif args.format == 'pdf':
+        count = controller.export_to_pdf(args.file, **filters)
+    else:
+        count = controller.export_to_sqlite(args.file, incremental=args.incremental, **filters)
+    if count is None:
+        return 1
+    out.write({'format': args.format, 'file': args.file, 'rows': count})
+    return 0
+
+
+def cmd_archive(controller, args, out):
+    for year in args.years:
+        if controller.archive_year(year) is None:
+            return 1
+    if args.compact:
+        controller.compact_archives()
+    for archive in controller.get_archives():
+        out.write({'year': archive.year, 'file': archive.file, 'rows': archive.rows, 'bytes': archive.size})
+    return 0
+
+
+def cmd_snapshot(controller, args, out):
+    from snapshot import Snapshot
+
+    written = controller.refresh_snapshot(args.directory, full=args.full)
+    if written is None:
+        return 1
+    snapshot = Snapshot(args.directory)
+    out.write({'directory': args.directory, 'rows': snapshot.rows, 'written': written, 'last_id': snapshot.last_id})
+    return 0
+
+
+def write_chart(file_path, report):
+    """Draw report into an image file; its type follows the file's extension."""
+    # A bare Figure needs neither pyplot nor a GUI backend, so this works without a display
+    from matplotlib.figure import Figure
+    from pdf_report import MAX_TICK_LABELS
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    if isinstance(report, Distribution):
+        pie = report.positive()
+        if pie.labels:
+            ax.pie(pie.totals, labels=pie.labels, autopct='%1.1f%%', startangle=140)
+            ax.axis('equal')
+        else:
+            ax.text(0.5, 0.5, 'No expenses', ha='center', va='center', transform=ax.transAxes)
+            ax.set_axis_off()
+        ax.set_title('Expense Distribution by Category')
+    else:
+        positions = range(len(report.periods))
+        if isinstance(report, CategoryTimeSeries):
+            for category, series in zip(report.categories, report.totals):
+                ax.plot(positions, series, label=category)
+            ax.legend(fontsize='small')
+        else:
+            ax.bar(positions, report.totals)
+        step = max(1, -(-len(positions) // MAX_TICK_LABELS))
+        ax.set_xticks(positions[::step], report.periods[::step], rotation=45, ha='right')
+        ax.set_title(f'Expenses per {report.bucket}')
+        ax.set_ylabel('Total Expenses')
+    fig.tight_layout()
+    fig.savefig(file_path)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Expense Tracker without the window.')
+    parser.add_argument('--db', help="database file, 'file:' URI or ':memory:' "
+                                     "(default: $EXPENSE_TRACKER_DB, then data/expenses.db)")
+    parser.add_argument('--json', action='store_true', help='write one JSON object per line')
+    parser.add_argument('--verbose', action='store_true', help='pass messages from the model on to stderr')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='time the command and write the timings, counters and slow queries to FILE '
+                             '(JSON), or cProfile stats if FILE ends in .prof')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='add one expense')
+    add.add_argument('amount')
+    add.add_argument('category')
+    add.add_argument('--date', help='YYYY-MM-DD, default today')
+    add.add_argument('--description', default='')
+    add.set_defaults(run=cmd_add)
+
+    bulk_import = commands.add_parser('bulk-import', help='merge a CSV or SQLite export, skipping duplicates')
+    bulk_import.add_argument('file')
+    bulk_import.set_defaults(run=cmd_bulk_import)
+
+    filter_ = commands.add_parser('filter', help='list expenses')
+    add_filter_arguments(filter_)
+    filter_.add_argument('--search', help='full-text query; results come best match first')
+    filter_.add_argument('--limit', type=int, help='stop after this many rows')
+    filter_.set_defaults(run=cmd_filter)
+
+    report = commands.add_parser('report', help='totals per category or period')
+    report.add_argument('kind', choices=['distribution', 'monthly', 'timeseries'])
+    add_filter_arguments(report)
+    report.add_argument('--bucket', default='month', choices=['day', 'week', 'month', 'year'],
+                        help='period of a timeseries')
+    report.add_argument('--by-category', action='store_true', help='split a timeseries by category')
+    report.add_argument('--chart', help='also draw the report into this image file (.png, .svg, ...)')
+    report.set_defaults(run=cmd_report)
+
+    export = commands.add_parser('export', help='write expenses to a file')
+    export.add_argument('format', choices=['csv', 'pdf', 'sqlite'])
+    export.add_argument('file')
+    add_filter_arguments(export)
+    export.add_argument('--incremental', action='store_true',
+                        help='sqlite: only append expenses newer than those already in the file')
+    export.set_defaults(run=cmd_export)
+
+    archive = commands.add_parser('archive', help='move past years into archive files, then list the archives')
+    archive.add_argument('years', metavar='YEAR', nargs='*', type=int, help='year to archive')
+    archive.add_argument('--compact', action='store_true', help='also rewrite the archive files without unused space')
+    archive.set_defaults(run=cmd_archive)
+
+    snapshot = commands.add_parser('snapshot', help='write or refresh a memory-mapped columnar snapshot')
+    snapshot.add_argument('directory', help='directory of the snapshot')
+    snapshot.add_argument('--full', action='store_true', help='write the whole snapshot anew')
+    snapshot.set_defaults(run=cmd_snapshot)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = Output(sys.stdout, json_lines=args.json)
+    if args.profile:
+        instrumentation.enable(profile=args.profile.endswith('.prof'))
+
+    # The model reports through print(); keep that off stdout, which carries the results
+    log = sys.stderr if args.verbose else io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            controller = ExpenseTrackerController(db_file=args.db)
+            try:
+                status = args.run(controller, args, out)
+            except ValueError as e:
+                print(f"Error: {e}")
+                status = 1
+            finally:
+                controller.model.close_connection()
+    except BrokenPipeError:
+        # The reader went away (e.g. `| head`); stop quietly
+        sys.stdout = open(os.devnull, 'w')
+        return 0
+    if args.profile:
+        instrumentation.dump(args.profile)
+    if status and not args.verbose:
+        sys.stderr.write(log.getvalue())
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,96 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-from tkinter import filedialog
-from data import ExpenseModel
+from data import ExpenseModel, DATE_FORMAT, DEFAULT_BATCH_SIZE, DEFAULT_PAGE_SIZE, RowError, read_expenses_csv
+from events import EventBus, CategoryEvent, ExpenseEvent, CATEGORIES, EXPENSES
+from itertools import islice
 from datetime import datetime, date
 import sqlite3
+import instrumentation
 
+class ExpensePages:
+    """Keyset-paginated expenses matching a fixed set of filters.
+
+    Rows are (id, amount, category, date, description) tuples in id order; the
+    id is the key used to continue from one page to the next.
+    """
+
+    def __init__(self, model, filters=None):
+        self.model = model
+        self.filters = filters or {}
+
+    def count(self):
+        return self.model.count_expenses(**self.filters)
+
+    def page(self, after_key=None, before_key=None, limit=DEFAULT_PAGE_SIZE):
+        return self.model.get_expenses_page(after_key, before_key, limit, **self.filters)
+
+    def key_at(self, offset):
+        return self.model.get_expense_id_at(offset, **self.filters)
+
+
+class SearchPages:
+    """Full-text search results, best match first, paged like ExpensePages.
+
+    Rows are (position, amount, category, date, description) tuples; the
+    position in the ranking is the key used to continue from one page to the next.
+    """
+
+    def __init__(self, model, query, filters=None):
+        self.model = model
+        self.query = query
+        self.filters = filters or {}
+
+    def count(self):
+        return self.model.count_search_results(self.query, **self.filters)
+
+    def page(self, after_key=None, before_key=None, limit=DEFAULT_PAGE_SIZE):
+        if before_key is not None:
+            start = max(0, before_key - limit)
+            limit = before_key - start
+        else:
+            start = 0 if after_key is None else after_key + 1
+        rows = self.model.search_expenses(self.query, limit, start, **self.filters)
+        return [(start + index,) + tuple(row) for index, row in enumerate(rows)]
+
+    def key_at(self, offset):
+        return offset
+
+
+@instrumentation.instrumented
 class ExpenseTrackerController:
-    def __init__(self):
-        self.model = ExpenseModel()
+    def __init__(self, model=None, use_store=False, db_file=None, snapshot_dir=None):
+        # Without a model, one is opened on db_file: a path, a 'file:' URI or
+        # ':memory:', by default $EXPENSE_TRACKER_DB or data/expenses.db
+        self.model = model if model is not None else ExpenseModel(db_file)
+        # Category and expense changes are published here, with what changed,
+        # so views can patch themselves instead of reloading
+        self.events = EventBus()
+        # Opt-in columnar cache answering loads, filters and charts with NumPy,
+        # mapped from a snapshot in snapshot_dir if given
+        self.store = None
+        if use_store:
+            from store import ExpenseStore
+            self.store = ExpenseStore(self.model, snapshot_dir=snapshot_dir)
+
+    @property
+    def queries(self):
+        """The ExpenseStore when enabled, otherwise the model; both answer the same read queries."""
+        return self.store if self.store is not None else self.model
+
+    @property
+    def db_file(self):
+        """Path of the database, for jobs that open their own connection in another process."""
+        return self.model.db_file
+
+    @property
+    def in_memory(self):
+        """Whether the database only lives in this process, so other processes can't open db_file."""
+        return self.model.in_memory
         
     def validate_date(self, date_str):
         """
         Validate and normalize the date format to '%Y-%m-%d'.
         
         Args:
-        - date_str (str): Date string in format '%Y-%m-%d'.
+        - date_str (str or date): Date string in format '%Y-%m-%d', or a date object.
         
         Returns:
         - str: Validated date string in format '%Y-%m-%d'.
@@ -23,12 +99,36 @@ class ExpenseTrackerController:
         - ValueError: If date format is not valid.
         """
         if not date_str:
-            return datetime.today().date().strftime("%m/%d/%Y")  # Default to today's date if empty
+            return datetime.today().date().strftime(DATE_FORMAT)  # Default to today's date if empty
+
+        if isinstance(date_str, date):
+            return date_str.strftime(DATE_FORMAT)
 
         try:
-            return datetime.strptime(date_str, '%m/%d/%Y').date().strftime("%m/%d/%Y")
-        except ValueError:
-            raise ValueError("Date format is not valid. It should be in YYYY/MM/DD format.")
+            return datetime.strptime(date_str, DATE_FORMAT).date().strftime(DATE_FORMAT)
+        except (TypeError, ValueError):
+            raise ValueError("Date format is not valid. It should be in YYYY-MM-DD format.")
+
+    def validate_expense(self, amount, category, date_str, description):
+        """
+        Validate one expense and return it in the form stored by the model.
+        
+        Args:
+        - amount (str or float): Amount of the expense.
+        - category (str): Category of the expense.
+        - date_str (str): Date of the expense in format '%Y-%m-%d'.
+        - description (str): Description of the expense.
+        
+        Returns:
+        - tuple: (amount, category, date, description) with amount as float and date normalized.
+        
+        Raises:
+        - ValueError: If any required field is missing or if amount or date is not valid.
+        """
+        if not (amount and category and date_str):
+            raise ValueError("All fields except description are required.")
+
+        return float(amount), category, self.validate_date(date_str), description or ''
 
     def add_expense(self, amount, category, date_str, description):
         """
@@ -40,23 +140,27 @@ class ExpenseTrackerController:
         - date_str (str): Date of the expense in format '%Y-%m-%d'.
         - description (str): Description of the expense.
         
+        Returns:
+        - bool: True if the expense was stored, False if the database rejected it.
+        
         Raises:
         - ValueError: If any required field is missing or if amount is not numeric.
         - Exception: For any unexpected errors during the addition of expense.
         """
         try:
-            # Validate inputs
-            if not (amount and category and date_str):
-                raise ValueError("All fields except description are required.")
-
-            # Convert amount to float (if it's not already)
-            amount = float(amount)
-
-            # Validate and normalize date format
-            date = self.validate_date(date_str)
+            # Validate inputs, convert amount to float and normalize date format
+            expense = self.validate_expense(amount, category, date_str, description)
+            categories = self.get_categories()
 
-            # Add expense to model
-            self.model.add_expense(amount, category, date, description)
+            # Add expense to model; the store also appends it to its columns
+            if self.store is not None:
+                added = self.store.add_expense(*expense)
+            else:
+                added = self.model.add_expense(*expense)
+            if added:
+                self.publish_new_categories(categories)
+                self.events.publish(EXPENSES, ExpenseEvent('added', 1, [expense]))
+            return added
 
         except ValueError as ve:
             print(f"Error adding expense: {ve}")
@@ -66,11 +170,86 @@ class ExpenseTrackerController:
             print(f"Error adding expense: {e}")
             raise Exception("Unexpected error occurred while adding expense.")
 
+    def add_expenses_bulk(self, rows, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Validate and insert many expenses, one transaction per batch.
+        
+        Args:
+        - rows (iterable): (amount, category, date_str, description) tuples; consumed lazily.
+        - batch_size (int): Number of rows validated and written per transaction.
+        
+        Returns:
+        - tuple: (inserted_count, errors) where errors lists a RowError for every
+          rejected row, indexed by its position in rows.
+        """
+        inserted = 0
+        errors = []
+        categories = self.get_categories()
+        rows = iter(rows)
+        offset = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+
+            valid = []
+            positions = []
+            for position, row in enumerate(batch, start=offset):
+                try:
+                    valid.append(self.validate_expense(*row))
+                    positions.append(position)
+                except (TypeError, ValueError) as e:
+                    errors.append(RowError(position, row, str(e)))
+
+            count, batch_errors = self.model.add_expenses_bulk(valid, batch_size=len(valid) or 1)
+            inserted += count
+            errors.extend(RowError(positions[error.index], error.row, error.message) for error in batch_errors)
+            offset += len(batch)
+
+        errors.sort(key=lambda error: error.index)
+        if inserted:
+            self.publish_new_categories(categories)
+            self.events.publish(EXPENSES, ExpenseEvent('added', inserted))
+        return inserted, errors
+
+    def import_expenses_csv(self, file_path, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Stream expenses from a CSV file in the data/expenses.csv layout into the model.
+        
+        Args:
+        - file_path (str): Path of the CSV file to import.
+        - batch_size (int): Number of rows written per transaction.
+        
+        Returns:
+        - tuple: (inserted_count, errors) as returned by add_expenses_bulk. Error
+          indexes count data rows, so row n is on line n + 2 of the file.
+        """
+        return self.add_expenses_bulk(read_expenses_csv(file_path), batch_size)
 
+    def import_expenses(self, file_path, progress=None):
+        """
+        Merge a CSV or SQLite file written by the exporters, skipping expenses that are already present.
+        
+        Args:
+        - file_path (str): CSV (optionally gzip-compressed) or SQLite file to import.
+        - progress (callable): Called with the fraction imported so far.
         
+        Returns:
+        - ImportResult: Counts of imported and duplicate rows, and the RowErrors of rejected rows.
+        """
+        try:
+            categories = self.get_categories()
+            result = self.model.import_expenses(file_path, progress=progress)
+            if result is not None and result.imported:
+                self.publish_new_categories(categories)
+                self.events.publish(EXPENSES, ExpenseEvent('added', result.imported))
+            return result
+        except Exception as e:
+            print(f"Error importing expenses: {e}")
+
     def get_expenses(self):
         try:
-            return self.model.get_expenses()
+            return self.queries.get_expenses()
         except Exception as e:
             print(f"Error getting expenses: {e}")
             return []
@@ -91,78 +270,348 @@ class ExpenseTrackerController:
 
     def add_category(self, category):
         try:
-            self.model.add_category(category)
+            if self.model.add_category(category):
+                self.events.publish(CATEGORIES, CategoryEvent('added', category))
         except Exception as e:
             print(f"Error adding category: {e}")
 
-    def remove_category(self, category):
+    def rename_category(self, category, new_name):
+        try:
+            if self.model.rename_category(category, new_name):
+                self.events.publish(CATEGORIES, CategoryEvent('renamed', new_name, old_name=category))
+        except Exception as e:
+            print(f"Error renaming category: {e}")
+
+    def remove_category(self, category, replacement=None):
+        """
+        Remove a category.
+        
+        Args:
+        - category (str): Name of the category to remove.
+        - replacement (str): Category its expenses move to; None leaves them without a category.
+        """
         try:
-            self.model.remove_category(category)
+            categories = self.get_categories()
+            if self.model.remove_category(category, replacement):
+                self.publish_new_categories(categories)
+                self.events.publish(CATEGORIES, CategoryEvent('removed', category, replacement=replacement))
         except Exception as e:
             print(f"Error removing category: {e}")
+
+    def publish_new_categories(self, before):
+        """Publish an 'added' event for every category that is not in the list before."""
+        known = set(before)
+        for category in self.get_categories():
+            if category not in known:
+                self.events.publish(CATEGORIES, CategoryEvent('added', category))
             
     def load_expenses(self):
         try:
-            return self.model.get_expenses()
+            return self.queries.get_expenses()
         except Exception as e:
             print(f"Error loading expenses: {e}")
             return []
 
+    def validate_filters(self, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None):
+        """
+        Validate filter arguments and return them as keyword arguments for the model.
+        
+        Args:
+        - category (str): Category to match, or 'All'/empty for every category.
+        - start_date (str): Inclusive lower date bound in format '%Y-%m-%d', or empty.
+        - end_date (str): Inclusive upper date bound in format '%Y-%m-%d', or empty.
+        - min_amount (str or float): Inclusive lower amount bound, or empty.
+        - max_amount (str or float): Inclusive upper amount bound, or empty.
+        
+        Returns:
+        - dict: Normalized filters; bounds that were left empty are None.
+        
+        Raises:
+        - ValueError: If a date or amount bound is not valid.
+        """
+        return {
+            'category': category if category and category != 'All' else None,
+            'start_date': self.validate_date(start_date) if start_date else None,
+            'end_date': self.validate_date(end_date) if end_date else None,
+            'min_amount': float(min_amount) if min_amount not in (None, '') else None,
+            'max_amount': float(max_amount) if max_amount not in (None, '') else None,
+        }
+
     def filter_expenses(self, category, start_date, end_date, min_amount, max_amount):
+        """
+        Return expenses matching the given filters, evaluated by the database or the ExpenseStore.
+        
+        Args: see validate_filters.
+        
+        Returns:
+        - list: Matching (amount, category, date, description) rows.
+        """
         try:
-            expenses = self.model.get_expenses()
-
-            # Filter by category
-            if category and category != 'All':
-                expenses = [expense for expense in expenses if expense[2] == category]
+            # Validate the bounds once here instead of parsing every row
+            filters = self.validate_filters(category, start_date, end_date, min_amount, max_amount)
+            return self.queries.filter_expenses(**filters)
+        except Exception as e:
+            print(f"Error filtering expenses: {e}")
+            return []
 
-            # Filter by date range
-            if start_date:
-                start_date = datetime.strptime(start_date, '%Y-%m-%d')
-                expenses = [expense for expense in expenses if datetime.strptime(expense[3], '%Y-%m-%d') >= start_date]
+    def get_expense_pages(self, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None):
+        """
+        Return a paged view of the expenses matching the given filters.
+        
+        Args: see validate_filters.
+        
+        Returns:
+        - ExpensePages: Source of keyset-paginated rows for a VirtualTreeview.
+        
+        Raises:
+        - ValueError: If a date or amount bound is not valid.
+        """
+        return ExpensePages(self.model, self.validate_filters(category, start_date, end_date, min_amount, max_amount))
 
-            if end_date:
-                end_date = datetime.strptime(end_date, '%Y-%m-%d')
-                expenses = [expense for expense in expenses if datetime.strptime(expense[3], '%Y-%m-%d') <= end_date]
+    def search_expenses(self, query, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None,
+                        limit=DEFAULT_PAGE_SIZE):
+        """
+        Search descriptions and categories, e.g. 'uber' for every Uber ride.
+        
+        Args:
+        - query (str): Words to look for; each matches any word it is a prefix of.
+        - limit (int): Maximum number of rows returned.
+        - other arguments: see validate_filters.
+        
+        Returns:
+        - list: Matching (amount, category, date, description) rows, best match first.
+        
+        Raises:
+        - ValueError: If a date or amount bound is not valid.
+        """
+        filters = self.validate_filters(category, start_date, end_date, min_amount, max_amount)
+        return self.model.search_expenses(query, limit, **filters)
 
-            # Filter by amount range
-            if min_amount:
-                expenses = [expense for expense in expenses if expense[1] >= float(min_amount)]
+    def get_search_pages(self, query, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None):
+        """
+        Return a paged view of the search results for query, for a VirtualTreeview.
+        
+        Args: see search_expenses.
+        
+        Returns:
+        - SearchPages: Source of ranked rows.
+        """
+        return SearchPages(self.model, query, self.validate_filters(category, start_date, end_date, min_amount, max_amount))
 
-            if max_amount:
-                expenses = [expense for expense in expenses if expense[1] <= float(max_amount)]
+    def get_category_totals(self):
+        """
+        Return precomputed (category, total, count) rows from the summary tables.
+        """
+        try:
+            return self.model.get_category_totals()
+        except Exception as e:
+            print(f"Error getting category totals: {e}")
+            return []
 
-            return expenses
+    def get_monthly_totals(self):
+        """
+        Return precomputed ('YYYY-MM', total, count) rows from the summary tables.
+        """
+        try:
+            return self.model.get_monthly_totals()
         except Exception as e:
-            print(f"Error filtering expenses: {e}")
+            print(f"Error getting monthly totals: {e}")
             return []
 
-    def plot_expense_distribution(self):
+    def check_summaries(self):
+        """
+        Compare the summary tables with a full scan of the expenses.
+        
+        Returns:
+        - list: (table, key, stored, expected) for every inconsistent entry; empty when consistent.
+        """
+        try:
+            return self.model.check_summaries()
+        except Exception as e:
+            print(f"Error checking summaries: {e}")
+            raise
+
+    def rebuild_summaries(self):
+        try:
+            self.model.rebuild_summaries()
+        except Exception as e:
+            print(f"Error rebuilding summaries: {e}")
+
+    def plot_expense_distribution(self, **filters):
+        """
+        Return the data behind the expense distribution chart.
+        
+        Args:
+        - filters: Optional keyword arguments of validate_filters.
+        
+        Returns:
+        - reports.Distribution: Totals and counts per category, largest first.
+        """
         try:
-            return self.model.plot_expense_distribution()
+            return self.queries.plot_expense_distribution(**self.validate_filters(**filters))
         except Exception as e:
             print(f"Error plotting expense distribution: {e}")
 
-    def plot_monthly_expenses(self):
+    def plot_monthly_expenses(self, **filters):
+        """
+        Return the data behind the monthly expenses chart.
+        
+        Args:
+        - filters: Optional keyword arguments of validate_filters.
+        
+        Returns:
+        - reports.TimeSeries: Totals and counts per 'YYYY-MM' month.
+        """
         try:
-            return self.model.plot_monthly_expenses()
+            return self.queries.plot_monthly_expenses(**self.validate_filters(**filters))
         except Exception as e:
             print(f"Error plotting monthly expenses: {e}")
 
-    def export_to_csv(self, file_path):
+    def get_expense_timeseries(self, bucket='month', by_category=False, **filters):
+        """
+        Return spending over time.
+        
+        Args:
+        - bucket (str): 'day', 'week', 'month' or 'year'.
+        - by_category (bool): Split every period by category.
+        - filters: Optional keyword arguments of validate_filters.
+        
+        Returns:
+        - reports.TimeSeries, or reports.CategoryTimeSeries when by_category is set.
+        
+        Raises:
+        - ValueError: If the bucket or a filter is not valid.
+        """
+        return self.queries.get_expense_timeseries(bucket, by_category, **self.validate_filters(**filters))
+
+    def export_to_csv(self, file_path, compress=None, progress=None, **filters):
+        """
+        Stream the expenses, or only those matching filters, to a CSV file.
+        
+        Args:
+        - file_path (str): Destination; a '.gz' suffix writes gzip unless compress says otherwise.
+        - compress (bool): Force gzip output on or off.
+        - progress (callable): Called with the fraction of rows written so far.
+        - filters: Optional keyword arguments of validate_filters.
+        
+        Returns:
+        - int: Number of rows written.
+        """
         try:
-            return self.model.export_to_csv(file_path)
+            return self.model.export_to_csv(file_path, compress=compress, progress=progress,
+                                            **self.validate_filters(**filters))
         except Exception as e:
             print(f"Error exporting to CSV: {e}")
 
-    def export_to_pdf(self, file_path):
+    def export_to_pdf(self, file_path, progress=None, **filters):
+        """
+        Write a PDF report of the expenses, or only those matching filters.
+        
+        Args:
+        - file_path (str): Destination PDF file.
+        - progress (callable): Called with the fraction of rows written so far.
+        - filters: Optional keyword arguments of validate_filters.
+        
+        Returns:
+        - int: Number of expenses in the report.
+        """
         try:
-            return self.model.export_to_pdf(file_path)
+            return self.model.export_to_pdf(file_path, progress=progress, **self.validate_filters(**filters))
         except Exception as e:
             print(f"Error exporting to PDF: {e}")
 
-    def export_to_sqlite(self, file_path):
+    def export_to_sqlite(self, file_path, incremental=False, progress=None, **filters):
+        """
+        Copy the expenses, or only those matching filters, into a SQLite file.
+        
+        Args:
+        - file_path (str): Destination database file.
+        - incremental (bool): Append only expenses newer than those already in file_path.
+        - progress (callable): Called with the fraction copied so far.
+        - filters: Optional keyword arguments of validate_filters.
+        
+        Returns:
+        - int: Number of expenses copied.
+        """
         try:
-            return self.model.export_to_sqlite(file_path)
+            return self.model.export_to_sqlite(file_path, incremental=incremental, progress=progress,
+                                               **self.validate_filters(**filters))
         except Exception as e:
             print(f"Error exporting to SQLite: {e}")
+
+    def save_database(self, file_path, progress=None):
+        """
+        Save the whole database, e.g. an in-memory session, to a SQLite file in one step.
+        
+        Args:
+        - file_path (str): Destination database file, replaced if it exists.
+        - progress (callable): Called with the fraction copied so far.
+        
+        Returns:
+        - int: Number of expenses saved.
+        """
+        try:
+            return self.model.backup_to(file_path, progress)
+        except Exception as e:
+            print(f"Error saving database: {e}")
+
+    def archive_year(self, year):
+        """
+        Move the expenses of a past year out of the database into an archive file.
+        
+        The archived expenses stay visible to every query; see ExpenseModel.archive_year.
+        
+        Args:
+        - year (int): Year to archive; the current year can't be archived.
+        
+        Returns:
+        - int: Number of expenses archived, or None if the year could not be archived.
+        """
+        try:
+            return self.model.archive_year(year)
+        except Exception as e:
+            print(f"Error archiving expenses: {e}")
+
+    def get_archives(self):
+        """
+        List the archived years.
+        
+        Returns:
+        - list: data.Archive tuples of year, file, schema, rows and size in bytes, oldest first.
+        """
+        try:
+            return self.model.get_archives()
+        except Exception as e:
+            print(f"Error listing archives: {e}")
+            return []
+
+    def compact_archives(self):
+        """
+        Rewrite the archive files without unused space.
+        
+        Returns:
+        - int: Number of bytes saved.
+        """
+        try:
+            return self.model.compact_archives()
+        except Exception as e:
+            print(f"Error compacting archives: {e}")
+
+    def refresh_snapshot(self, directory, full=False):
+        """
+        Write the expenses to a memory-mapped columnar snapshot, or bring an existing one up to date.
+        
+        Only expenses added since the last refresh are written; see snapshot.refresh_snapshot.
+        
+        Args:
+        - directory (str): Directory of the snapshot; created if missing.
+        - full (bool): Write the whole snapshot anew.
+        
+        Returns:
+        - int: Number of expenses written, or None if the snapshot could not be written.
+        """
+        try:
+            from snapshot import refresh_snapshot
+            return refresh_snapshot(self.model, directory, full=full)
+        except Exception as e:
+            print(f"Error writing snapshot: {e}")
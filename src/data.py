@@ -1,140 +1,1518 @@
 import sqlite3
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.backends.backend_pdf
-from tkinter import filedialog
+import contextlib
+import csv
+import gzip
+import hashlib
+import inspect
+import io
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from itertools import islice
+from datetime import date, datetime
+from database import (default_db_file, get_manager, is_memory, is_uri, read_only_uri, release_manager,
+                      register_function)
+import instrumentation
+import reports
 
-DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'expenses.db')
+# Dates are stored as ISO '%Y-%m-%d' text so they sort chronologically and can be
+# range-scanned through an index. Formats written by older releases are
+# rewritten by the schema migrations below.
+DATE_FORMAT = '%Y-%m-%d'
+LEGACY_DATE_FORMATS = ('%m/%d/%Y', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S', '%d.%m.%Y')
+
+# Rows written per transaction by add_expenses_bulk
+DEFAULT_BATCH_SIZE = 1000
+
+# Rows held in memory at a time by the streaming exporters
+DEFAULT_CHUNK_SIZE = 5000
+
+# Column definitions of the base tables, shared by the exporters that create
+# them in other database files. Expenses refer to their category by id; the
+# name is stored once, in categories.
+TABLES = {
+    'expenses': ('id INTEGER PRIMARY KEY, amount REAL, category_id INTEGER REFERENCES categories (id), '
+                 'date TEXT, description TEXT, content_hash INTEGER'),
+    'categories': 'id INTEGER PRIMARY KEY, name TEXT UNIQUE',
+}
+
+# Expenses with their category name, for every query that returns rows to the user
+EXPENSE_DETAILS = '''SELECT expenses.id AS id, amount, categories.name AS category, date, description,
+                            content_hash, category_id
+                     FROM expenses LEFT JOIN categories ON categories.id = expenses.category_id'''
+
+# Database pages copied per backup step by export_to_sqlite (4 MiB at the
+# default 4 KiB page size), and rows per INSERT ... SELECT for filtered copies
+BACKUP_STEP_PAGES = 1024
+DEFAULT_COPY_CHUNK_SIZE = 50000
+
+# Header written by export_to_csv and understood by read_expenses_csv
+CSV_COLUMNS = ('id', 'amount', 'category', 'date', 'description')
+
+# Rows fetched per query by get_expenses_page
+DEFAULT_PAGE_SIZE = 200
+
+# Bounds of the ResultCache: results kept, and rows summed over them (a
+# result that is not a list counts as one). Larger results are not cached.
+RESULT_CACHE_ENTRIES = 64
+RESULT_CACHE_ROWS = 200000
+
+# Arguments of the model's queries that filter expenses; '' and 'All' mean no filter
+FILTER_ARGUMENTS = ('category', 'start_date', 'end_date', 'min_amount', 'max_amount')
+
+# One rejected input row: its position in the input, the row itself and why it failed
+RowError = namedtuple('RowError', ['index', 'row', 'message'])
+
+# Inserts one (amount, category_id, date, description) row along with its content hash
+INSERT_EXPENSE = ('INSERT INTO expenses (amount, category_id, date, description, content_hash) '
+                  'VALUES (?1, ?2, ?3, ?4, expense_hash(?1, ?3, ?4))')
+
+# Outcome of import_expenses: rows added, rows skipped because the same expense
+# was already there, and the RowErrors of rows that could not be imported
+ImportResult = namedtuple('ImportResult', ['imported', 'duplicates', 'errors'])
+
+# First bytes of every SQLite database file
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+# Bumped whenever migrate_schema() gains a step; stored in PRAGMA user_version.
+SCHEMA_VERSION = 6
+
+# Summary tables kept current by triggers on expenses, keyed by category id (0
+# for expenses without a category, so a rename leaves them alone) and by
+# 'YYYY-MM' month. Each maps to its key column, the key's type and the
+# expression computing the key from a row.
+SUMMARY_TABLES = {
+    'category_totals': ('category_id', 'INTEGER', "IFNULL({row}category_id, 0)"),
+    'monthly_totals': ('month', 'TEXT', "substr({row}date, 1, 7)"),
+}
+
+# Years moved out of the main database by archive_year, each into a file of
+# its own; file is relative to the directory of the main database
+ARCHIVES_TABLE = 'year INTEGER PRIMARY KEY, file TEXT NOT NULL'
+
+# Name an archived year is attached under
+ARCHIVE_SCHEMA = 'archive_{year}'
+
+# SQLite attaches at most 10 databases to a connection by default; two are
+# left for the exports and imports that attach their file
+MAX_ARCHIVES = 8
+
+# Every table expense_source() can read across the main database and the
+# archives, as a query over one of them. Archived rows take their category
+# names from main, where categories are renamed.
+PARTITION_QUERIES = {
+    'expenses': 'SELECT id, amount, category_id, date, description, content_hash FROM {schema}.expenses',
+    'expense_details': '''SELECT expenses.id AS id, amount, categories.name AS category, date, description,
+                                 content_hash, category_id
+                          FROM {schema}.expenses AS expenses
+                          LEFT JOIN main.categories AS categories ON categories.id = expenses.category_id''',
+    'category_totals': 'SELECT category_id, total, count FROM {schema}.category_totals',
+    'monthly_totals': 'SELECT month, total, count FROM {schema}.monthly_totals',
+}
+
+# One archived year: its file, the schema it is attached under, and for
+# get_archives() the expenses and bytes in it
+Archive = namedtuple('Archive', ['year', 'file', 'schema', 'rows', 'size'])
+
+def read_expenses_csv(file_path, progress=None):
+    """Yield (amount, category, date, description) rows from a CSV file lazily.
+
+    Expects the header layout written by export_to_csv and used by
+    data/expenses.csv; an 'id' column is ignored. Files ending in '.gz' are
+    read as gzip. Values are returned as read, validation is left to the caller.
+    progress, if given, is called every DEFAULT_BATCH_SIZE rows with the
+    fraction of the file read so far.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as raw:
+        stream = gzip.GzipFile(fileobj=raw) if file_path.endswith('.gz') else raw
+        with io.TextIOWrapper(stream, encoding='utf-8', newline='') as f:
+            for index, record in enumerate(csv.DictReader(f), start=1):
+                yield (record.get('amount'), record.get('category'), record.get('date'), record.get('description') or '')
+                if progress and index % DEFAULT_BATCH_SIZE == 0:
+                    # Position in the file as stored, so compressed files report correctly too
+                    progress(raw.tell() / size)
+
+
+def export_pdf_file(db_file, file_path):
+    """Process-pool job: render the PDF export from a connection of its own; returns the row count.
+
+    A failure the model reports instead of raising is raised as a RuntimeError
+    with the model's message, so the task's on_error sees it.
+    """
+    model = ExpenseModel(db_file)
+    try:
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            written = model.export_to_pdf(file_path)
+        if written is None:
+            raise RuntimeError(log.getvalue().strip() or f"Exporting {file_path} failed.")
+        return written
+    finally:
+        model.close_connection()
+
+
+def content_hash(amount, date, description):
+    """Return a 64-bit hash of an expense's content, as stored in expenses.content_hash.
+
+    Amounts hash the same whether they arrive as text, int or float, so rows
+    from CSV files match the rows already in the database. The category is
+    left out so renaming one does not invalidate the hashes of its expenses;
+    merge_rows compares categories itself.
+    """
+    try:
+        amount = repr(float(amount))
+    except (TypeError, ValueError):
+        amount = '' if amount is None else str(amount)
+    key = f"{amount}\x1f{'' if date is None else date}\x1f{'' if description is None else description}"
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+register_function('expense_hash', 3, content_hash)
+
+
+def build_search_query(text):
+    """Turn free text into an FTS5 query matching rows that contain every word as a prefix.
+
+    'ube rid' becomes '"ube"* "rid"*'. Only word characters are kept, so user
+    input can never form FTS5 operators or syntax errors.
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text or ''))
+
+
+def normalize_date(value):
+    """Return value as an ISO '%Y-%m-%d' string, or None if it cannot be parsed."""
+    if isinstance(value, (date, datetime)):
+        return value.strftime(DATE_FORMAT)
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    try:
+        # Fast path for the common case; strptime below is far slower
+        return date.fromisoformat(value).strftime(DATE_FORMAT)
+    except ValueError:
+        pass
+    for fmt in (DATE_FORMAT,) + LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime(DATE_FORMAT)
+        except ValueError:
+            continue
+    return None
+
+
+class CategoryCache:
+    """Category ids and names of one database, kept in memory.
+
+    Shared by every ExpenseModel using the same ConnectionManager. The model
+    methods that write categories update it as they go; a write by any other
+    connection shows up as a changed PRAGMA data_version on the next refresh,
+    which costs no table read, and makes it load the table again.
+    """
 
-class ExpenseModel:
     def __init__(self):
+        self.lock = threading.Lock()
+        self.names = {}     # id -> name
+        self.ids = {}       # name -> id, in id order
+        self.versions = {}  # connection -> its data_version when the cache was last loaded
+
+    def refresh(self, conn):
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        with self.lock:
+            if self.versions.get(conn) == version:
+                return
+            rows = conn.execute('SELECT id, name FROM categories ORDER BY id').fetchall()
+            self.names = dict(rows)
+            self.ids = {name: category_id for category_id, name in rows}
+            # Other connections have not been checked against this load yet
+            self.versions = {conn: version}
+
+    def add(self, category_id, name):
+        with self.lock:
+            self.names[category_id] = name
+            self.ids[name] = category_id
+
+    def rename(self, category_id, name):
+        with self.lock:
+            self.names[category_id] = name
+            self.ids = {name: category_id for category_id, name in sorted(self.names.items())}
+
+    def discard(self, category_id):
+        with self.lock:
+            self.ids.pop(self.names.pop(category_id, None), None)
+
+    def clear(self):
+        """Forget everything, e.g. after a rollback; the next refresh loads the table."""
+        with self.lock:
+            self.versions = {}
+
+
+class ResultCache:
+    """Recently used query results of one database, least recently used evicted first.
+
+    Shared like CategoryCache. Results are stored along with the database
+    version they were read at (ConnectionManager.data_version(), which moves
+    on every commit by any connection of any process); the first lookup at a
+    newer version empties the cache.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_ENTRIES, max_rows=RESULT_CACHE_ROWS):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (result, rows), least recently used first
+        self.rows = 0
+        self.version = None
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+
+    def get(self, key, version):
+        """Return (True, result) if a result for key was read at version, else (False, None)."""
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.rows = 0
+                self.version = version
+                return False, None
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[0]
+
+    def put(self, key, version, result):
+        rows = len(result) if isinstance(result, list) else 1
+        with self.lock:
+            # A write since the result was read, or too big to keep
+            if version != self.version or rows > self.max_rows:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.rows -= previous[1]
+            self.entries[key] = (result, rows)
+            self.rows += rows
+            while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.rows -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.rows = 0
+            self.version = None
+
+
+class ArchiveCatalog:
+    """The archived years of one database, from its archives table.
+
+    Shared and refreshed like CategoryCache. attachments maps the schema of
+    every archive to its file, for ConnectionManager.attach().
+    """
+
+    def __init__(self, directory):
+        self.lock = threading.Lock()
+        self.directory = directory  # archive files are relative to this
+        self.archives = {}          # year -> Archive, oldest first
+        self.attachments = {}
+        self.versions = {}
+
+    def refresh(self, conn):
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        with self.lock:
+            if self.versions.get(conn) == version:
+                return
+            rows = conn.execute('SELECT year, file FROM main.archives ORDER BY year').fetchall()
+            archives = {year: Archive(year, os.path.join(self.directory, file), ARCHIVE_SCHEMA.format(year=year), None, None)
+                        for year, file in rows}
+            if archives != self.archives:
+                self.archives = archives
+                self.attachments = {archive.schema: archive.file for archive in archives.values()}
+            self.versions = {conn: version}
+
+    def clear(self):
+        with self.lock:
+            self.versions = {}
+
+
+def archive_directory(db_file):
+    """Directory the archives of db_file go to: data/expenses-archive for data/expenses.db."""
+    return os.path.splitext(os.path.abspath(db_file))[0] + '-archive'
+
+
+def cached_result(method):
+    """Answer repeated calls of a read-only ExpenseModel method from its ResultCache.
+
+    The key is the method's name and its arguments bound to their parameter
+    names, with empty filters dropped, so f(), f(category=None) and
+    f(category='All') share one entry. Lists come back as copies, so callers
+    can't change the cached one.
+    """
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # data_version only moves on commit; this connection's own pending
+        # writes would go unnoticed
+        if self.db is None or self.conn.in_transaction:
+            return method(self, *args, **kwargs)
+
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        del arguments['self']
+        arguments.update(arguments.pop('filters', {}))
+        key = (method.__name__,) + tuple(sorted(
+            (name, value) for name, value in arguments.items()
+            if value is not None and not (name in FILTER_ARGUMENTS and value in ('', 'All'))))
+
+        version = self.db.data_version()
+        found, result = self.result_cache.get(key, version)
+        if found:
+            instrumentation.count('cache_hits')
+        else:
+            instrumentation.count('cache_misses')
+            result = method(self, *args, **kwargs)
+            self.result_cache.put(key, version, result)
+        return list(result) if isinstance(result, list) else result
+    return wrapper
+
+
+@instrumentation.instrumented
+class ExpenseModel:
+    def __init__(self, db_file=None):
+        # A path or 'file:' URI; defaults to $EXPENSE_TRACKER_DB, then data/expenses.db
+        self.db_file = db_file or default_db_file()
+        self.db = None
+        self._local = threading.local()
         try:
-            self.conn = sqlite3.connect(DB_FILE)
-            self.cursor = self.conn.cursor()
+            self.db = get_manager(self.db_file)
+            # ':memory:' is opened under a URI of its own, which other models can share
+            self.db_file = self.db.db_file
+            self.category_cache = self.db.cache.setdefault('categories', CategoryCache())
+            # Results of the filters, charts and counts, until the next commit
+            self.result_cache = self.db.cache.setdefault('results', ResultCache())
+            self.archive_catalog = self.db.cache.setdefault(
+                'archives', ArchiveCatalog(os.path.dirname(os.path.abspath(self.db_file))))
             self.create_tables_if_not_exist()
         except sqlite3.Error as e:
             print(f"Error connecting to SQLite database: {e}")
 
+    @property
+    def in_memory(self):
+        return is_memory(self.db_file)
+
+    @property
+    def conn(self):
+        return self.db.connection_for_thread()
+
+    @property
+    def cursor(self):
+        # One cursor per thread, so background tasks can call the model directly
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = self.conn.cursor()
+        return cursor
+
     def create_tables_if_not_exist(self):
         try:
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS expenses (
-                                    id INTEGER PRIMARY KEY,
-                                    amount REAL,
-                                    category TEXT,
-                                    date TEXT,
-                                    description TEXT)''')
+            created = not self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'expenses'").fetchone()
+            for table, columns in TABLES.items():
+                self.cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+            self.cursor.execute(f'CREATE TABLE IF NOT EXISTS archives ({ARCHIVES_TABLE})')
+            self.create_summary_tables()
+            if created:
+                # A new database starts out with the current schema, there is nothing to migrate
+                self.cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
 
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS categories (
-                                    id INTEGER PRIMARY KEY,
-                                    name TEXT UNIQUE)''')
+            self.migrate_schema()
+            self.cursor.execute(f'CREATE VIEW IF NOT EXISTS expense_details AS {EXPENSE_DETAILS}')
+            self.create_search_table()
+            self.create_summary_triggers()
+            self.create_search_triggers()
+
+            # Reject anything but ISO dates so range queries stay correct; NULL
+            # too, which would give the monthly_totals summary a NULL month
+            for event in ('INSERT', 'UPDATE OF date'):
+                trigger = 'expenses_date_format_' + event.split()[0].lower()
+                self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {trigger}
+                                        BEFORE {event} ON expenses
+                                        WHEN NEW.date IS NULL OR date(NEW.date) IS NOT NEW.date
+                                        BEGIN
+                                            SELECT RAISE(ABORT, 'expense date must be in YYYY-MM-DD format');
+                                        END''')
+
+            # Indexes backing filter_expenses; the category/date pair also serves
+            # category-only lookups, the date index serves "All" categories.
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses (category_id, date)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date)')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_expenses_amount ON expenses (amount)')
+            # Finds duplicates for import_expenses; not unique, the same expense may be entered twice
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_expenses_content_hash ON expenses (content_hash)')
             self.conn.commit()
         except sqlite3.Error as e:
             print(f"Error creating tables: {e}")
 
+    def migrate_schema(self):
+        """Bring an existing database up to SCHEMA_VERSION, one step at a time."""
+        # migrations[n] upgrades a database from version n to n + 1. Versions 2 to 4
+        # added the summary tables, content hashes and search index; these are
+        # built from scratch by normalize_categories now, so those steps are empty.
+        migrations = [self.migrate_dates_to_iso, None, None, None, self.normalize_categories,
+                      self.drop_date_triggers]
+
+        version = self.cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        self.conn.commit()
+        self.cursor.execute('BEGIN')
+        try:
+            for target, migration in enumerate(migrations, start=1):
+                if version < target:
+                    if migration is not None:
+                        migration()
+                    self.cursor.execute(f'PRAGMA user_version = {target}')
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def drop_date_triggers(self):
+        # Version 6 rejects NULL dates too; the triggers are created again after the migration
+        for trigger in ('expenses_date_format_insert', 'expenses_date_format_update'):
+            self.cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+
+    def migrate_dates_to_iso(self):
+        # Bulk rewrite of the '%m/%d/%Y' strings older versions of validate_date produced
+        # Impossible ones like 13/45/2024 keep their text for the warning below
+        iso = "substr(date, 7, 4) || '-' || substr(date, 1, 2) || '-' || substr(date, 4, 2)"
+        self.cursor.execute(f'''UPDATE expenses SET date = {iso}
+                                WHERE date GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'
+                                  AND date({iso}) IS {iso}
+                             ''')
+
+        # Whatever is left over is parsed row by row; there should be very few of these
+        self.cursor.execute('SELECT id, date FROM expenses WHERE date(date) IS NOT date')
+        updates = []
+        unparsed = 0
+        for expense_id, value in self.cursor.fetchall():
+            normalized = normalize_date(value)
+            if normalized is None:
+                unparsed += 1
+            else:
+                updates.append((normalized, expense_id))
+        self.cursor.executemany('UPDATE expenses SET date = ? WHERE id = ?', updates)
+        if unparsed:
+            print(f"Warning: {unparsed} expenses have unrecognized dates and were left unchanged.")
+
+    def normalize_categories(self):
+        """Replace the category text of every expense by the id of its row in categories."""
+        self.cursor.execute('''INSERT OR IGNORE INTO categories (name)
+                               SELECT category FROM expenses WHERE IFNULL(category, '') != ''
+                               GROUP BY category ORDER BY MIN(id)''')
+        # Copied into a new table rather than altered, which is what frees the space of the text column
+        self.cursor.execute(f"CREATE TABLE expenses_new ({TABLES['expenses']})")
+        self.cursor.execute('''INSERT INTO expenses_new (id, amount, category_id, date, description, content_hash)
+                               SELECT expenses.id, amount, categories.id, date, description,
+                                      expense_hash(amount, date, description)
+                               FROM expenses LEFT JOIN categories ON categories.name = expenses.category''')
+        # Takes the old triggers and indexes along; they are created again for the new table
+        self.cursor.execute('DROP TABLE expenses')
+        self.cursor.execute('DROP TABLE IF EXISTS expenses_fts')
+        self.cursor.execute('ALTER TABLE expenses_new RENAME TO expenses')
+
+        self.cursor.execute('DROP TABLE IF EXISTS category_totals')
+        self.create_summary_tables()
+        self.fill_summaries()
+        self.cursor.execute(f'CREATE VIEW IF NOT EXISTS expense_details AS {EXPENSE_DETAILS}')
+        self.create_search_table()
+        self.fill_search_index()
+
+    def fill_content_hashes(self):
+        """Hash every expense that has none, e.g. rows written by other tools."""
+        self.cursor.execute('''UPDATE expenses SET content_hash = expense_hash(amount, date, description)
+                               WHERE content_hash IS NULL''')
+
+    def create_summary_tables(self):
+        for table, (key, key_type, _) in SUMMARY_TABLES.items():
+            self.cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                                    {key} {key_type} PRIMARY KEY,
+                                    total REAL NOT NULL,
+                                    count INTEGER NOT NULL)''')
+
+    def create_summary_triggers(self):
+        """Keep the summary tables current on every insert, update and delete."""
+        for table, (key, _, expression) in SUMMARY_TABLES.items():
+            add = f'''INSERT INTO {table} ({key}, total, count)
+                     VALUES ({expression.format(row='NEW.')}, IFNULL(NEW.amount, 0), 1)
+                     ON CONFLICT ({key}) DO UPDATE SET total = total + excluded.total, count = count + 1;'''
+            remove = f'''UPDATE {table} SET total = total - IFNULL(OLD.amount, 0), count = count - 1
+                        WHERE {key} = {expression.format(row='OLD.')};
+                        DELETE FROM {table} WHERE {key} = {expression.format(row='OLD.')} AND count <= 0;'''
+            self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON expenses
+                                    BEGIN {add} END''')
+            self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON expenses
+                                    BEGIN {remove} END''')
+            self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF amount, category_id, date ON expenses
+                                    BEGIN {remove} {add} END''')
+
+    def create_search_table(self):
+        """Create the full-text index over descriptions and category names."""
+        # External content: the index stores only the tokens and reads the text
+        # back from expense_details. prefix='2 3' keeps short prefix queries fast.
+        self.cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+                                   description, category, content='expense_details', content_rowid='id', prefix='2 3')""")
+
+    def fill_search_index(self):
+        self.cursor.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+    def create_search_triggers(self):
+        """Keep expenses_fts in step with the description and category name of every row."""
+        name = '(SELECT name FROM categories WHERE id = {row}.category_id)'
+        add = ('INSERT INTO expenses_fts (rowid, description, category) '
+               f"VALUES (NEW.id, NEW.description, {name.format(row='NEW')});")
+        remove = ("INSERT INTO expenses_fts (expenses_fts, rowid, description, category) "
+                  f"VALUES ('delete', OLD.id, OLD.description, {name.format(row='OLD')});")
+        self.cursor.execute(f'CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses BEGIN {add} END')
+        self.cursor.execute(f'CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN {remove} END')
+        self.cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS expenses_fts_update AFTER UPDATE OF description, category_id ON expenses
+                                BEGIN {remove} {add} END''')
+        # A rename is a single row in categories, but the index holds the name
+        # once per expense, so the entries of that category are replaced
+        self.cursor.execute('''CREATE TRIGGER IF NOT EXISTS expenses_fts_rename AFTER UPDATE OF name ON categories
+                               BEGIN
+                                   INSERT INTO expenses_fts (expenses_fts, rowid, description, category)
+                                   SELECT 'delete', id, description, OLD.name FROM expenses WHERE category_id = OLD.id;
+                                   INSERT INTO expenses_fts (rowid, description, category)
+                                   SELECT id, description, NEW.name FROM expenses WHERE category_id = NEW.id;
+                               END''')
+
+    def summary_query(self, table):
+        """Full-scan GROUP BY that produces what the given summary table should contain."""
+        key, _, expression = SUMMARY_TABLES[table]
+        return (f'SELECT {expression.format(row="")} AS {key}, SUM(IFNULL(amount, 0)) AS total, COUNT(*) AS count '
+                f'FROM expenses GROUP BY 1')
+
+    def fill_summaries(self):
+        for table in SUMMARY_TABLES:
+            self.cursor.execute(f'DELETE FROM {table}')
+            self.cursor.execute(f'INSERT INTO {table} ({SUMMARY_TABLES[table][0]}, total, count) {self.summary_query(table)}')
+
+    def rebuild_summaries(self):
+        """Recompute every summary table from scratch, e.g. for a database edited by another tool."""
+        try:
+            self.fill_summaries()
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error rebuilding summaries: {e}")
+
+    def check_summaries(self, tolerance=1e-6):
+        """Compare the summary tables against a full scan.
+
+        Returns a list of (table, key, stored, expected) tuples for every key whose
+        (total, count) differs; stored or expected is None when the key is missing.
+        """
+        mismatches = []
+        for table, (key, _, _) in SUMMARY_TABLES.items():
+            self.cursor.execute(f'SELECT {key}, total, count FROM {table}')
+            stored = {row[0]: row[1:] for row in self.cursor.fetchall()}
+            self.cursor.execute(self.summary_query(table))
+            expected = {row[0]: row[1:] for row in self.cursor.fetchall()}
+            for name in stored.keys() | expected.keys():
+                have, want = stored.get(name), expected.get(name)
+                if have is None or want is None or have[1] != want[1] or abs(have[0] - want[0]) > tolerance * max(1.0, abs(want[0])):
+                    mismatches.append((table, name, have, want))
+        return mismatches
+
+    @cached_result
+    def get_category_totals(self):
+        try:
+            self.cursor.execute(f'''SELECT IFNULL(categories.name, ''), SUM(total), SUM(count)
+                                    FROM {self.expense_source('category_totals')}
+                                    LEFT JOIN categories ON categories.id = category_totals.category_id
+                                    GROUP BY category_totals.category_id ORDER BY 1''')
+            return self.cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error fetching category totals: {e}")
+            return []
+
+    @cached_result
+    def get_monthly_totals(self):
+        try:
+            self.cursor.execute(f"SELECT month, SUM(total), SUM(count) FROM {self.expense_source('monthly_totals')} "
+                                'GROUP BY month ORDER BY month')
+            return self.cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error fetching monthly totals: {e}")
+            return []
+
+    @cached_result
+    def plot_expense_distribution(self, **filters):
+        """Data for the expense distribution chart, as a reports.Distribution."""
+        try:
+            return reports.expense_distribution(self, **filters)
+        except sqlite3.Error as e:
+            print(f"Error computing expense distribution: {e}")
+            return reports.Distribution([], [], [])
+
+    @cached_result
+    def plot_monthly_expenses(self, **filters):
+        """Data for the monthly expenses chart, as a reports.TimeSeries."""
+        return self.get_expense_timeseries('month', **filters)
+
+    @cached_result
+    def get_expense_timeseries(self, bucket='month', by_category=False, **filters):
+        """Spending per 'day', 'week', 'month' or 'year', optionally split by category."""
+        try:
+            if by_category:
+                return reports.category_timeseries(self, bucket, **filters)
+            return reports.expense_timeseries(self, bucket, **filters)
+        except sqlite3.Error as e:
+            print(f"Error computing expense time series: {e}")
+            if by_category:
+                return reports.CategoryTimeSeries(bucket, [], [], [])
+            return reports.TimeSeries(bucket, [], [], [])
+
     def add_expense(self, amount, category, date, description):
+        """Insert one expense; returns whether it was stored."""
         try:
-            self.cursor.execute('INSERT INTO expenses (amount, category, date, description) VALUES (?, ?, ?, ?)',
-                                (amount, category, date, description))
+            category_id = self.get_category_id(category, create=True)
+            self.cursor.execute(INSERT_EXPENSE, (amount, category_id, date, description))
             self.conn.commit()
+            return True
         except sqlite3.Error as e:
+            self.conn.rollback()
+            self.category_cache.clear()
             print(f"Error adding expense: {e}")
+            return False
+
+    def add_expenses_bulk(self, rows, batch_size=DEFAULT_BATCH_SIZE):
+        """Insert (amount, category, date, description) rows in batched transactions.
 
+        Each batch is written with a single executemany and commit. If the database
+        rejects a batch, it is retried row by row so only the offending rows are lost.
+        Categories that do not exist yet are added along with their first expense.
+        Returns (inserted_count, errors) where errors is a list of RowError.
+        """
+        inserted = 0
+        errors = []
+        query = INSERT_EXPENSE
+        cache = self.category_cache
+        rows = iter(rows)
+        offset = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            try:
+                # Checked once per batch; the names are then looked up in memory
+                cache.refresh(self.conn)
+                self.cursor.executemany(query, [self.expense_params(row) for row in batch])
+                self.conn.commit()
+                inserted += len(batch)
+            except (sqlite3.Error, TypeError, ValueError):
+                self.conn.rollback()
+                cache.clear()
+                cache.refresh(self.conn)
+                for position, row in enumerate(batch):
+                    try:
+                        self.cursor.execute(query, self.expense_params(row))
+                        inserted += 1
+                    except (sqlite3.Error, TypeError, ValueError) as e:
+                        errors.append(RowError(offset + position, row, str(e)))
+                self.conn.commit()
+            offset += len(batch)
+        return inserted, errors
+
+    def expense_params(self, row):
+        """INSERT_EXPENSE parameters for an (amount, category, date, description) row."""
+        amount, category, date, description = row
+        return amount, self.lookup_category_id(category, create=True), date, description
+
+    @cached_result
     def get_expenses(self):
         try:
-            self.cursor.execute('SELECT amount, category, date, description FROM expenses')
-            return self.cursor.fetchall()
+            self.cursor.execute(f"SELECT amount, category, date, description FROM {self.expense_source('expense_details')}")
+            return instrumentation.fetched(self.cursor.fetchall())
         except sqlite3.Error as e:
             print(f"Error fetching expenses: {e}")
             return []
         
+    def build_filter_conditions(self, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None):
+        """Translate filter arguments into lists of SQL conditions and parameters.
+
+        Empty values and the 'All' category are ignored. Categories are compared
+        by id. Dates are compared as '%Y-%m-%d' strings, which sort
+        chronologically and can use the date indexes.
+        """
+        conditions = []
+        params = []
+        if category and category != 'All':
+            # An unknown name gives NULL, which matches no row
+            conditions.append('category_id = ?')
+            params.append(self.get_category_id(category))
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(end_date)
+        if min_amount not in (None, ''):
+            conditions.append('amount >= ?')
+            params.append(float(min_amount))
+        if max_amount not in (None, ''):
+            conditions.append('amount <= ?')
+            params.append(float(max_amount))
+        return conditions, params
+
+    def build_filter_clause(self, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None):
+        """Return a (clause, params) tuple; clause is '' when no filter applies."""
+        conditions, params = self.build_filter_conditions(category, start_date, end_date, min_amount, max_amount)
+        clause = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return clause, params
+
+    def partitions(self, conn=None, start_date=None, end_date=None, **_):
+        """Schemas holding the expenses from start_date to end_date: the archives, oldest first, then 'main'.
+
+        Archived years outside the range are left out, as are archives conn
+        could not attach. The other filters don't narrow the partitions down.
+        """
+        conn = conn or self.conn
+        catalog = self.archive_catalog
+        catalog.refresh(conn)
+        if not catalog.archives:
+            return ['main']
+        if self.db.attachments != catalog.attachments:
+            self.db.attach(catalog.attachments)
+        attached = self.db.sync_attachments(conn)
+        return [archive.schema for archive in catalog.archives.values()
+                if archive.schema in attached
+                and not (start_date and start_date > f'{archive.year:04d}-12-31')
+                and not (end_date and end_date < f'{archive.year:04d}-01-01')] + ['main']
+
+    def expense_source(self, table='expenses', conn=None, **filters):
+        """FROM item for table, a key of PARTITION_QUERIES, covering the partitions of filters.
+
+        That is table itself until something in the date range is archived,
+        then a UNION ALL of the table in every partition named like it, so
+        the rest of the query stays the same. SQLite pushes the WHERE clause
+        down into every part, where it can use the indexes.
+        """
+        schemas = self.partitions(conn, **filters)
+        if len(schemas) == 1:
+            return table
+        parts = ' UNION ALL '.join(PARTITION_QUERIES[table].format(schema=schema) for schema in schemas)
+        return f'({parts}) AS {table}'
+
+    @cached_result
+    def filter_expenses(self, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None):
+        clause, params = self.build_filter_clause(category, start_date, end_date, min_amount, max_amount)
+        try:
+            source = self.expense_source('expense_details', start_date=start_date, end_date=end_date)
+            self.cursor.execute(f'SELECT amount, category, date, description FROM {source}{clause}', params)
+            return instrumentation.fetched(self.cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Error filtering expenses: {e}")
+            return []
+
+    def get_expenses_page(self, after_id=None, before_id=None, limit=DEFAULT_PAGE_SIZE, **filters):
+        """Return up to limit (id, amount, category, date, description) rows in id order.
+
+        Uses keyset pagination: rows with id > after_id, or the rows immediately
+        preceding before_id, so each page costs the same wherever it starts.
+        filters are the keyword arguments of filter_expenses.
+        """
+        conditions, params = self.build_filter_conditions(**filters)
+        order = 'ASC'
+        if after_id is not None:
+            conditions.append('id > ?')
+            params.append(after_id)
+        elif before_id is not None:
+            conditions.append('id < ?')
+            params.append(before_id)
+            order = 'DESC'
+        clause = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        try:
+            self.cursor.execute(f"SELECT id, amount, category, date, description "
+                                f"FROM {self.expense_source('expense_details', **filters)}{clause} "
+                                f"ORDER BY id {order} LIMIT ?", params + [limit])
+            rows = instrumentation.fetched(self.cursor.fetchall())
+            return rows[::-1] if order == 'DESC' else rows
+        except sqlite3.Error as e:
+            print(f"Error fetching expenses page: {e}")
+            return []
+
+    @cached_result
+    def count_expenses(self, **filters):
+        clause, params = self.build_filter_clause(**filters)
+        try:
+            # Counted partition by partition: SQLite can't count through a UNION ALL without reading every row
+            parts = [f'SELECT COUNT(*) AS count FROM {schema}.expenses{clause}' for schema in self.partitions(**filters)]
+            self.cursor.execute(f"SELECT SUM(count) FROM ({' UNION ALL '.join(parts)})", params * len(parts))
+            return self.cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error counting expenses: {e}")
+            return 0
+
+    @cached_result
+    def search_expenses(self, query, limit=DEFAULT_PAGE_SIZE, offset=0, **filters):
+        """Return (amount, category, date, description) rows matching query, best match first.
+
+        Every word of query must start a word of the description or category.
+        Matches are ranked by bm25 and narrowed by the filter_expenses keyword
+        arguments; limit and offset select a page of the ranking. Archives are
+        searched through their own index, which ranks against its own year and
+        knows their categories by the names they had when they were archived.
+        """
+        match = build_search_query(query)
+        if not match:
+            return []
+        conditions, params = self.build_filter_conditions(**filters)
+        clause = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        try:
+            parts = []
+            for schema in self.partitions(**filters):
+                source = PARTITION_QUERIES['expense_details'].format(schema=schema)
+                parts.append(f'''SELECT amount, category, date, description, expense_details.id AS id, matches.rank AS rank
+                                 FROM ({source}) AS expense_details
+                                 JOIN (SELECT rowid AS match_id, rank FROM {schema}.expenses_fts WHERE expenses_fts MATCH ?) AS matches
+                                 ON expense_details.id = matches.match_id{clause}''')
+            self.cursor.execute(f'''SELECT amount, category, date, description FROM ({' UNION ALL '.join(parts)})
+                                    ORDER BY rank, id LIMIT ? OFFSET ?''', ([match] + params) * len(parts) + [limit, offset])
+            return instrumentation.fetched(self.cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Error searching expenses: {e}")
+            return []
+
+    @cached_result
+    def count_search_results(self, query, **filters):
+        match = build_search_query(query)
+        if not match:
+            return 0
+        conditions, params = self.build_filter_conditions(**filters)
+        clause = ' AND ' + ' AND '.join(conditions) if conditions else ''
+        try:
+            parts = [f'''SELECT COUNT(*) AS count FROM {schema}.expenses
+                         WHERE id IN (SELECT rowid FROM {schema}.expenses_fts WHERE expenses_fts MATCH ?){clause}'''
+                     for schema in self.partitions(**filters)]
+            self.cursor.execute(f"SELECT SUM(count) FROM ({' UNION ALL '.join(parts)})", ([match] + params) * len(parts))
+            return self.cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error counting search results: {e}")
+            return 0
+
+    def get_expense_id_at(self, offset, **filters):
+        """Return the id of the row at position offset in id order, or None."""
+        clause, params = self.build_filter_clause(**filters)
+        try:
+            self.cursor.execute(f"SELECT id FROM {self.expense_source('expenses', **filters)}{clause} "
+                                f"ORDER BY id LIMIT 1 OFFSET ?", params + [offset])
+            row = self.cursor.fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"Error locating expense: {e}")
+            return None
+
     def get_expenses_charts(self):
         try:
-            self.cursor.execute('SELECT * FROM expenses')
-            return self.cursor.fetchall()
+            self.cursor.execute(f"SELECT * FROM {self.expense_source('expense_details')}")
+            return instrumentation.fetched(self.cursor.fetchall())
         except sqlite3.Error as e:
             print(f"Error fetching expenses: {e}")
             return []
 
     def add_category(self, category):
+        """Add a category; returns whether it was added."""
         try:
             self.cursor.execute('INSERT INTO categories (name) VALUES (?)', (category,))
             self.conn.commit()
+            self.category_cache.add(self.cursor.lastrowid, category)
+            return True
         except sqlite3.IntegrityError:
             print(f"Category '{category}' already exists.")
         except sqlite3.Error as e:
             print(f"Error adding category: {e}")
+        return False
+
+    def rename_category(self, category, new_name):
+        """Rename a category and return whether it was renamed.
+
+        Its expenses refer to it by id, so only the categories row changes.
+        """
+        try:
+            category_id = self.get_category_id(category)
+            if category_id is None:
+                print(f"Category '{category}' does not exist.")
+                return False
+            self.cursor.execute('UPDATE categories SET name = ? WHERE id = ?', (new_name, category_id))
+            self.conn.commit()
+            self.category_cache.rename(category_id, new_name)
+            return True
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            print(f"Category '{new_name}' already exists.")
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error renaming category: {e}")
+        return False
+
+    def remove_category(self, category, replacement=None):
+        """Remove a category, moving its expenses to replacement with a single UPDATE.
 
-    def remove_category(self, category):
+        replacement is added if it does not exist yet; without one, the
+        expenses are left without a category. Returns whether it was removed.
+        """
         try:
-            self.cursor.execute('DELETE FROM categories WHERE name=?', (category,))
+            category_id = self.get_category_id(category)
+            if category_id is None:
+                return False
+            for schema in self.partitions()[:-1]:
+                # Archives are read-only, their expenses can't be moved
+                if self.cursor.execute(f'SELECT 1 FROM {schema}.expenses WHERE category_id = ? LIMIT 1',
+                                       (category_id,)).fetchone():
+                    print(f"Category '{category}' is used by archived expenses and can't be removed.")
+                    return False
+            replacement_id = self.get_category_id(replacement, create=True)
+            if replacement_id == category_id:
+                return False
+            self.cursor.execute('UPDATE expenses SET category_id = ? WHERE category_id = ?', (replacement_id, category_id))
+            self.cursor.execute('DELETE FROM categories WHERE id = ?', (category_id,))
             self.conn.commit()
+            self.category_cache.discard(category_id)
+            return True
         except sqlite3.Error as e:
+            self.conn.rollback()
+            self.category_cache.clear()
             print(f"Error removing category: {e}")
+            return False
 
     def get_categories(self):
+        """Category names in the order they were added, from the CategoryCache."""
         try:
-            self.cursor.execute('SELECT name FROM categories')
-            return [row[0] for row in self.cursor.fetchall()]
+            self.category_cache.refresh(self.conn)
+            return list(self.category_cache.ids)
         except sqlite3.Error as e:
             print(f"Error fetching categories: {e}")
             return []
 
-    def export_to_csv(self, file_path):
+    def get_category_names(self):
+        """Return a dict from category id to name."""
+        self.category_cache.refresh(self.conn)
+        return dict(self.category_cache.names)
+
+    def get_category_id(self, category, create=False):
+        """Return the id of the named category, or None for an empty or unknown name.
+
+        With create=True an unknown name is added to categories, uncommitted.
+        """
+        self.category_cache.refresh(self.conn)
+        return self.lookup_category_id(category, create)
+
+    def lookup_category_id(self, category, create=False):
+        """get_category_id without the refresh, for loops that refreshed the cache once up front."""
+        if not category:
+            return None
+        category_id = self.category_cache.ids.get(category)
+        if category_id is None and create:
+            # OR IGNORE: another connection may have added it since the cache was loaded
+            self.cursor.execute('INSERT OR IGNORE INTO categories (name) VALUES (?)', (category,))
+            category_id = self.cursor.execute('SELECT id FROM categories WHERE name = ?', (category,)).fetchone()[0]
+            self.category_cache.add(category_id, category)
+        return category_id
+
+    def export_to_csv(self, file_path, chunk_size=DEFAULT_CHUNK_SIZE, compress=None, progress=None, **filters):
+        """Stream expenses to a CSV file, chunk_size rows at a time.
+
+        Memory use does not depend on the number of rows. compress writes gzip
+        and defaults to whether file_path ends in '.gz'. filters are the keyword
+        arguments of filter_expenses. progress, if given, is called with the
+        fraction of rows written after every chunk. Returns the row count.
+        """
+        if compress is None:
+            compress = file_path.endswith('.gz')
+        clause, params = self.build_filter_clause(**filters)
         try:
-            self.cursor.execute('SELECT * FROM expenses')
-            rows = self.cursor.fetchall()
+            total = self.count_expenses(**filters) if progress else 0
+
+            # A cursor of its own, so other model calls cannot reset it mid-export
+            cursor = self.conn.cursor()
+            cursor.execute(f"SELECT id, amount, category, date, description "
+                           f"FROM {self.expense_source('expense_details', **filters)}{clause}", params)
 
-            df = pd.DataFrame(rows, columns=['id', 'amount', 'category', 'date', 'description'])
-            df.to_csv(file_path, index=False)
+            written = 0
+            opener = gzip.open if compress else open
+            try:
+                with opener(file_path, 'wt', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(CSV_COLUMNS)
+                    while True:
+                        rows = instrumentation.fetched(cursor.fetchmany(chunk_size))
+                        if not rows:
+                            break
+                        writer.writerows(rows)
+                        written += len(rows)
+                        if progress:
+                            progress(written / total if total else 1.0)
+            except Exception:
+                # Failed or cancelled: don't leave a truncated file behind, if it was created at all
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                raise
+            instrumentation.count('bytes_exported', os.path.getsize(file_path))
             print(f"Data exported to {file_path} successfully.")
+            return written
         except sqlite3.Error as e:
             print(f"Error exporting to CSV: {e}")
 
-    def export_to_pdf(self, file_path):
-        try:
-            self.cursor.execute('SELECT * FROM expenses')
-            rows = self.cursor.fetchall()
-
-            df = pd.DataFrame(rows, columns=['id', 'amount', 'category', 'date', 'description'])
+    def export_to_pdf(self, file_path, rows_per_page=None, progress=None, **filters):
+        """Write a paginated PDF report: summary, charts, then rows_per_page expenses per page.
 
-            fig = plt.figure(figsize=(10, 8))
-            ax = fig.add_subplot(111)
-            ax.axis('off')
-            table = ax.table(cellText=df.values, colLabels=df.columns, cellLoc='center', loc='center')
+        The summary and chart pages use the precomputed aggregates in reports;
+        the rows are streamed a page at a time (pdf_report.ROWS_PER_PAGE rows
+        unless rows_per_page says otherwise). filters are the keyword arguments
+        of filter_expenses. progress is called with the fraction of rows written.
+        """
+        # matplotlib takes a while to import; only pay for it when exporting
+        import pdf_report
+        rows_per_page = rows_per_page or pdf_report.ROWS_PER_PAGE
+        clause, params = self.build_filter_clause(**filters)
+        try:
+            row_count = self.count_expenses(**filters)
+            # Shared with the charts through the result cache
+            distribution = self.plot_expense_distribution(**filters)
+            monthly = self.plot_monthly_expenses(**filters)
 
-            pdf = matplotlib.backends.backend_pdf.PdfPages(file_path)
-            pdf.savefig(fig)
-            pdf.close()
+            cursor = self.conn.cursor()
+            cursor.execute(f"SELECT id, amount, category, date, description "
+                           f"FROM {self.expense_source('expense_details', **filters)}{clause}", params)
+            pages = iter(lambda: instrumentation.fetched(cursor.fetchmany(rows_per_page)), [])
+            try:
+                pdf_report.write_pdf_report(file_path, pages, row_count, distribution, monthly,
+                                            rows_per_page=rows_per_page, progress=progress)
+            except Exception:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                raise
+            instrumentation.count('bytes_exported', os.path.getsize(file_path))
             print(f"Data exported to {file_path} successfully.")
+            return row_count
         except sqlite3.Error as e:
             print(f"Error exporting to PDF: {e}")
 
-    def export_to_sqlite(self, file_path):
+    def export_to_sqlite(self, file_path, incremental=False, chunk_size=DEFAULT_COPY_CHUNK_SIZE,
+                         progress=None, **filters):
+        """Copy expenses and categories, ids included, into the SQLite file at file_path.
+
+        Without filters the whole database is copied with the backup API, a
+        few pages per step. With filters, or with incremental=True, rows are
+        copied by INSERT ... SELECT into the attached file, chunk_size rows per
+        statement; incremental keeps the existing file and only appends rows
+        with ids above the highest one already in it. Rows never pass through
+        Python, and both paths read from a single snapshot so the copy stays
+        consistent while other connections write. Archived years are copied
+        along with the rest, so the whole database always takes the second
+        path once something is archived. progress is called with the fraction
+        done. Returns the number of expenses copied.
+        """
         try:
-            conn_export = sqlite3.connect(file_path)
-            cursor_export = conn_export.cursor()
-            
-            self.cursor.execute('SELECT amount, category, date, description FROM expenses')
-            rows = self.cursor.fetchall()
+            if (incremental or any(value not in (None, '', 'All') for value in filters.values())
+                    or len(self.partitions()) > 1):
+                return self.copy_expenses_to(file_path, incremental, chunk_size, progress, **filters)
+            return self.backup_to(file_path, progress)
+        except sqlite3.Error as e:
+            print(f"Error exporting to SQLite: {e}")
 
-            cursor_export.execute('''CREATE TABLE IF NOT EXISTS expenses (
-                                    id INTEGER PRIMARY KEY,
-                                    amount REAL,
-                                    category TEXT,
-                                    date TEXT,
-                                    description TEXT)''')
+    def backup_to(self, file_path, progress=None):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        conn = self.conn
+        conn.commit()
+        target = sqlite3.connect(file_path)
+        try:
+            # Keep a read transaction open for the whole copy: in WAL mode it pins
+            # a snapshot, where otherwise every write from another connection
+            # would restart the backup, possibly forever on a busy database
+            conn.execute('BEGIN')
+            count = conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
 
-            cursor_export.executemany('INSERT INTO expenses (amount, category, date, description) VALUES (?, ?, ?, ?)', rows)
-            conn_export.commit()
-            conn_export.close()
-            print(f"Data exported to {file_path} successfully.")
+            def step(status, remaining, total):
+                if progress:
+                    progress((total - remaining) / total if total else 1.0)
+
+            conn.backup(target, pages=BACKUP_STEP_PAGES, progress=step)
+            # The copy inherits WAL mode; a rollback journal keeps it a single file
+            target.execute('PRAGMA journal_mode = DELETE')
+            target.close()
+        except Exception:
+            target.close()
+            os.remove(file_path)
+            raise
+        finally:
+            conn.rollback()
+        instrumentation.count('bytes_exported', os.path.getsize(file_path))
+        print(f"Data exported to {file_path} successfully.")
+        return count
+
+    def copy_expenses_to(self, file_path, incremental=False, chunk_size=DEFAULT_COPY_CHUNK_SIZE,
+                         progress=None, **filters):
+        if not incremental and os.path.exists(file_path):
+            os.remove(file_path)
+        created = not os.path.exists(file_path)
+        if not created:
+            # Appending to an earlier export: make sure it has the current schema
+            ExpenseModel(file_path).close_connection()
+
+        conditions, params = self.build_filter_conditions(**filters)
+        where = ' AND '.join(conditions + ['id > ?'])
+        conn = self.conn
+        conn.commit()
+        source = self.expense_source('expenses', **filters)
+        conn.execute('ATTACH DATABASE ? AS export', (file_path,))
+        try:
+            conn.execute('BEGIN')
+            for table, columns in TABLES.items():
+                conn.execute(f'CREATE TABLE IF NOT EXISTS export.{table} ({columns})')
+            if created:
+                # Already in the current layout; ExpenseModel adds the rest below
+                conn.execute(f'PRAGMA export.user_version = {SCHEMA_VERSION}')
+            last_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM export.expenses').fetchone()[0]
+            total = conn.execute(f'SELECT COUNT(*) FROM {source} WHERE {where}',
+                                 params + [last_id]).fetchone()[0]
+
+            # Upserted, so an earlier export picks up renames (its search index follows through its trigger)
+            conn.execute('''INSERT INTO export.categories (id, name) SELECT id, name FROM main.categories WHERE true
+                            ON CONFLICT (id) DO UPDATE SET name = excluded.name''')
+            copied = 0
+            while copied < total:
+                # Keyset chunks along the primary key, each one a single statement
+                conn.execute(f'''INSERT OR IGNORE INTO export.expenses (id, amount, category_id, date, description, content_hash)
+                                 SELECT id, amount, category_id, date, description, content_hash FROM {source}
+                                 WHERE {where} ORDER BY id LIMIT ?''', params + [last_id, chunk_size])
+                last_id = conn.execute('SELECT MAX(id) FROM export.expenses').fetchone()[0]
+                copied = min(copied + chunk_size, total)
+                if progress:
+                    progress(copied / total)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.execute('DETACH DATABASE export')
+            if created:
+                os.remove(file_path)
+            raise
+        conn.execute('DETACH DATABASE export')
+
+        if created:
+            # Indexes, triggers, summary tables and the search index are built once
+            # all rows are in, which is several times faster than maintaining them per row
+            model = ExpenseModel(file_path)
+            try:
+                model.fill_summaries()
+                model.fill_search_index()
+                model.conn.commit()
+            finally:
+                model.close_connection()
+        target = sqlite3.connect(file_path)
+        target.execute('PRAGMA journal_mode = DELETE')
+        target.close()
+        instrumentation.count('bytes_exported', os.path.getsize(file_path))
+        print(f"Data exported to {file_path} successfully.")
+        return total
+
+    def import_expenses(self, file_path, batch_size=DEFAULT_COPY_CHUNK_SIZE, progress=None):
+        """Merge a file written by export_to_csv or export_to_sqlite into the database.
+
+        Expenses are matched as a multiset: an expense that the database
+        already holds n times is skipped for its first n copies in the file,
+        and further copies, like two identical coffees on one day, are
+        imported. Matches are found in SQL through the indexed content_hash
+        column, never by comparing rows in Python. Rows are merged batch_size
+        at a time with one transaction per batch; they get new ids, and their
+        categories are added to the category list. progress is called with the
+        fraction done. Returns an ImportResult.
+        """
+        with open(file_path, 'rb') as f:
+            is_sqlite = f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+        try:
+            # Rows written by other programs may not have been hashed yet
+            self.fill_content_hashes()
+            self.conn.commit()
+            # Attaches the archives for the duplicate checks while that is still allowed, outside a transaction
+            self.partitions()
+            # Every row merged so far, so repeats are counted across batches
+            self.cursor.execute('''CREATE TEMP TABLE IF NOT EXISTS merged_rows
+                                   (hash INTEGER, amount REAL, category_id INTEGER, date TEXT, description TEXT)''')
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS temp.idx_merged_rows_hash ON merged_rows (hash)')
+            # Rows this import inserts come after stored_until and are not counted as stored
+            stored_until = self.cursor.execute('SELECT IFNULL(MAX(id), 0) FROM main.expenses').fetchone()[0]
+            try:
+                if is_sqlite:
+                    return self.import_sqlite(file_path, batch_size, progress, stored_until)
+                return self.import_csv(file_path, batch_size, progress, stored_until)
+            finally:
+                self.cursor.execute('DROP TABLE IF EXISTS temp.merged_rows')
         except sqlite3.Error as e:
-            print(f"Error exporting to SQLite: {e}")
+            print(f"Error importing expenses: {e}")
+
+    def import_sqlite(self, file_path, batch_size=DEFAULT_COPY_CHUNK_SIZE, progress=None, stored_until=None):
+        conn = self.conn
+        conn.execute('ATTACH DATABASE ? AS source', (file_path,))
+        try:
+            version = conn.execute('PRAGMA source.user_version').fetchone()[0]
+            columns = [row[1] for row in conn.execute('PRAGMA source.table_info(expenses)').fetchall()]
+            tables = [row[0] for row in conn.execute("SELECT name FROM source.sqlite_master WHERE type = 'table'")]
+            # Rows with their category names, whether the file stores names or ids
+            if 'category_id' in columns:
+                conn.execute('''CREATE TEMP VIEW import_source AS
+                                SELECT expenses.id AS id, amount, categories.name AS category, date, description, content_hash
+                                FROM source.expenses LEFT JOIN source.categories ON categories.id = expenses.category_id''')
+            else:
+                conn.execute('''CREATE TEMP VIEW import_source AS
+                                SELECT id, amount, category, date, description FROM source.expenses''')
+            # Hashes written before schema version 5 covered the category and match nothing now
+            hashed = 'content_hash' in columns and version >= 5
+
+            # The date triggers would abort a whole batch for one bad row, so those are left out and reported
+            errors = [RowError(row[0], row[1:], 'expense date must be in YYYY-MM-DD format')
+                      for row in conn.execute('SELECT id, amount, category, date, description FROM temp.import_source '
+                                              'WHERE date IS NULL OR date(date) IS NOT date').fetchall()]
+            total = conn.execute('SELECT COUNT(*) FROM source.expenses').fetchone()[0]
+
+            if 'categories' in tables:
+                conn.execute("INSERT OR IGNORE INTO main.categories (name) "
+                             "SELECT name FROM source.categories WHERE IFNULL(name, '') != ''")
+            imported = done = last_id = 0
+            while True:
+                count, upper = conn.execute('SELECT COUNT(*), MAX(id) FROM '
+                                            '(SELECT id FROM source.expenses WHERE id > ? ORDER BY id LIMIT ?)',
+                                            (last_id, batch_size)).fetchone()
+                if not count:
+                    break
+                imported += self.merge_rows('temp.import_source', last_id, upper, hashed, stored_until)
+                conn.commit()
+                done += count
+                last_id = upper
+                if progress:
+                    progress(done / total)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.category_cache.clear()
+            conn.execute('DROP VIEW IF EXISTS temp.import_source')
+            conn.execute('DETACH DATABASE source')
+        print(f"Imported {imported} expenses from {file_path}.")
+        return ImportResult(imported, total - imported - len(errors), errors)
+
+    def import_csv(self, file_path, batch_size=DEFAULT_COPY_CHUNK_SIZE, progress=None, stored_until=None):
+        conn = self.conn
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS import_rows '
+                     '(id INTEGER PRIMARY KEY, amount REAL, category TEXT, date TEXT, description TEXT)')
+        imported = read = 0
+        errors = []
+        rows = enumerate(read_expenses_csv(file_path, progress))
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                staged = []
+                for index, row in batch:
+                    amount, category, date_value, description = row
+                    try:
+                        amount = float(amount)
+                    except (TypeError, ValueError):
+                        errors.append(RowError(index, row, 'amount must be a number'))
+                        continue
+                    date_value = normalize_date(date_value)
+                    if not category or date_value is None:
+                        errors.append(RowError(index, row, 'category and a valid date are required'))
+                        continue
+                    staged.append((amount, category, date_value, description))
+
+                # The emptied staging table numbers its rows from 1 again
+                conn.execute('DELETE FROM temp.import_rows')
+                conn.executemany('INSERT INTO temp.import_rows (amount, category, date, description) '
+                                 'VALUES (?, ?, ?, ?)', staged)
+                imported += self.merge_rows('temp.import_rows', 0, len(staged), hashed=False,
+                                            stored_until=stored_until)
+                conn.commit()
+                read += len(batch)
+            if progress:
+                progress(1.0)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.category_cache.clear()
+            conn.execute('DROP TABLE IF EXISTS temp.import_rows')
+        print(f"Imported {imported} expenses from {file_path}.")
+        return ImportResult(imported, read - imported - len(errors), errors)
+
+    def merge_rows(self, source, after_id, last_id, hashed=True, stored_until=None):
+        """Insert the rows of table source with ids in (after_id, last_id] that are not in expenses yet.
+
+        source has (id, amount, category, date, description) columns with
+        category names, which are added to categories when missing. Rows are
+        matched as a multiset: the k-th copy of an expense, counted over the
+        whole import in temp.merged_rows, is inserted only if the database
+        held fewer than k copies before the import, i.e. in the archives and
+        in main up to id stored_until (by default all of it). hashed says
+        whether source also has a current content_hash column; without it the
+        hashes are computed here. Returns the number of rows inserted.
+        """
+        self.cursor.execute(f"""INSERT OR IGNORE INTO main.categories (name)
+                                SELECT category FROM {source}
+                                WHERE id > ? AND id <= ? AND IFNULL(category, '') != ''
+                                GROUP BY category ORDER BY MIN(id)""", (after_id, last_id))
+        hash_expression = 'expense_hash(amount, date, description)'
+        if hashed:
+            hash_expression = f'IFNULL(content_hash, {hash_expression})'
+        first_row = self.cursor.execute('SELECT IFNULL(MAX(rowid), 0) FROM temp.merged_rows').fetchone()[0]
+        self.cursor.execute(f'''INSERT INTO temp.merged_rows (hash, amount, category_id, date, description)
+                                SELECT {hash_expression}, amount, categories.id, date, description
+                                FROM {source} AS incoming LEFT JOIN main.categories ON categories.name = incoming.category
+                                WHERE incoming.id > ? AND incoming.id <= ? AND date(date) = date
+                                ORDER BY incoming.id''', (after_id, last_id))
+
+        if stored_until is None:
+            stored_until = self.cursor.execute('SELECT IFNULL(MAX(id), 0) FROM main.expenses').fetchone()[0]
+        same = '''{table}.{hash} = incoming.hash AND {table}.amount IS incoming.amount
+                  AND {table}.category_id IS incoming.category_id AND {table}.date IS incoming.date
+                  AND {table}.description IS incoming.description'''
+        # Counted partition by partition, each through its own content_hash index
+        stored = ' + '.join(f'''(SELECT COUNT(*) FROM {schema}.expenses AS existing
+                                 WHERE {same.format(table='existing', hash='content_hash')}
+                                 {'AND existing.id <= ?2' if schema == 'main' else ''})'''
+                            for schema in self.partitions())
+        # The occurrence of a row in this batch, plus its copies in earlier batches
+        self.cursor.execute(f'''INSERT INTO main.expenses (amount, category_id, date, description, content_hash)
+                                SELECT amount, category_id, date, description, hash FROM (
+                                    SELECT rowid AS row, *, ROW_NUMBER() OVER (
+                                        PARTITION BY hash, amount, category_id, date, description ORDER BY rowid
+                                    ) AS occurrence
+                                    FROM temp.merged_rows WHERE rowid > ?1) AS incoming
+                                WHERE occurrence + (SELECT COUNT(*) FROM temp.merged_rows AS earlier
+                                                    WHERE earlier.rowid <= ?1
+                                                      AND {same.format(table='earlier', hash='hash')}) > {stored}
+                                ORDER BY row''', (first_row, stored_until))
+        return self.cursor.rowcount
+
+    def get_archives(self):
+        """Archived years, oldest first, as Archive tuples with their rows and file size."""
+        try:
+            archives = []
+            for schema in self.partitions()[:-1]:
+                year = int(schema.rsplit('_', 1)[1])
+                archive = self.archive_catalog.archives[year]
+                rows = self.cursor.execute(f'SELECT COUNT(*) FROM {schema}.expenses').fetchone()[0]
+                archives.append(archive._replace(rows=rows, size=os.path.getsize(archive.file)))
+            return archives
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error listing archives: {e}")
+            return []
+
+    def archive_year(self, year):
+        """Move the expenses of a past year out of the database, into an archive file of its own.
+
+        The file, expenses-YEAR.db in archive_directory(), is a complete
+        database written by copy_expenses_to. It is attached read-only, and
+        every query whose date range reaches into the year reads it along
+        with the main database, which keeps only the other years and is
+        vacuumed to its new size. A year is archived once: its file is open
+        wherever it is attached, so expenses added to it afterwards stay in
+        the main database, where the queries find them as well.
+
+        The last expense added can't be archived: a new expense would take its
+        id. Returns the number of expenses moved, or None on failure.
+        """
+        year = int(year)
+        if self.in_memory or is_uri(self.db_file):
+            print("Error archiving expenses: archives need a database file.")
+            return None
+        if year >= date.today().year:
+            print(f"Error archiving expenses: {year} is not over yet.")
+            return None
+        catalog = self.archive_catalog
+        catalog.refresh(self.conn)
+        if year in catalog.archives:
+            print(f"{year} is archived already.")
+            return 0
+        if len(catalog.archives) >= MAX_ARCHIVES:
+            print(f"Error archiving expenses: at most {MAX_ARCHIVES} years can be archived.")
+            return None
+
+        start_date, end_date = f'{year:04d}-01-01', f'{year:04d}-12-31'
+        conn = self.conn
+        try:
+            conn.commit()
+            count, last_id = conn.execute('SELECT COUNT(*), MAX(id) FROM main.expenses WHERE date BETWEEN ? AND ?',
+                                          (start_date, end_date)).fetchone()
+            if not count:
+                print(f"No expenses from {year} to archive.")
+                return 0
+            if conn.execute('SELECT 1 FROM main.expenses WHERE id > ? LIMIT 1', (last_id,)).fetchone() is None:
+                print(f"Error archiving expenses: the last expense added is from {year}; "
+                      f"archive the year once a later expense has been added.")
+                return None
+
+            file_path = os.path.join(archive_directory(self.db_file), f'expenses-{year}.db')
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if self.copy_expenses_to(file_path, start_date=start_date, end_date=end_date) is None:
+                return None
+
+            # Registered and deleted in one transaction, so every reader sees the
+            # year either in the main database or in the archive
+            conn.execute('ATTACH DATABASE ? AS archived', (read_only_uri(file_path),))
+            try:
+                conn.execute('BEGIN')
+                conn.execute('INSERT INTO main.archives (year, file) VALUES (?, ?)',
+                             (year, os.path.relpath(file_path, catalog.directory)))
+                moved = conn.execute('''DELETE FROM main.expenses WHERE date BETWEEN ? AND ?
+                                        AND id IN (SELECT id FROM archived.expenses)''',
+                                     (start_date, end_date)).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute('DETACH DATABASE archived')
+            # This connection's own commit leaves its data_version alone
+            catalog.clear()
+            conn.execute('VACUUM main')
+            print(f"Archived {moved} expenses from {year} to {file_path}.")
+            return moved
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error archiving expenses: {e}")
+            return None
+
+    def compact_archives(self):
+        """Rewrite every archive file without free pages through VACUUM INTO; returns the bytes saved.
+
+        Connections that have a file attached keep reading the old one, which
+        holds the same rows, until they attach it again. Where open files can't
+        be replaced (Windows), an archive in use is left as it is.
+        """
+        saved = 0
+        for archive in self.get_archives():
+            compacted = archive.file + '.compact'
+            try:
+                if os.path.exists(compacted):
+                    os.remove(compacted)
+                self.conn.execute(f'VACUUM {archive.schema} INTO ?', (compacted,))
+                os.replace(compacted, archive.file)
+                saved += archive.size - os.path.getsize(archive.file)
+            except (sqlite3.Error, OSError) as e:
+                print(f"Error compacting {archive.file}: {e}")
+                if os.path.exists(compacted):
+                    os.remove(compacted)
+        return saved
 
     def close_connection(self):
         try:
-            self.conn.close()
+            if self.db is not None:
+                release_manager(self.db)
+                self.db = None
+                self._local = threading.local()
             print("Database connection closed.")
         except sqlite3.Error as e:
             print(f"Error closing connection: {e}")
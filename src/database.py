@@ -0,0 +1,273 @@
+import itertools
+import os
+import sqlite3
+import threading
+import weakref
+from urllib.request import pathname2url
+import instrumentation
+
+DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'expenses.db')
+
+# Environment variable naming the database, as a path or a 'file:' URI, used
+# wherever none is passed explicitly (main.py's --db flag takes precedence)
+DB_ENV = 'EXPENSE_TRACKER_DB'
+
+# A database that only lives in memory, gone once its last user releases it
+MEMORY = ':memory:'
+
+# Applied to every connection opened by a ConnectionManager. WAL lets readers
+# and the writer work at the same time, and synchronous=NORMAL only syncs on
+# checkpoints instead of on every commit (still safe against corruption in WAL
+# mode, a power cut may lose the last few commits). Override per manager with
+# the pragmas argument, e.g. {'synchronous': 'FULL'} for maximum durability.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -32000,           # negative values are KiB, so ~32 MB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,           # milliseconds to wait on a locked database
+}
+
+
+# Python functions callable from SQL on every managed connection, by name:
+# (number of arguments, function). Filled in through register_function().
+FUNCTIONS = {}
+
+
+def default_db_file():
+    """The database named by $EXPENSE_TRACKER_DB, or data/expenses.db."""
+    return os.environ.get(DB_ENV) or DB_FILE
+
+
+def is_uri(db_file):
+    return db_file.startswith('file:')
+
+
+def is_memory(db_file):
+    return db_file == MEMORY or (is_uri(db_file) and ('mode=memory' in db_file or 'vfs=memdb' in db_file))
+
+
+def memory_uri(name):
+    """URI of the in-memory database called name.
+
+    Every connection in the process opening the same URI sees the same data,
+    for as long as at least one of them stays open. It uses the memdb VFS
+    rather than mode=memory&cache=shared: a shared cache locks tables, which
+    fails a write at once while another thread still reads, where memdb locks
+    like a file and the writer waits out busy_timeout.
+    """
+    return f'file:/{name}?vfs=memdb'
+
+
+def read_only_uri(file_path):
+    """URI opening file_path read-only, e.g. to ATTACH it."""
+    return f'file:{pathname2url(os.path.abspath(file_path))}?mode=ro'
+
+
+_memory_ids = itertools.count(1)
+
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+
+def register_function(name, num_params, func):
+    """Make func available to SQL on connections opened from now on.
+
+    func must be deterministic; call this at import time, before any manager
+    opens its connections.
+    """
+    FUNCTIONS[name] = (num_params, func)
+
+
+class ConnectionManager:
+    """Owns the SQLite connections to one database file.
+
+    The thread that creates the manager gets the shared `connection`; any other
+    thread asking for a cursor gets a connection of its own, opened lazily with
+    the same pragmas and reused for the lifetime of that thread. Use
+    get_manager() rather than instantiating this directly so every part of the
+    app shares one manager per file.
+
+    db_file is a path or a 'file:' URI. ':memory:' becomes a uniquely named
+    memory_uri() database, so the other threads' connections reach
+    the same data instead of each opening an empty database of its own.
+    """
+
+    def __init__(self, db_file=None, pragmas=None):
+        db_file = db_file or default_db_file()
+        if db_file == MEMORY:
+            db_file = memory_uri(f'expenses-{os.getpid()}-{next(_memory_ids)}')
+        self.db_file = db_file
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self.users = 0
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread_connections = []
+        self._monitor = None
+        # Databases attached read-only to the connections by sync_attachments(),
+        # schema name: file; replaced as a whole by attach(), never changed in place
+        self.attachments = {}
+        self._attached = {}  # connection -> (attachments it was synced with, {name: file} it has)
+        # Objects shared by everything using this database in the process, by name
+        self.cache = {}
+        self.connection = self.open_connection()
+        _live_managers.add(self)
+
+    def set_tracing(self, on):
+        """Install or remove the instrumentation trace callback on the managed connections."""
+        with self._lock:
+            connections = [self.connection] + self._thread_connections
+        for conn in connections:
+            try:
+                if on:
+                    instrumentation.trace_connection(conn)
+                else:
+                    conn.set_trace_callback(None)
+            except sqlite3.ProgrammingError:
+                # Closed, or the owner's connection seen from another thread
+                pass
+
+    def open_connection(self, **kwargs):
+        """Open an extra connection with the manager's pragmas and functions; the caller closes it."""
+        if not is_uri(self.db_file):
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+        conn = sqlite3.connect(self.db_file, uri=is_uri(self.db_file), **kwargs)
+        if instrumentation.enabled:
+            instrumentation.trace_connection(conn)
+        apply_pragmas(conn, self.pragmas)
+        for name, (num_params, func) in FUNCTIONS.items():
+            conn.create_function(name, num_params, func, deterministic=True)
+        return conn
+
+    def attach(self, attachments):
+        """Have sync_attachments() attach these databases, {schema name: file}, instead of the earlier ones."""
+        self.attachments = dict(attachments)
+
+    def sync_attachments(self, conn):
+        """ATTACH and DETACH on conn until it has the current attachments; returns the names it has.
+
+        Neither is allowed inside a transaction; conn then keeps what it has
+        until the next call. A file that can't be attached is reported once
+        and left out.
+        """
+        attachments = self.attachments
+        with self._lock:
+            synced, attached = self._attached.get(conn, (None, {}))
+        if synced is attachments or conn.in_transaction:
+            return attached.keys()
+
+        attached = dict(attached)
+        complete = True
+        for name, file_path in list(attached.items()):
+            if attachments.get(name) != file_path:
+                try:
+                    conn.execute(f'DETACH DATABASE {name}')
+                    del attached[name]
+                except sqlite3.Error as e:
+                    # Still read by an unfinished statement; tried again on the next call
+                    print(f"Error detaching {file_path}: {e}")
+                    complete = False
+        for name, file_path in attachments.items():
+            if name not in attached:
+                try:
+                    conn.execute(f'ATTACH DATABASE ? AS {name}', (read_only_uri(file_path),))
+                    attached[name] = file_path
+                except sqlite3.Error as e:
+                    print(f"Error attaching {file_path}: {e}")
+        with self._lock:
+            self._attached[conn] = (attachments if complete else None, attached)
+        return attached.keys()
+
+    def connection_for_thread(self):
+        if threading.get_ident() == self._owner:
+            return self.connection
+
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            # Only ever used by this thread, but closed by close() from the owner
+            conn = self.open_connection(check_same_thread=False)
+            self._local.connection = conn
+            with self._lock:
+                self._thread_connections.append(conn)
+        return conn
+
+    def data_version(self):
+        """PRAGMA data_version of a connection of its own that never writes.
+
+        Every commit by any other connection, of this process or another one,
+        changes it; results read at the same version saw the same data.
+        """
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = self.open_connection(check_same_thread=False)
+            return self._monitor.execute('PRAGMA data_version').fetchone()[0]
+
+    def cursor(self):
+        """Return a cursor on the calling thread's connection."""
+        return self.connection_for_thread().cursor()
+
+    def close(self):
+        with self._lock:
+            connections, self._thread_connections = self._thread_connections, []
+            if self._monitor is not None:
+                connections.append(self._monitor)
+                self._monitor = None
+            self._attached = {}
+        for conn in connections:
+            conn.close()
+        self.connection.close()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+# Every manager still in use, private ':memory:' ones included
+_live_managers = weakref.WeakSet()
+
+
+def _set_tracing(on):
+    for manager in list(_live_managers):
+        manager.set_tracing(on)
+
+
+instrumentation.on_toggle(_set_tracing)
+
+
+def _manager_key(db_file):
+    return db_file if db_file == MEMORY or is_uri(db_file) else os.path.abspath(db_file)
+
+
+def get_manager(db_file=None, pragmas=None):
+    """Return the shared ConnectionManager for db_file, opening it on first use.
+
+    db_file defaults to default_db_file(). Every call must be paired with
+    release_manager(). The pragmas only take effect when the manager is first
+    opened. ':memory:' always gets a new, private manager; to share an
+    in-memory database between models, pass the same memory_uri() to each.
+    """
+    db_file = db_file or default_db_file()
+    key = _manager_key(db_file)
+    with _managers_lock:
+        manager = _managers.get(key) if key != MEMORY else None
+        if manager is None:
+            manager = ConnectionManager(db_file, pragmas)
+            if key != MEMORY:
+                _managers[key] = manager
+        manager.users += 1
+        return manager
+
+
+def release_manager(manager):
+    """Drop one user of manager and close its connections once nobody uses it."""
+    with _managers_lock:
+        manager.users -= 1
+        if manager.users > 0:
+            return
+        key = _manager_key(manager.db_file)
+        if _managers.get(key) is manager:
+            del _managers[key]
+    manager.close()
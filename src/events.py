@@ -0,0 +1,37 @@
+from collections import defaultdict, namedtuple
+
+# Topics published by ExpenseTrackerController.events
+CATEGORIES = 'categories'
+EXPENSES = 'expenses'
+
+# kind is 'added', 'renamed' or 'removed'. name is the category's (new) name,
+# old_name its name before a rename, replacement the category the expenses of
+# a removed one were moved to (None: left without a category).
+CategoryEvent = namedtuple('CategoryEvent', ['kind', 'name', 'old_name', 'replacement'], defaults=(None, None))
+
+# kind is 'added' for count new expenses, appended after all existing ones;
+# rows holds them as (amount, category, date, description) tuples when known.
+ExpenseEvent = namedtuple('ExpenseEvent', ['kind', 'count', 'rows'], defaults=(None,))
+
+
+class EventBus:
+    """Delivers change events to the callbacks subscribed to their topic.
+
+    Callbacks run synchronously on the publishing thread, in subscription
+    order; one that touches Tk widgets should hand the event over to the Tk
+    thread itself (see TaskRunner.call_soon).
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+
+    def subscribe(self, topic, callback):
+        self.subscribers[topic].append(callback)
+
+    def unsubscribe(self, topic, callback):
+        if callback in self.subscribers[topic]:
+            self.subscribers[topic].remove(callback)
+
+    def publish(self, topic, event):
+        for callback in list(self.subscribers[topic]):
+            callback(event)
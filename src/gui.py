@@ -1,31 +1,45 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
 from preferences import Preferences
+from widgets import VirtualTreeview
+from tasks import TaskRunner
+from data import export_pdf_file
 from controller import ExpenseTrackerController
+from events import CATEGORIES, EXPENSES
 from datetime import datetime
 from tkcalendar import Calendar, DateEntry
-import pandas as pd
-import matplotlib.pyplot as plt
-from ttkthemes import ThemedStyle
 import sv_ttk
 
+# Choices of the time series chart's granularity, and the reports.BUCKETS they use
+GRANULARITIES = {"Daily": 'day', "Weekly": 'week', "Monthly": 'month', "Yearly": 'year'}
+
 class ExpenseTrackerView:
     def __init__(self, root, controller):
         self.root = root
         self.root.title("Expense Tracker")
         self.controller = controller
+        if self.controller.in_memory:
+            self.root.title("Expense Tracker (in memory)")
 
-        self.style = ThemedStyle(self.root)
         sv_ttk.set_theme("dark")  # Apply "dark" theme from sv_ttk
 
         # Continue with your existing setup
         self.setup_tabs()
         self.setup_export_buttons()
         self.setup_settings_tab()
+        self.setup_status_bar()
+
+        # Database, export and chart work runs in the background
+        self.tasks = TaskRunner(self.root, on_busy=self.update_busy_indicator)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
-        self.preferences = Preferences(self.root, self.controller, self.update_categories)
+        self.preferences = Preferences(self.root, self.controller)
         self.load_categories()
 
+        # Events may come from background tasks; they are handled on the Tk thread
+        self.controller.events.subscribe(CATEGORIES, lambda event: self.tasks.call_soon(self.on_category_event, event))
+        self.controller.events.subscribe(EXPENSES, lambda event: self.tasks.call_soon(self.on_expense_event, event))
+
     def setup_tabs(self):
         self.tabs = ttk.Notebook(self.root)
         self.tabs.grid(row=0, column=0, sticky=(tk.W, tk.E))
@@ -67,12 +81,7 @@ class ExpenseTrackerView:
 
     def setup_expense_table(self, frame):
         columns = ('Amount', 'Category', 'Date', 'Description')
-        self.tree = ttk.Treeview(frame, columns=columns, show='headings')
-
-        for col in columns:
-            self.tree.heading(col, text=col)
-            self.tree.column(col, minwidth=0, width=100)
-
+        self.tree = VirtualTreeview(frame, columns)
         self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E))
         frame.columnconfigure(0, weight=1)
 
@@ -104,65 +113,109 @@ class ExpenseTrackerView:
         self.filter_button = ttk.Button(frame, text="Filter", command=self.filter_expenses)
         self.filter_button.grid(row=1, column=4, padx=10, pady=5, sticky=tk.W)
 
+        # Full-text search over descriptions and categories, ranked by relevance
+        ttk.Label(frame, text="Search:").grid(row=2, column=0, sticky=tk.W)
+        self.search_entry = ttk.Entry(frame)
+        self.search_entry.grid(row=2, column=1, columnspan=3, sticky=(tk.W, tk.E))
+        self.search_entry.bind('<Return>', lambda event: self.filter_expenses())
+
         # Treeview for displaying filtered expenses
         columns = ('Amount', 'Category', 'Date', 'Description')
-        self.filtered_tree = ttk.Treeview(frame, columns=columns, show='headings')
-
-        for col in columns:
-            self.filtered_tree.heading(col, text=col)
-            self.filtered_tree.column(col, minwidth=0, width=100)
-
-        self.filtered_tree.grid(row=2, column=0, columnspan=5, sticky=(tk.W, tk.E))
+        self.filtered_tree = VirtualTreeview(frame, columns)
+        self.filtered_tree.grid(row=3, column=0, columnspan=5, sticky=(tk.W, tk.E))
 
     def setup_report_form(self, frame):
         self.report_frame = ttk.Frame(frame, padding="10")
         self.report_frame.grid(row=4, column=0, sticky=(tk.W, tk.E))
+        self.report_frame.columnconfigure(3, weight=1)
 
         self.pie_chart_button = ttk.Button(self.report_frame, text="Expense Distribution", command=self.plot_expense_distribution)
         self.pie_chart_button.grid(row=0, column=0, padx=10)
 
-        self.bar_chart_button = ttk.Button(self.report_frame, text="Monthly Expenses", command=self.plot_monthly_expenses)
-        self.bar_chart_button.grid(row=0, column=1, padx=10)
+        self.timeseries_button = ttk.Button(self.report_frame, text="Expenses Over Time", command=self.plot_expense_timeseries)
+        self.timeseries_button.grid(row=0, column=1, padx=10)
+
+        self.granularity_var = tk.StringVar(value="Monthly")
+        self.granularity_menu = ttk.OptionMenu(self.report_frame, self.granularity_var, "Monthly", *GRANULARITIES,
+                                               command=lambda _: self.plot_expense_timeseries())
+        self.granularity_menu.grid(row=0, column=2, padx=10, sticky=tk.W)
+
+        # Created with the first chart, so matplotlib is only loaded when needed
+        self.chart = None
+
+    def chart_panel(self):
+        if self.chart is None:
+            from charts import ChartPanel
+            self.chart = ChartPanel(self.report_frame)
+            self.chart.grid(row=1, column=0, columnspan=4, pady=(10, 0), sticky=(tk.N, tk.S, tk.W, tk.E))
+        return self.chart
 
     def plot_expense_distribution(self):
+        # Unfiltered, this reads the trigger-maintained summary table: a handful of rows
+        self.tasks.submit(self.controller.plot_expense_distribution, name="Expense distribution",
+                          on_done=self.show_expense_distribution,
+                          on_error=lambda e: messagebox.showerror("Error", f"Error plotting expense distribution: {e}"))
+
+    def show_expense_distribution(self, distribution):
         try:
-            expenses = self.controller.get_expenses_charts()
-            df = pd.DataFrame(expenses, columns=['id', 'Amount', 'Category', 'Date', 'Description'])
-            category_expenses = df.groupby('Category')['Amount'].sum()
-
-            # Configure Matplotlib for dark theme
-            plt.style.use('bmh')
-            
-            plt.figure(figsize=(8, 6))
-            plt.pie(category_expenses, labels=category_expenses.index, autopct='%1.1f%%', startangle=140)
-            plt.axis('equal')
-            plt.title('Expense Distribution by Category')
-            plt.show()
+            self.chart_panel().show_distribution(distribution)
         except Exception as e:
             messagebox.showerror("Error", f"Error plotting expense distribution: {e}")
 
-    def plot_monthly_expenses(self):
+    def plot_expense_timeseries(self):
+        bucket = GRANULARITIES[self.granularity_var.get()]
+        self.tasks.submit(self.controller.get_expense_timeseries, bucket, name="Expenses over time",
+                          on_done=self.show_expense_timeseries,
+                          on_error=lambda e: messagebox.showerror("Error", f"Error plotting expenses over time: {e}"))
+
+    def show_expense_timeseries(self, series):
         try:
-            expenses = self.controller.get_expenses_charts()
-            df = pd.DataFrame(expenses, columns=['id', 'Amount', 'Category', 'Date', 'Description'])
-            df['Date'] = pd.to_datetime(df['Date'])
-            df['Month'] = df['Date'].dt.to_period('M')
-            monthly_expenses = df.groupby('Month')['Amount'].sum()
-
-            # Configure Matplotlib for dark theme
-            plt.style.use('bmh')
-            
-            plt.figure(figsize=(10, 6))
-            plt.bar(monthly_expenses.index.astype(str), monthly_expenses.values)
-            plt.xlabel('Month')
-            plt.ylabel('Total Expenses')
-            plt.title('Monthly Expenses')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.show()
+            self.chart_panel().show_timeseries(series)
         except Exception as e:
-            messagebox.showerror("Error", f"Error plotting monthly expenses: {e}")
-
+            messagebox.showerror("Error", f"Error plotting expenses over time: {e}")
+
+    def setup_status_bar(self):
+        self.status_frame = ttk.Frame(self.root, padding=(10, 0))
+        self.status_frame.grid(row=2, column=0, sticky=(tk.W, tk.E))
+        self.status_frame.columnconfigure(0, weight=1)
+
+        self.status_label = ttk.Label(self.status_frame, text="")
+        self.status_label.grid(row=0, column=0, sticky=tk.W)
+        self.progress_bar = ttk.Progressbar(self.status_frame, mode='indeterminate', length=150)
+        self.cancel_button = ttk.Button(self.status_frame, text="Cancel", command=self.cancel_tasks)
+
+    def update_busy_indicator(self, tasks):
+        if tasks:
+            self.status_label.config(text="Working: " + ", ".join(task.name for task in tasks))
+            if not self.progress_bar.winfo_ismapped():
+                self.progress_bar.config(mode='indeterminate')
+                self.progress_bar.grid(row=0, column=1, padx=10)
+                self.progress_bar.start()
+                self.cancel_button.grid(row=0, column=2)
+        else:
+            self.status_label.config(text="")
+            self.progress_bar.stop()
+            self.progress_bar.grid_remove()
+            self.cancel_button.grid_remove()
+
+    def update_progress(self, fraction):
+        if self.progress_bar.cget('mode') != 'determinate':
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', maximum=100)
+        self.progress_bar['value'] = fraction * 100
+
+    def cancel_tasks(self):
+        self.tasks.cancel_all()
+        self.status_label.config(text="Cancelling...")
+
+    def on_close(self):
+        if self.controller.in_memory and messagebox.askyesno(
+                "Save Session", "This session only lives in memory. Save it to a file before closing?"):
+            file_path = filedialog.asksaveasfilename(defaultextension=".db", filetypes=[("SQLite files", "*.db")])
+            if file_path:
+                self.controller.save_database(file_path)
+        self.tasks.shutdown()
+        self.root.destroy()
 
     def setup_settings_tab(self):
         settings_frame = ttk.Frame(self.tabs)
@@ -180,24 +233,90 @@ class ExpenseTrackerView:
         self.remove_category_button = ttk.Button(settings_frame, text="Remove", command=self.remove_category)
         self.remove_category_button.grid(row=1, column=2, padx=10)
 
-    def update_category_menu(self, frame=None):
-        if frame is None:
-            frame = self.tabs.nametowidget(self.tabs.tabs()[0])
-        categories = self.controller.get_categories()
-        if hasattr(self, 'category_var'):
-            self.category_var.set(categories[0] if categories else "")
-            if hasattr(self, 'category_menu'):
-                self.category_menu['menu'].delete(0, 'end')
-                for category in categories:
-                    self.category_menu['menu'].add_command(label=category, command=tk._setit(self.category_var, category))
-            else:
-                self.category_menu = ttk.OptionMenu(frame, self.category_var, categories[0] if categories else "", *categories)
-                self.category_menu.grid(row=1, column=1, sticky=(tk.W, tk.E))
+        self.rename_category_button = ttk.Button(settings_frame, text="Rename", command=self.rename_category)
+        self.rename_category_button.grid(row=1, column=3, padx=10)
 
+        self.check_summaries_button = ttk.Button(settings_frame, text="Check Report Totals", command=self.check_summaries)
+        self.check_summaries_button.grid(row=2, column=0, pady=10, sticky=tk.W)
 
-    def update_categories(self):
-        self.update_category_menu(self.tabs.winfo_children()[0])
-        self.load_categories()
+        self.import_button = ttk.Button(settings_frame, text="Import Expenses", command=self.import_expenses)
+        self.import_button.grid(row=2, column=1, pady=10, sticky=tk.W)
+
+    def import_expenses(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Expense exports", "*.csv *.csv.gz *.db"),
+                                                          ("CSV files", "*.csv *.csv.gz"), ("SQLite files", "*.db")])
+        if file_path:
+            self.tasks.submit(self.controller.import_expenses, file_path, name="Import expenses",
+                              on_progress=self.update_progress,
+                              on_done=self.show_import_result,
+                              on_error=lambda e: messagebox.showerror("Error", f"Error importing expenses: {e}"))
+
+    def show_import_result(self, result):
+        if result is None:
+            messagebox.showerror("Error", "The file could not be imported.")
+            return
+        message = f"Imported {result.imported} expenses, skipped {result.duplicates} already present."
+        if result.errors:
+            message += f"\n{len(result.errors)} rows were rejected, e.g. row {result.errors[0].index}: {result.errors[0].message}"
+        messagebox.showinfo("Import", message)
+
+    def check_summaries(self):
+        self.tasks.submit(self.controller.check_summaries, name="Check report totals",
+                          on_done=self.confirm_rebuild_summaries,
+                          on_error=lambda e: messagebox.showerror("Error", f"Error checking report totals: {e}"))
+
+    def confirm_rebuild_summaries(self, mismatches):
+        if not mismatches:
+            messagebox.showinfo("Report Totals", "Report totals are consistent with the expenses.")
+        elif messagebox.askyesno("Report Totals", f"{len(mismatches)} report totals are out of date. Rebuild them now?"):
+            self.tasks.submit(self.controller.rebuild_summaries, name="Rebuild report totals",
+                              on_done=lambda _: messagebox.showinfo("Report Totals", "Report totals rebuilt."))
+
+    def on_category_event(self, event):
+        """Patch the category menus and list with one added, renamed or removed category."""
+        menus = [(self.category_menu, self.category_var, ''), (self.filter_category_menu, self.filter_category_var, 'All')]
+        listed = list(self.category_listbox.get(0, tk.END))
+        if event.kind == 'added':
+            for option_menu, var, _ in menus:
+                option_menu['menu'].add_command(label=event.name, command=tk._setit(var, event.name))
+            self.category_listbox.insert(tk.END, event.name)
+        else:
+            old_name = event.old_name if event.kind == 'renamed' else event.name
+            for option_menu, var, default in menus:
+                menu = option_menu['menu']
+                index = self.find_menu_entry(menu, old_name)
+                if event.kind == 'renamed':
+                    if index is not None:
+                        menu.entryconfigure(index, label=event.name, command=tk._setit(var, event.name))
+                    if var.get() == old_name:
+                        var.set(event.name)
+                else:
+                    if index is not None:
+                        menu.delete(index)
+                    if var.get() == old_name:
+                        var.set(default)
+            if old_name in listed:
+                index = listed.index(old_name)
+                self.category_listbox.delete(index)
+                if event.kind == 'renamed':
+                    self.category_listbox.insert(index, event.name)
+            # Rows on screen may show the old name
+            self.tree.reload()
+            self.filtered_tree.clear()
+        self.preferences.on_category_event(event)
+
+    @staticmethod
+    def find_menu_entry(menu, label):
+        last = menu.index('end')
+        for index in range(last + 1 if last is not None else 0):
+            if menu.entrycget(index, 'label') == label:
+                return index
+        return None
+
+    def on_expense_event(self, event):
+        # New expenses get the highest ids, so they go after the rows already listed
+        if event.kind == 'added':
+            self.tree.rows_appended(event.count)
 
     def clear_entries(self):
         self.amount_entry.delete(0, tk.END)
@@ -206,12 +325,10 @@ class ExpenseTrackerView:
         self.description_entry.delete(0, tk.END)
 
     def clear_tree(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.tree.clear()
 
     def clear_filtered_tree(self):
-        for item in self.filtered_tree.get_children():
-            self.filtered_tree.delete(item)
+        self.filtered_tree.clear()
 
     def setup_export_buttons(self):
         ttk.Label(self.root, text="Export Data:").grid(row=1, column=0, pady=10)
@@ -224,47 +341,70 @@ class ExpenseTrackerView:
         self.export_sqlite_button = ttk.Button(self.root, text="Export to SQLite", command=self.export_to_sqlite)
         self.export_sqlite_button.grid(row=1, column=0, padx=10)
 
+    def export_finished(self, file_path, kind):
+        """on_done of an export task; the exports return None when they failed and reported it themselves."""
+        def on_done(written):
+            if written is None:
+                messagebox.showerror("Error", f"Error exporting to {kind}: {file_path} was not written.")
+            else:
+                messagebox.showinfo("Success", f"Data exported to {file_path} successfully!")
+        return on_done
+
     def export_to_csv(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv"),
+                                                                                     ("Compressed CSV files", "*.csv.gz")])
         if file_path:
-            try:
-                self.controller.export_to_csv(file_path)
-                messagebox.showinfo("Success", f"Data exported to {file_path} successfully!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Error exporting to CSV: {e}")
+            self.tasks.submit(self.controller.export_to_csv, file_path, name="Export to CSV",
+                              on_progress=self.update_progress,
+                              on_done=self.export_finished(file_path, "CSV"),
+                              on_error=lambda e: messagebox.showerror("Error", f"Error exporting to CSV: {e}"))
 
     def export_to_pdf(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF files", "*.pdf")])
         if file_path:
-            try:
-                self.controller.export_to_pdf(file_path)
-                messagebox.showinfo("Success", f"Data exported to {file_path} successfully!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Error exporting to PDF: {e}")
+            on_done = self.export_finished(file_path, "PDF")
+            on_error = lambda e: messagebox.showerror("Error", f"Error exporting to PDF: {e}")
+            if self.controller.in_memory:
+                # Another process can't open an in-memory database
+                self.tasks.submit(self.controller.export_to_pdf, file_path, name="Export to PDF",
+                                  on_done=on_done, on_error=on_error)
+            else:
+                # Rendering is CPU bound, so it gets a process of its own
+                self.tasks.submit_cpu(export_pdf_file, self.controller.db_file, file_path, name="Export to PDF",
+                                      on_done=on_done, on_error=on_error)
 
     def export_to_sqlite(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".db", filetypes=[("SQLite files", "*.db")])
         if file_path:
-            try:
-                self.controller.export_to_sqlite(file_path)
-                messagebox.showinfo("Success", f"Data exported to {file_path} successfully!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Error exporting to SQLite: {e}")
+            self.tasks.submit(self.controller.export_to_sqlite, file_path, name="Export to SQLite",
+                              on_progress=self.update_progress,
+                              on_done=self.export_finished(file_path, "SQLite"),
+                              on_error=lambda e: messagebox.showerror("Error", f"Error exporting to SQLite: {e}"))
 
     def add_new_category(self):
         category = self.new_category_entry.get().strip()
         if category:
+            # The menus, the list and Preferences follow through on_category_event
             self.controller.add_category(category)
-            self.preferences.add_category(category)  # Notify Preferences to add category
-            self.update_categories()  # Update categories in both tabs
+            self.new_category_entry.delete(0, tk.END)
 
     def remove_category(self):
         category_index = self.category_listbox.curselection()
         if category_index:
             category = self.category_listbox.get(category_index[0])
+            count = {name: count for name, _, count in self.controller.get_category_totals()}.get(category, 0)
+            if count and not messagebox.askyesno("Remove Category", f"{count} expenses are in '{category}'. "
+                                                 "Remove it and leave them without a category?"):
+                return
             self.controller.remove_category(category)
-            self.preferences.remove_category(category)  # Notify Preferences to remove category
-            self.update_categories()  # Update categories in both tabs
+
+    def rename_category(self):
+        category_index = self.category_listbox.curselection()
+        if category_index:
+            category = self.category_listbox.get(category_index[0])
+            new_name = simpledialog.askstring("Rename Category", f"New name for '{category}':", parent=self.root)
+            if new_name and new_name.strip() and new_name.strip() != category:
+                self.controller.rename_category(category, new_name.strip())
 
     def load_categories(self):
         categories = self.controller.get_categories()
@@ -290,7 +430,6 @@ class ExpenseTrackerView:
             self.controller.add_expense(amount, category, date, description)
             messagebox.showinfo("Success", "Expense added successfully!")
             self.clear_entries()
-            self.load_expenses()
         except ValueError as ve:
             messagebox.showerror("Error", str(ve))
         except Exception as e:
@@ -298,10 +437,11 @@ class ExpenseTrackerView:
                 
 
     def load_expenses(self):
-        self.clear_tree()
-        expenses = self.controller.get_expenses()
-        for expense in expenses:
-            self.tree.insert("", tk.END, values=expense)
+        # Only the visible rows are fetched; the rest are paged in while scrolling.
+        # Counting the matches scans the table, so that happens in the background.
+        pages = self.controller.get_expense_pages()
+        self.tasks.submit(pages.count, name="Load expenses",
+                          on_done=lambda total: self.tree.set_source(pages, total))
 
     def filter_expenses(self):
         category = self.filter_category_var.get()
@@ -317,10 +457,14 @@ class ExpenseTrackerView:
             if end_date:
                 end_date = datetime.strptime(end_date, "%Y-%m-%d").date().strftime("%Y-%m-%d")
 
-            # Call controller method with formatted dates
-            filtered_expenses = self.controller.filter_expenses(category, start_date, end_date, min_amount, max_amount)
-
-            # Update GUI with filtered results (assuming implementation)
+            # Page through the matching rows instead of loading them all
+            query = self.search_entry.get().strip()
+            if query:
+                pages = self.controller.get_search_pages(query, category, start_date, end_date, min_amount, max_amount)
+            else:
+                pages = self.controller.get_expense_pages(category, start_date, end_date, min_amount, max_amount)
+            self.tasks.submit(pages.count, name="Filter expenses",
+                              on_done=lambda total: self.display_filtered_expenses(pages, total))
 
         except ValueError as e:
             print(f"ValueError in filter_expenses: {e}")
@@ -330,9 +474,7 @@ class ExpenseTrackerView:
             print(f"Exception in filter_expenses: {e}")
             # Handle unexpected errors
 
-    def display_filtered_expenses(self, expenses):
-        self.clear_filtered_tree()
-        for expense in expenses:
-            self.filtered_tree.insert("", tk.END, values=expense)
+    def display_filtered_expenses(self, pages, total=None):
+        self.filtered_tree.set_source(pages, total)
 
 
@@ -0,0 +1,265 @@
+"""Timings, a slow-query log and counters, for finding out what made the app slow.
+
+Everything is off by default and close to free while off. Turn it on for a
+run with EXPENSE_TRACKER_PROFILE=1, or at runtime with enable(). While on:
+
+- every public method of the classes decorated with @instrumented (the model,
+  the controller and the store) is timed, as is any `with timed(name):` block;
+- every SQL statement goes through a trace callback; one that takes longer
+  than EXPENSE_TRACKER_SLOW_QUERY_MS milliseconds (default 100) is printed
+  and kept with its EXPLAIN QUERY PLAN;
+- count() adds up counters such as rows_fetched and bytes_exported.
+
+snapshot() returns all of it as a dict and dump() writes it to a JSON file;
+with enable(profile=True) dump() can write cProfile stats instead, to a file
+ending in '.prof'. Set EXPENSE_TRACKER_PROFILE_OUTPUT to a file name to dump
+automatically when the process exits; a '.prof' name also turns on cProfile.
+
+The trace callback cannot time statements itself: a statement is timed from
+its start until the next statement on the same thread or the end of the
+instrumented method that ran it, whichever comes first. That includes
+fetching the rows in Python, which is part of what the user waits for.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import types
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+PROFILE_ENV = 'EXPENSE_TRACKER_PROFILE'
+OUTPUT_ENV = 'EXPENSE_TRACKER_PROFILE_OUTPUT'
+SLOW_QUERY_ENV = 'EXPENSE_TRACKER_SLOW_QUERY_MS'
+
+DEFAULT_SLOW_QUERY_MS = 100
+# Slow queries kept; older ones are dropped first
+MAX_SLOW_QUERIES = 200
+# Statements EXPLAIN QUERY PLAN can say something about
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+enabled = False
+slow_query_ms = DEFAULT_SLOW_QUERY_MS
+
+_lock = threading.Lock()
+_timings = defaultdict(lambda: [0, 0.0, 0.0])  # name: [calls, total seconds, longest seconds]
+_counters = defaultdict(int)
+_slow_queries = deque(maxlen=MAX_SLOW_QUERIES)
+_profiler = None
+
+# Called with True or False whenever tracing is switched, e.g. to install the
+# trace callback on connections that are already open
+_toggle_hooks = []
+
+
+class _ThreadState(threading.local):
+    def __init__(self):
+        self.depth = 0            # instrumented methods running on this thread
+        self.pending = None       # (connection, sql, start) of the statement running now
+        self.slow = []            # (connection, sql, seconds) waiting for their query plan
+        self.explaining = False
+
+
+_thread = _ThreadState()
+
+
+def on_toggle(hook):
+    _toggle_hooks.append(hook)
+
+
+def enable(slow_ms=None, profile=False):
+    """Start collecting; profile also runs cProfile.
+
+    slow_ms is the slow-query threshold, by default EXPENSE_TRACKER_SLOW_QUERY_MS
+    if set, otherwise the threshold stays what it was.
+    """
+    global enabled, slow_query_ms, _profiler
+    if slow_ms is None and os.environ.get(SLOW_QUERY_ENV):
+        slow_ms = float(os.environ[SLOW_QUERY_ENV])
+    if slow_ms is not None:
+        slow_query_ms = slow_ms
+    if profile and _profiler is None:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if not enabled:
+        enabled = True
+        for hook in _toggle_hooks:
+            hook(True)
+
+
+def disable():
+    """Stop collecting; what was collected so far stays until reset()."""
+    global enabled
+    if _profiler is not None:
+        _profiler.disable()
+    if enabled:
+        enabled = False
+        for hook in _toggle_hooks:
+            hook(False)
+
+
+def reset():
+    global _profiler
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _slow_queries.clear()
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+
+
+def count(name, amount=1):
+    if enabled:
+        with _lock:
+            _counters[name] += amount
+
+
+def fetched(rows):
+    """Count rows as fetched from the database and return them."""
+    count('rows_fetched', len(rows))
+    return rows
+
+
+def _record(name, seconds):
+    with _lock:
+        timing = _timings[name]
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+
+@contextmanager
+def timed(name):
+    """Time the block under name, like an instrumented method."""
+    if not enabled:
+        yield
+        return
+    _thread.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _leave(name, start)
+
+
+def _leave(name, start):
+    end = time.perf_counter()
+    _record(name, end - start)
+    _finish_statement(end)
+    _thread.depth = max(0, _thread.depth - 1)
+    if _thread.depth == 0 and _thread.slow:
+        _explain_slow_queries(name)
+
+
+def instrumented(cls):
+    """Class decorator timing every public method of cls as 'ClassName.method'."""
+    for attr, value in list(vars(cls).items()):
+        if not attr.startswith('_') and isinstance(value, types.FunctionType):
+            setattr(cls, attr, _timed_method(f'{cls.__name__}.{attr}', value))
+    return cls
+
+
+def _timed_method(name, method):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return method(*args, **kwargs)
+        _thread.depth += 1
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _leave(name, start)
+    return wrapper
+
+
+def trace_connection(conn):
+    """Route conn's statements through the slow-query log."""
+    conn.set_trace_callback(lambda sql: _statement(conn, sql))
+
+
+def _statement(conn, sql):
+    # Statements run by triggers and virtual tables come as '-- ' comments;
+    # they are part of the statement that fired them
+    if not enabled or _thread.explaining or sql.startswith('--'):
+        return
+    now = time.perf_counter()
+    _finish_statement(now)
+    _thread.pending = (conn, sql, now)
+    count('sql_statements')
+
+
+def _finish_statement(now):
+    if _thread.pending is None:
+        return
+    conn, sql, start = _thread.pending
+    _thread.pending = None
+    if (now - start) * 1000 >= slow_query_ms:
+        _thread.slow.append((conn, sql, now - start))
+
+
+def _explain_slow_queries(method):
+    # Runs once the outermost instrumented method is done, outside any trace
+    # callback, on the thread (and so the connection) that ran the queries
+    slow, _thread.slow = _thread.slow, []
+    for conn, sql, seconds in slow:
+        entry = {'sql': sql, 'ms': round(seconds * 1000, 1), 'method': method, 'plan': query_plan(conn, sql)}
+        with _lock:
+            _slow_queries.append(entry)
+        print(f"Slow query ({entry['ms']:.0f} ms in {method}): {sql}")
+
+
+def query_plan(conn, sql):
+    """EXPLAIN QUERY PLAN of sql as a list of lines, or None for statements without a plan."""
+    words = sql.split(None, 1)
+    if not words or words[0].upper() not in EXPLAINABLE:
+        return None
+    _thread.explaining = True
+    try:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()]
+    except sqlite3.Error as e:
+        # e.g. the connection was closed, or a temp table is gone by now
+        return [f'unavailable: {e}']
+    finally:
+        _thread.explaining = False
+
+
+def snapshot():
+    """Everything collected so far: timings slowest total first, counters and slow queries."""
+    with _lock:
+        timings = sorted(_timings.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'timings': {name: {'calls': calls, 'total_ms': round(total * 1000, 3),
+                               'mean_ms': round(total * 1000 / calls, 3), 'max_ms': round(longest * 1000, 3)}
+                        for name, (calls, total, longest) in timings},
+            'counters': dict(_counters),
+            'slow_queries': list(_slow_queries),
+        }
+
+
+def dump(file_path):
+    """Write cProfile stats if file_path ends in '.prof' (needs enable(profile=True)), else the snapshot as JSON."""
+    if file_path.endswith('.prof'):
+        if _profiler is None:
+            raise ValueError("cProfile stats need enable(profile=True)")
+        _profiler.dump_stats(file_path)
+    else:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot(), f, indent=2)
+
+
+def _configure_from_environment():
+    output = os.environ.get(OUTPUT_ENV)
+    if os.environ.get(PROFILE_ENV, '') in ('', '0') and not output:
+        return
+    enable(profile=bool(output and output.endswith('.prof')))
+    if output:
+        atexit.register(dump, output)
+
+
+_configure_from_environment()
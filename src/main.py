@@ -1,14 +1,37 @@
 # src/main.py
+import argparse
+import os
 import tkinter as tk
 from tkinter import ttk
-from gui import ExpenseTrackerView
-from controller import ExpenseTrackerController
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Expense Tracker")
+    parser.add_argument('--db', help="database file or 'file:' URI (default: $EXPENSE_TRACKER_DB, then data/expenses.db)")
+    parser.add_argument('--memory', action='store_true',
+                        help="keep the database in memory only; you are offered to save it on exit")
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args()
     root = tk.Tk()
-    controller = ExpenseTrackerController()
+    root.title("Expense Tracker")
+
+    # Put a window on screen before the GUI modules, theme and database load
+    loading = ttk.Label(root, text="Loading…", padding=40)
+    loading.grid()
+    root.update()
+
+    from gui import ExpenseTrackerView
+    from controller import ExpenseTrackerController
+
+    loading.destroy()
+    # EXPENSE_TRACKER_STORE=1 answers loads, filters and charts from the in-memory ExpenseStore,
+    # mapped from the snapshot in $EXPENSE_TRACKER_SNAPSHOT if set
+    controller = ExpenseTrackerController(use_store=os.environ.get('EXPENSE_TRACKER_STORE') == '1',
+                                          db_file=':memory:' if args.memory else args.db,
+                                          snapshot_dir=os.environ.get('EXPENSE_TRACKER_SNAPSHOT'))
     app = ExpenseTrackerView(root, controller)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
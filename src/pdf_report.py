@@ -0,0 +1,125 @@
+from datetime import datetime
+from matplotlib import rc_context
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_pdf import PdfPages
+
+PAGE_SIZE = (8.27, 11.69)  # A4 portrait, inches
+ROWS_PER_PAGE = 50
+
+# (header, width in characters, alignment) of the columns on the expense pages
+COLUMNS = (
+    ('ID', 8, 'right'),
+    ('Amount', 12, 'right'),
+    ('Category', 18, 'left'),
+    ('Date', 12, 'left'),
+    ('Description', 36, 'left'),
+)
+
+# Most month labels a chart axis shows before it starts skipping some
+MAX_TICK_LABELS = 24
+
+
+def _cell(value, width):
+    text = '' if value is None else f'{value:.2f}' if isinstance(value, float) else str(value)
+    return text if len(text) <= width else text[:width - 1] + '…'
+
+
+def _core_fonts_suffice(texts):
+    # The 14 standard PDF fonts only cover the cp1252 character set
+    try:
+        ''.join(texts).encode('cp1252')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def _save(pdf, fig, texts):
+    # Drawing with the standard PDF fonts skips embedding and per-glyph work and
+    # is several times faster; pages with other characters use embedded fonts
+    with rc_context({'pdf.use14corefonts': _core_fonts_suffice(texts)}):
+        pdf.savefig(fig)
+    # Figures made without pyplot are not tracked globally; clearing drops the
+    # artists right away instead of whenever the garbage collector gets to them
+    fig.clear()
+
+
+def _summary_page(pdf, title, row_count, distribution):
+    fig = Figure(figsize=PAGE_SIZE)
+    fig.text(0.08, 0.93, title, fontsize=18, weight='bold')
+    fig.text(0.08, 0.90, f'Generated {datetime.now():%Y-%m-%d %H:%M}', fontsize=9, color='gray')
+    fig.text(0.08, 0.85, f'Expenses: {row_count}', fontsize=11)
+    fig.text(0.08, 0.83, f'Total amount: {distribution.total:.2f}', fontsize=11)
+
+    lines = [f'{"Category":<20}{"Count":>8}{"Total":>14}{"Share":>9}']
+    for label, total, count, share in zip(distribution.labels, distribution.totals,
+                                          distribution.counts, distribution.shares()):
+        lines.append(f'{_cell(label, 19):<20}{count:>8}{total:>14.2f}{share:>9.1%}')
+    fig.text(0.08, 0.78, '\n'.join(lines), family='monospace', fontsize=9, va='top')
+    _save(pdf, fig, [title] + lines)
+
+
+def _chart_page(pdf, distribution, monthly):
+    fig = Figure(figsize=PAGE_SIZE)
+    pie = distribution.positive()
+    if pie.labels:
+        ax = fig.add_subplot(211)
+        ax.pie(pie.totals, labels=pie.labels, autopct='%1.1f%%', startangle=140)
+        ax.axis('equal')
+        ax.set_title('Expense Distribution by Category')
+    if monthly.periods:
+        ax = fig.add_subplot(212)
+        positions = range(len(monthly.periods))
+        ax.bar(positions, monthly.totals)
+        step = -(-len(positions) // MAX_TICK_LABELS)
+        ax.set_xticks(positions[::step], monthly.periods[::step], rotation=45, ha='right')
+        ax.set_title('Monthly Expenses')
+        ax.set_ylabel('Total Expenses')
+    fig.tight_layout(pad=3)
+    _save(pdf, fig, distribution.labels)
+
+
+def _format_row(values):
+    cells = []
+    for value, (_, width, align) in zip(values, COLUMNS):
+        text = _cell(value, width)
+        cells.append(text.rjust(width) if align == 'right' else text.ljust(width))
+    return '  '.join(cells).rstrip()
+
+
+def _rows_page(pdf, rows, page_number, page_count, rows_per_page):
+    fig = Figure(figsize=PAGE_SIZE)
+    # Fixed-width lines in a monospace font line the columns up without a table,
+    # whose per-cell artists make matplotlib's layout far slower
+    lines = [_format_row([header for header, _, _ in COLUMNS])] + [_format_row(row) for row in rows]
+    step = 0.88 / (rows_per_page + 1)
+    for index, line in enumerate(lines):
+        fig.text(0.06, 0.95 - index * step, line, family='monospace', fontsize=8, va='top')
+    fig.text(0.5, 0.03, f'Page {page_number} of {page_count}', ha='center', fontsize=8, color='gray')
+    _save(pdf, fig, lines)
+
+
+def write_pdf_report(file_path, pages, row_count, distribution, monthly, title='Expense Report',
+                     rows_per_page=ROWS_PER_PAGE, progress=None):
+    """Write a multi-page PDF report.
+
+    pages yields lists of at most rows_per_page (id, amount, category, date,
+    description) rows, e.g. successive cursor.fetchmany(rows_per_page) calls;
+    row_count is the total number of rows they will produce. distribution and
+    monthly are the reports.Distribution and reports.TimeSeries shown on the
+    summary and chart pages. Each page is written and freed before the next one
+    is drawn, so memory use stays flat and time grows linearly with the rows.
+    progress, if given, is called with the fraction of rows written.
+    """
+    page_count = max(1, -(-row_count // rows_per_page))
+    with PdfPages(file_path) as pdf:
+        _summary_page(pdf, title, row_count, distribution)
+        _chart_page(pdf, distribution, monthly)
+
+        written = 0
+        for page_number, rows in enumerate(pages, start=1):
+            if not rows:
+                break
+            _rows_page(pdf, rows, page_number, page_count, rows_per_page)
+            written += len(rows)
+            if progress:
+                progress(written / row_count if row_count else 1.0)
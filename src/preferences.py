@@ -1,69 +1,37 @@
-import sqlite3
-from tkinter import ttk, messagebox
-from data import DB_FILE
+from tkinter import ttk
 
 class Preferences(ttk.Frame):
-    def __init__(self, parent, controller, update_categories):
+    def __init__(self, parent, controller):
         super().__init__(parent)
         self.parent = parent
         self.controller = controller
-        self.update_categories = update_categories
 
-        self.conn = None
-        self.cursor = None
-        self.connect_to_database()
-        self.create_categories_table()
-        self.load_categories_from_db()
+        # Categories come from the model's category cache; after that, changes
+        # arrive through on_category_event
+        self.categories = self.controller.get_categories()
+        self.category_labels = {}
 
         self.setup_ui()
 
-    def connect_to_database(self):
-        try:
-            self.conn = sqlite3.connect(DB_FILE)
-            self.cursor = self.conn.cursor()
-        except sqlite3.Error as e:
-            print(f"Error connecting to database: {e}")
-            messagebox.showerror("Database Error", f"Error connecting to database: {e}")
-
-    def create_categories_table(self):
-        try:
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS categories (
-                                    id INTEGER PRIMARY KEY,
-                                    name TEXT UNIQUE)''')
-            self.conn.commit()
-        except sqlite3.Error as e:
-            print(f"Error creating categories table: {e}")
-            messagebox.showerror("Database Error", f"Error creating categories table: {e}")
-
-    def load_categories_from_db(self):
-        try:
-            self.cursor.execute('SELECT name FROM categories')
-            self.categories = [row[0] for row in self.cursor.fetchall()]
-        except sqlite3.Error as e:
-            print(f"Error loading categories from database: {e}")
-            messagebox.showerror("Database Error", f"Error loading categories from database: {e}")
-
     def add_category(self, category):
-        try:
-            self.cursor.execute('INSERT INTO categories (name) VALUES (?)', (category,))
-            self.conn.commit()
-            self.load_categories_from_db()
-            self.update_categories()
-        except sqlite3.IntegrityError:
-            messagebox.showerror("Integrity Error", "Category already exists!")
-        except sqlite3.Error as e:
-            print(f"Error adding category: {e}")
-            messagebox.showerror("Database Error", f"Error adding category: {e}")
+        self.controller.add_category(category)
 
     def remove_category(self, category):
-        try:
-            self.cursor.execute('DELETE FROM categories WHERE name=?', (category,))
-            self.conn.commit()
-            self.load_categories_from_db()
-            self.update_categories()
-        except sqlite3.Error as e:
-            print(f"Error removing category: {e}")
-            messagebox.showerror("Database Error", f"Error removing category: {e}")
+        self.controller.remove_category(category)
+
+    def on_category_event(self, event):
+        """Patch the category list with one added, renamed or removed category."""
+        if event.kind == 'added':
+            self.categories.append(event.name)
+            self.add_category_label(event.name)
+        elif event.kind == 'renamed' and event.old_name in self.categories:
+            self.categories[self.categories.index(event.old_name)] = event.name
+            label = self.category_labels.pop(event.old_name)
+            label.config(text=event.name)
+            self.category_labels[event.name] = label
+        elif event.kind == 'removed' and event.name in self.categories:
+            self.categories.remove(event.name)
+            self.category_labels.pop(event.name).destroy()
 
     def setup_ui(self):
         ttk.Label(self, text="Preferences Panel").pack(padx=10, pady=10)
@@ -71,16 +39,13 @@ class Preferences(ttk.Frame):
 
         ttk.Label(self, text="Categories:").pack(padx=10, pady=5)
         for category in self.categories:
-            ttk.Label(self, text=category).pack(padx=10, pady=2)
+            self.add_category_label(category)
+
+    def add_category_label(self, category):
+        label = ttk.Label(self, text=category)
+        label.pack(padx=10, pady=2)
+        self.category_labels[category] = label
 
     def add_category_button_click(self):
         category = "New Category"
         self.add_category(category)
-        self.setup_ui()
-
-    def close_connection(self):
-        try:
-            self.conn.close()
-        except sqlite3.Error as e:
-            print(f"Error closing database connection: {e}")
-            messagebox.showerror("Database Error", f"Error closing database connection: {e}")
@@ -0,0 +1,119 @@
+from collections import namedtuple
+
+# SQL expression giving the period an ISO date falls in, for each bucket size.
+# Every label sorts chronologically; weeks start on Monday and are labelled by
+# that Monday's date.
+BUCKETS = {
+    'day': 'date',
+    'week': "date(date, 'weekday 0', '-6 days')",
+    'month': 'substr(date, 1, 7)',
+    'year': 'substr(date, 1, 4)',
+}
+
+
+class Distribution(namedtuple('Distribution', ['labels', 'totals', 'counts'])):
+    """Total amount and number of expenses per category, largest total first."""
+    __slots__ = ()
+
+    @property
+    def total(self):
+        return sum(self.totals)
+
+    def shares(self):
+        """Fraction of the overall total for each label."""
+        total = self.total
+        return [value / total if total else 0.0 for value in self.totals]
+
+    def positive(self):
+        """The categories with a total above zero, the only wedges a pie chart can draw.
+
+        Refunds, entered as negative amounts, can leave a category at zero or below.
+        """
+        kept = [index for index, total in enumerate(self.totals) if total > 0]
+        return Distribution([self.labels[i] for i in kept], [self.totals[i] for i in kept],
+                            [self.counts[i] for i in kept])
+
+
+class TimeSeries(namedtuple('TimeSeries', ['bucket', 'periods', 'totals', 'counts'])):
+    """Total amount and number of expenses per period, oldest period first."""
+    __slots__ = ()
+
+
+class CategoryTimeSeries(namedtuple('CategoryTimeSeries', ['bucket', 'periods', 'categories', 'totals'])):
+    """Totals per category and period: totals[i][j] is categories[i] in periods[j]."""
+    __slots__ = ()
+
+    def series(self, category):
+        return self.totals[self.categories.index(category)]
+
+
+def _filtered(model, filters):
+    """FROM item, WHERE clause and parameters of the expenses matching filters, archives included."""
+    conditions, params = model.build_filter_conditions(**filters)
+    source = model.expense_source('expenses', **filters)
+    return source + (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+
+def _has_filters(filters):
+    return any(value not in (None, '', 'All') for value in filters.values())
+
+
+def expense_distribution(model, **filters):
+    """Distribution of spending over categories.
+
+    filters are the keyword arguments of ExpenseModel.filter_expenses. Without
+    filters the answer comes straight from the category_totals summary table.
+    """
+    if _has_filters(filters):
+        source, params = _filtered(model, filters)
+        model.cursor.execute(f"SELECT category_id, SUM(IFNULL(amount, 0)), COUNT(*) "
+                             f"FROM {source} GROUP BY 1", params)
+        names = model.get_category_names()
+        rows = [(names.get(row[0], ''), row[1], row[2]) for row in model.cursor.fetchall()]
+    else:
+        rows = model.get_category_totals()
+
+    rows = sorted(rows, key=lambda row: row[1], reverse=True)
+    return Distribution([row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows])
+
+
+def expense_timeseries(model, bucket='month', **filters):
+    """Spending per day, week, month or year.
+
+    Monthly totals without filters come from the monthly_totals summary table,
+    everything else is a single GROUP BY over the (indexed) date column.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', expected one of {', '.join(BUCKETS)}.")
+
+    if bucket == 'month' and not _has_filters(filters):
+        rows = model.get_monthly_totals()
+    else:
+        source, params = _filtered(model, filters)
+        model.cursor.execute(f"SELECT {BUCKETS[bucket]} AS period, SUM(IFNULL(amount, 0)), COUNT(*) "
+                             f"FROM {source} GROUP BY period ORDER BY period", params)
+        rows = model.cursor.fetchall()
+
+    return TimeSeries(bucket, [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows])
+
+
+def category_timeseries(model, bucket='month', **filters):
+    """Spending per period broken down by category, with zeros for empty cells."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', expected one of {', '.join(BUCKETS)}.")
+
+    source, params = _filtered(model, filters)
+    model.cursor.execute(f"SELECT {BUCKETS[bucket]} AS period, category_id, SUM(IFNULL(amount, 0)) "
+                         f"FROM {source} GROUP BY 1, 2 ORDER BY 1", params)
+    names = model.get_category_names()
+    rows = [(period, names.get(category_id, ''), total) for period, category_id, total in model.cursor.fetchall()]
+
+    periods = sorted({row[0] for row in rows})
+    categories = sorted({row[1] for row in rows})
+    period_index = {period: j for j, period in enumerate(periods)}
+    category_index = {category: i for i, category in enumerate(categories)}
+    totals = [[0.0] * len(periods) for _ in categories]
+    for period, category, total in rows:
+        totals[category_index[category]][period_index[period]] = total
+
+    return CategoryTimeSeries(bucket, periods, categories, totals)
@@ -0,0 +1,331 @@
+"""Memory-mapped columnar snapshots of the expenses, for analytics on long histories.
+
+A snapshot is a directory of fixed-width little-endian column files, one
+value per expense in id order, plus a dictionary of the distinct
+descriptions and a manifest:
+
+    manifest.json                   rows, last id, categories and the files below
+    ids-N.bin                       int64
+    amounts-N.bin                   float64, NaN for NULL
+    days-N.bin                      int32 days since the epoch, store.INVALID_DAY for bad dates
+    category_ids-N.bin              int32, 0 for expenses without a category
+    description_codes-N.bin         int32 index into the dictionary, -1 for NULL
+    descriptions-N.offsets          int64 end offset of each description in:
+    descriptions-N.utf8             the descriptions, UTF-8, back to back
+
+Snapshot() maps the columns with np.memmap: opening one is a few small
+reads however long the history, nothing is copied, and processes opening the
+same snapshot share its pages through the page cache.
+
+refresh_snapshot() appends the expenses with ids above the last one written
+and then replaces the manifest, so readers never see a partly written row. The
+model only ever appends expenses, moves them between the database and its
+archives, or changes their category; the manifest keeps per-category counts
+and totals, and when those no longer add up to the category_totals summary
+tables the snapshot is written anew. A new snapshot goes to files of the
+next generation N, so snapshots already open keep reading the old ones.
+"""
+import json
+import os
+
+import numpy as np
+
+import instrumentation
+from data import DEFAULT_CHUNK_SIZE
+from store import to_days
+
+# Bumped whenever the layout changes; a snapshot of another version is written anew
+FORMAT_VERSION = 1
+
+MANIFEST = 'manifest.json'
+
+# Column name and dtype, fixed little-endian so snapshots can be copied between machines
+COLUMNS = {
+    'ids': '<i8',
+    'amounts': '<f8',
+    'days': '<i4',
+    'category_ids': '<i4',
+    'description_codes': '<i4',
+}
+OFFSETS_DTYPE = '<i8'
+
+
+def column_file(directory, name, generation):
+    return os.path.join(directory, f'{name}-{generation}.bin')
+
+
+def dictionary_files(directory, generation):
+    """(offsets, utf8) file paths of the description dictionary."""
+    base = os.path.join(directory, f'descriptions-{generation}')
+    return base + '.offsets', base + '.utf8'
+
+
+def read_manifest(directory):
+    """The manifest of the snapshot in directory, or None if there is no readable one."""
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == FORMAT_VERSION else None
+
+
+def write_manifest(directory, manifest):
+    # Written aside and renamed over the old one, so a reader sees either
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def map_array(file_path, dtype, length):
+    """The first length values of file_path as a read-only array backed by np.memmap."""
+    if length == 0:
+        # mmap refuses empty files and empty mappings
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', shape=(length,)).view(np.ndarray)
+
+
+class Snapshot:
+    """A snapshot opened read-only.
+
+    ids, amounts, days, category_ids and description_codes are NumPy arrays
+    mapped from the column files; categories maps category ids to names as
+    they were at the last refresh. The description dictionary is decoded on
+    first use.
+    """
+
+    def __init__(self, directory):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise FileNotFoundError(f"No snapshot in '{directory}'.")
+        self.directory = directory
+        self.generation = manifest['generation']
+        self.rows = manifest['rows']
+        self.last_id = manifest['last_id']
+        self.categories = {int(category_id): name for category_id, name in manifest['categories'].items()}
+        self.description_count = manifest['descriptions']
+        self.description_bytes = manifest['description_bytes']
+        for name, dtype in COLUMNS.items():
+            setattr(self, name, map_array(column_file(directory, name, self.generation), dtype, self.rows))
+        self._dictionary = None
+
+    def category_list(self):
+        """Category names indexed by category id, None where no category has the id, e.g. 0."""
+        size = max(self.categories, default=0) + 1
+        if self.rows:
+            size = max(size, int(self.category_ids.max()) + 1)
+        names = [None] * size
+        for category_id, name in self.categories.items():
+            names[category_id] = name
+        return names
+
+    def dictionary(self):
+        """The distinct descriptions as an object array indexed by description code.
+
+        One None is added at the end, so indexing with code -1 gives None for NULL.
+        """
+        if self._dictionary is None:
+            offsets_file, text_file = dictionary_files(self.directory, self.generation)
+            ends = map_array(offsets_file, OFFSETS_DTYPE, self.description_count)
+            text = bytes(map_array(text_file, np.uint8, self.description_bytes))
+            dictionary = np.empty(self.description_count + 1, dtype=object)
+            start = 0
+            for code, end in enumerate(ends.tolist()):
+                dictionary[code] = text[start:end].decode('utf-8')
+                start = end
+            self._dictionary = dictionary
+        return self._dictionary
+
+    def descriptions(self):
+        """The description of every row as an object array."""
+        return self.dictionary()[self.description_codes]
+
+
+class SnapshotWriter:
+    """Appends rows to the files of one snapshot generation."""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.generation = manifest['generation']
+        self.rows = manifest['rows']
+        self.last_id = manifest['last_id']
+        self.stats = {int(category_id): stats for category_id, stats in manifest['category_stats'].items()}
+        self.codes = None
+        self.description_count = manifest['descriptions']
+        self.description_bytes = manifest['description_bytes']
+
+        # Bytes past the manifest's counts were left by a refresh that did not finish
+        self.files = {name: self.open(column_file(directory, name, self.generation),
+                                      self.rows * np.dtype(dtype).itemsize)
+                      for name, dtype in COLUMNS.items()}
+        offsets_file, text_file = dictionary_files(directory, self.generation)
+        self.files['offsets'] = self.open(offsets_file, self.description_count * np.dtype(OFFSETS_DTYPE).itemsize)
+        self.files['text'] = self.open(text_file, self.description_bytes)
+
+    @staticmethod
+    def open(file_path, length):
+        f = open(file_path, 'ab')
+        if f.tell() != length:
+            f.truncate(length)
+            f.seek(length)
+        return f
+
+    def description_codes(self, descriptions):
+        if self.codes is None:
+            # The dictionary is only read back when there is something to append
+            self.codes = {}
+            offsets_file, text_file = dictionary_files(self.directory, self.generation)
+            ends = map_array(offsets_file, OFFSETS_DTYPE, self.description_count)
+            with open(text_file, 'rb') as f:
+                text = f.read(self.description_bytes)
+            start = 0
+            for code, end in enumerate(ends.tolist()):
+                self.codes[text[start:end].decode('utf-8')] = code
+                start = end
+
+        codes = np.empty(len(descriptions), dtype=COLUMNS['description_codes'])
+        new_ends = []
+        encoded = []
+        for index, description in enumerate(descriptions):
+            if description is None:
+                codes[index] = -1
+                continue
+            code = self.codes.get(description)
+            if code is None:
+                code = self.codes[description] = self.description_count
+                data = description.encode('utf-8')
+                encoded.append(data)
+                self.description_bytes += len(data)
+                self.description_count += 1
+                new_ends.append(self.description_bytes)
+            codes[index] = code
+        if encoded:
+            self.files['text'].write(b''.join(encoded))
+            self.files['offsets'].write(np.array(new_ends, dtype=OFFSETS_DTYPE).tobytes())
+        return codes
+
+    def append(self, rows):
+        """Append (id, amount, category_id, date, description) rows, in id order."""
+        ids, amounts, category_ids, dates, descriptions = zip(*rows)
+        columns = {
+            'ids': np.array(ids, dtype=COLUMNS['ids']),
+            'amounts': np.array(amounts, dtype=COLUMNS['amounts']),  # NULL becomes nan
+            'days': to_days(dates).astype(COLUMNS['days']),
+            'category_ids': np.array(category_ids, dtype=COLUMNS['category_ids']),
+            'description_codes': self.description_codes(descriptions),
+        }
+        for name, values in columns.items():
+            self.files[name].write(values.tobytes())
+
+        category_ids = columns['category_ids']
+        counts = np.bincount(category_ids)
+        totals = np.bincount(category_ids, weights=np.nan_to_num(columns['amounts']))
+        for category_id in np.flatnonzero(counts).tolist():
+            count, total = self.stats.get(category_id, (0, 0.0))
+            self.stats[category_id] = (count + int(counts[category_id]), total + float(totals[category_id]))
+        self.rows += len(rows)
+        self.last_id = int(columns['ids'][-1])
+
+    def close(self):
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+    def finish(self, categories):
+        """Flush the files and return the manifest describing them."""
+        self.close()
+        return dict(self.manifest, rows=self.rows, last_id=self.last_id, descriptions=self.description_count,
+                    description_bytes=self.description_bytes, categories=categories,
+                    category_stats={str(category_id): list(stats) for category_id, stats in self.stats.items()})
+
+
+def new_manifest(generation):
+    return {'version': FORMAT_VERSION, 'generation': generation, 'rows': 0, 'last_id': 0,
+            'categories': {}, 'category_stats': {}, 'descriptions': 0, 'description_bytes': 0,
+            'columns': COLUMNS}
+
+
+def matches(stats, summary, tolerance=1e-6):
+    """Whether the per-category (count, total) of a snapshot equal those of the summary tables."""
+    stats = {category_id: value for category_id, value in stats.items() if value[0]}
+    if stats.keys() != summary.keys():
+        return False
+    return all(stats[key][0] == summary[key][0]
+               and abs(stats[key][1] - summary[key][1]) <= tolerance * max(1.0, abs(summary[key][1]))
+               for key in summary)
+
+
+def remove_generation(directory, generation):
+    files = [column_file(directory, name, generation) for name in COLUMNS]
+    for file_path in files + list(dictionary_files(directory, generation)):
+        try:
+            os.remove(file_path)
+        except OSError:
+            # Missing, or on Windows still mapped by a reader; the next full write leaves it behind too
+            pass
+
+
+@instrumentation.timed('snapshot.refresh')
+def refresh_snapshot(model, directory, conn=None, full=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Bring the snapshot in directory up to date with the model's expenses; returns the rows appended.
+
+    Expenses in the archives are included. Only expenses with ids above the
+    snapshot's last id are read, unless there is no snapshot yet, full is
+    True, or the expenses already written no longer match the database, in
+    which case a new snapshot is written from scratch. conn, by default the
+    model's, is the connection read from.
+    """
+    conn = conn if conn is not None else model.conn
+    os.makedirs(directory, exist_ok=True)
+    old = read_manifest(directory)
+    # Attaching archives is not possible inside the transaction below
+    conn.commit()
+    source = model.expense_source('expense_details', conn=conn)
+    totals_source = model.expense_source('category_totals', conn=conn)
+    # One read transaction, so the rows and the summary totals agree
+    conn.execute('BEGIN')
+    try:
+        # Category names are stored whole on every refresh, so renames need no rewrite
+        categories = {str(category_id): name for category_id, name in
+                      conn.execute('SELECT id, name FROM main.categories')}
+        summary = {category_id: (count, total) for category_id, count, total in conn.execute(
+            f'''SELECT category_id, SUM(count), SUM(total) FROM {totals_source}
+                GROUP BY category_id HAVING SUM(count) > 0''')}
+
+        def write(manifest):
+            writer = SnapshotWriter(directory, manifest)
+            try:
+                cursor = conn.execute(f'''SELECT id, amount, IFNULL(category_id, 0), date, description
+                                          FROM {source} WHERE id > ? ORDER BY id''', (writer.last_id,))
+                while True:
+                    rows = instrumentation.fetched(cursor.fetchmany(chunk_size))
+                    if not rows:
+                        break
+                    writer.append(rows)
+            except BaseException:
+                writer.close()
+                raise
+            return writer.finish(categories), writer.rows - manifest['rows']
+
+        if old is not None and not full:
+            manifest, appended = write(old)
+            if matches({int(key): value for key, value in manifest['category_stats'].items()}, summary):
+                write_manifest(directory, manifest)
+                return appended
+
+        generation = old['generation'] + 1 if old is not None else 0
+        remove_generation(directory, generation)
+        manifest, appended = write(new_manifest(generation))
+        if not matches({int(key): value for key, value in manifest['category_stats'].items()}, summary):
+            print("Warning: the category_totals summary does not match the expenses; see check_summaries")
+        write_manifest(directory, manifest)
+        if old is not None:
+            remove_generation(directory, old['generation'])
+        return appended
+    finally:
+        conn.rollback()
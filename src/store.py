@@ -0,0 +1,267 @@
+import sqlite3
+import threading
+import numpy as np
+from data import INSERT_EXPENSE
+import instrumentation
+import reports
+
+# Stands in for dates that are not valid ISO dates; no date filter matches it
+INVALID_DAY = np.iinfo(np.int32).min
+
+# datetime64 unit a day is truncated to for each of the reports.BUCKETS; weeks are counted in days
+PERIOD_UNITS = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+
+def to_days(dates):
+    """Convert ISO date strings to int32 days since the epoch."""
+    try:
+        values = np.array(dates, dtype='datetime64[D]')
+        days = values.astype(np.int64)
+        days[np.isnat(values)] = INVALID_DAY  # NULL dates
+        return days.astype(np.int32)
+    except ValueError:
+        days = np.empty(len(dates), dtype=np.int32)
+        for index, value in enumerate(dates):
+            try:
+                days[index] = np.datetime64(value, 'D').astype(np.int32)
+            except (TypeError, ValueError):
+                days[index] = INVALID_DAY
+        return days
+
+
+def day_bound(value):
+    return int(np.datetime64(value, 'D').astype(np.int32))
+
+
+@instrumentation.instrumented
+class ExpenseStore:
+    """Columnar in-memory copy of the expenses, answering queries with NumPy.
+
+    Holds float64 amounts, int32 days since the epoch and int32 codes into a
+    category dictionary, next to the ids and descriptions. filter_expenses and
+    the chart aggregations run as vectorized masks and np.bincount over
+    category codes or period offsets instead of SQL queries, and return what
+    the ExpenseModel methods of the same names return.
+
+    The store keeps a connection of its own. Expenses added through
+    add_expense are written on it and appended to the columns; a write by any
+    other connection changes that connection's PRAGMA data_version, and the
+    next query reloads everything.
+
+    With snapshot_dir, the columns are instead mapped from a snapshot.Snapshot
+    in that directory, refreshed incrementally on every reload: ids, amounts,
+    days and category codes are not copied, and the codes are category ids.
+    """
+
+    def __init__(self, model, snapshot_dir=None):
+        self.model = model
+        self.snapshot_dir = snapshot_dir
+        self.conn = model.db.open_connection(check_same_thread=False)
+        self.lock = threading.Lock()
+        self.data_version = None
+        self.size = 0
+
+    def current_version(self):
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def refresh(self):
+        """Reload the columns if another connection wrote since the last load."""
+        with self.lock:
+            version = self.current_version()
+            if version != self.data_version:
+                self.load()
+                self.data_version = version
+
+    def load(self):
+        if self.snapshot_dir is not None:
+            self.load_snapshot()
+            return
+        source = self.model.expense_source('expense_details', conn=self.conn)
+        rows = instrumentation.fetched(
+            self.conn.execute(f'SELECT id, amount, category, date, description FROM {source} ORDER BY id').fetchall())
+        ids, amounts, categories, dates, descriptions = zip(*rows) if rows else ((), (), (), (), ())
+
+        self.categories = []
+        self.category_codes = {}
+        codes = [self.category_code(category) for category in categories]
+
+        self.size = len(rows)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.amounts = np.array(amounts, dtype=np.float64)  # NULL becomes nan
+        self.days = to_days(dates)
+        self.codes = np.array(codes, dtype=np.int32)
+        self.descriptions = np.empty(self.size, dtype=object)
+        self.descriptions[:] = descriptions
+
+    def load_snapshot(self):
+        from snapshot import Snapshot, refresh_snapshot
+
+        refresh_snapshot(self.model, self.snapshot_dir, conn=self.conn)
+        snapshot = Snapshot(self.snapshot_dir)
+        self.categories = snapshot.category_list()
+        self.category_codes = {name: code for code, name in enumerate(self.categories) if name is not None}
+        self.category_codes[None] = 0
+
+        self.size = snapshot.rows
+        self.ids = snapshot.ids
+        self.amounts = snapshot.amounts
+        self.days = snapshot.days
+        self.codes = snapshot.category_ids
+        self.descriptions = snapshot.descriptions()
+
+    def category_code(self, category, category_id=None):
+        code = self.category_codes.get(category)
+        if code is None:
+            # Snapshot columns hold category ids, so there the code of a new category is its id
+            code = len(self.categories) if self.snapshot_dir is None else category_id
+            self.categories.extend([None] * (code + 1 - len(self.categories)))
+            self.categories[code] = category
+            self.category_codes[category] = code
+        return code
+
+    def add_expense(self, amount, category, date, description):
+        """Insert one expense and append it to the columns without a reload; returns True."""
+        self.refresh()
+        with self.lock:
+            category_id = None
+            if category:
+                self.conn.execute('INSERT OR IGNORE INTO categories (name) VALUES (?)', (category,))
+                category_id = self.conn.execute('SELECT id FROM categories WHERE name = ?', (category,)).fetchone()[0]
+            cursor = self.conn.execute(INSERT_EXPENSE, (amount, category_id, date, description))
+            self.conn.commit()
+            if self.size == len(self.ids):
+                self.grow()
+            index = self.size
+            self.ids[index] = cursor.lastrowid
+            self.amounts[index] = np.nan if amount is None else amount
+            self.days[index] = to_days([date])[0]
+            self.codes[index] = self.category_code(category or None, category_id)
+            self.descriptions[index] = description
+            self.size += 1
+            # Our own commit does not change data_version, so the columns stay valid
+        return True
+
+    def grow(self):
+        # Double the capacity so a run of appends costs amortized constant time;
+        # this also copies columns mapped from a snapshot, which are read-only
+        capacity = max(16, 2 * len(self.ids))
+        for name in ('ids', 'amounts', 'days', 'codes', 'descriptions'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def columns(self):
+        """Refresh if needed and return a consistent snapshot of the used part of the columns."""
+        self.refresh()
+        with self.lock:
+            size = self.size
+            return (self.ids[:size], self.amounts[:size], self.days[:size], self.codes[:size],
+                    self.descriptions[:size], list(self.categories))
+
+    def mask(self, amounts, days, codes, categories, category=None, start_date=None, end_date=None,
+             min_amount=None, max_amount=None):
+        """Boolean mask of the rows matching the filter_expenses arguments, or None for all rows."""
+        mask = None
+
+        def both(condition):
+            return condition if mask is None else mask & condition
+
+        if category and category != 'All':
+            code = categories.index(category) if category in categories else -1
+            mask = both(codes == code)
+        if start_date:
+            mask = both(days >= day_bound(start_date))
+        if end_date:
+            mask = both(days <= day_bound(end_date))
+        if start_date or end_date:
+            mask &= days != INVALID_DAY
+        if min_amount not in (None, ''):
+            mask = both(amounts >= float(min_amount))
+        if max_amount not in (None, ''):
+            mask = both(amounts <= float(max_amount))
+        return mask
+
+    def filter_expenses(self, category=None, start_date=None, end_date=None, min_amount=None, max_amount=None):
+        ids, amounts, days, codes, descriptions, categories = self.columns()
+        mask = self.mask(amounts, days, codes, categories, category, start_date, end_date, min_amount, max_amount)
+        if mask is not None:
+            amounts, days, codes, descriptions = amounts[mask], days[mask], codes[mask], descriptions[mask]
+        labels = np.array(categories, dtype=object)[codes]
+        dates = np.datetime_as_string(days.astype('datetime64[D]')).astype(object)
+        dates[days == INVALID_DAY] = None
+        missing = np.isnan(amounts)
+        if missing.any():
+            amounts = amounts.astype(object)
+            amounts[missing] = None
+        return list(zip(amounts.tolist(), labels.tolist(), dates.tolist(), descriptions.tolist()))
+
+    def get_expenses(self):
+        return self.filter_expenses()
+
+    def plot_expense_distribution(self, **filters):
+        """Totals and counts per category as a reports.Distribution, largest total first."""
+        ids, amounts, days, codes, descriptions, categories = self.columns()
+        mask = self.mask(amounts, days, codes, categories, **filters)
+        if mask is not None:
+            amounts, codes = amounts[mask], codes[mask]
+        totals = np.bincount(codes, weights=np.nan_to_num(amounts), minlength=len(categories))
+        counts = np.bincount(codes, minlength=len(categories))
+
+        present = np.flatnonzero(counts)
+        present = present[np.argsort(-totals[present], kind='stable')]
+        labels = ['' if categories[code] is None else categories[code] for code in present]
+        return reports.Distribution(labels, totals[present].tolist(), counts[present].tolist())
+
+    def plot_monthly_expenses(self, **filters):
+        return self.get_expense_timeseries('month', **filters)
+
+    def get_expense_timeseries(self, bucket='month', by_category=False, **filters):
+        """Spending per 'day', 'week', 'month' or 'year', optionally split by category."""
+        if bucket not in reports.BUCKETS:
+            raise ValueError(f"Unknown bucket '{bucket}', expected one of {', '.join(reports.BUCKETS)}.")
+        ids, amounts, days, codes, descriptions, categories = self.columns()
+        mask = self.mask(amounts, days, codes, categories, **filters)
+        if mask is not None:
+            amounts, days, codes = amounts[mask], days[mask], codes[mask]
+        valid = days != INVALID_DAY
+        amounts, days, codes = np.nan_to_num(amounts[valid]), days[valid], codes[valid]
+
+        unit = PERIOD_UNITS.get(bucket, 'D')
+        if bucket == 'week':
+            # 1970-01-01 was a Thursday, so (days + 3) % 7 is the weekday counted from Monday
+            periods = days - (days + 3) % 7
+        else:
+            periods = days.astype('datetime64[D]').astype(f'datetime64[{unit}]').astype(np.int64)
+        if not len(periods):
+            if by_category:
+                return reports.CategoryTimeSeries(bucket, [], [], [])
+            return reports.TimeSeries(bucket, [], [], [])
+
+        # Periods as offsets from the first one, so bincount sums them without sorting
+        first = periods.min()
+        offsets = periods - first
+        span = int(offsets.max()) + 1
+        counts = np.bincount(offsets, minlength=span)
+        present = np.flatnonzero(counts)
+        labels = np.datetime_as_string((present + first).astype(f'datetime64[{unit}]')).tolist()
+
+        if by_category:
+            used = np.unique(codes)
+            names = ['' if categories[code] is None else categories[code] for code in used]
+            order = np.argsort(names, kind='stable')
+            row_of = np.zeros(len(categories), dtype=np.int64)
+            row_of[used[order]] = np.arange(len(used))
+            cells = np.bincount(row_of[codes] * span + offsets, weights=amounts,
+                                minlength=len(used) * span).reshape(len(used), span)
+            return reports.CategoryTimeSeries(bucket, labels, [names[i] for i in order],
+                                              cells[:, present].tolist())
+
+        totals = np.bincount(offsets, weights=amounts, minlength=span)
+        return reports.TimeSeries(bucket, labels, totals[present].tolist(), counts[present].tolist())
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error as e:
+            print(f"Error closing expense store: {e}")
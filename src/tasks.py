@@ -0,0 +1,180 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskCancelled(Exception):
+    """Raised inside a job by its progress callback once the task was cancelled."""
+
+
+class Task:
+    """Handle for one job submitted to a TaskRunner."""
+
+    def __init__(self, runner, name, on_done, on_error, on_progress):
+        self.runner = runner
+        self.name = name
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Cancel the task; its callbacks will not run.
+
+        A job that has not started yet is dropped. A running thread job stops the
+        next time it reports progress; anything else runs to completion and its
+        result is discarded.
+        """
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def report_progress(self, value):
+        # Called from the worker thread; delivered on the Tk thread by TaskRunner.poll
+        if self.cancelled:
+            raise TaskCancelled()
+        self.runner.progress_queue.put((self, value))
+
+
+class TaskRunner:
+    """Runs jobs off the Tk main loop and delivers their results back onto it.
+
+    submit() uses a thread pool for SQLite and file I/O, submit_cpu() a process
+    pool for CPU-heavy work such as pandas aggregations and report rendering
+    (process jobs must be picklable module-level functions). Completion,
+    error and progress callbacks always run on the Tk thread: the runner polls
+    its futures with root.after while any task is pending. on_busy is called
+    with the list of pending tasks whenever that list changes.
+    """
+
+    def __init__(self, root, on_busy=None, poll_interval=50, max_threads=4, max_processes=2):
+        self.root = root
+        self.on_busy = on_busy
+        self.poll_interval = poll_interval
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self.tasks = []
+        self.progress_queue = queue.SimpleQueue()
+        self.call_queue = queue.SimpleQueue()
+        self._thread_pool = None
+        self._process_pool = None
+        self._poll_id = None
+
+    @property
+    def thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.max_threads, thread_name_prefix='expense-task')
+        return self._thread_pool
+
+    @property
+    def process_pool(self):
+        if self._process_pool is None:
+            # Imported here: multiprocessing is slow to load and most sessions never need it
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn, not fork: forking a process that runs Tk is not safe
+            context = multiprocessing.get_context('spawn')
+            self._process_pool = ProcessPoolExecutor(self.max_processes, mp_context=context)
+        return self._process_pool
+
+    def submit(self, fn, *args, name=None, on_done=None, on_error=None, on_progress=None, **kwargs):
+        """Run fn(*args, **kwargs) on the thread pool and return its Task.
+
+        When on_progress is given, fn is also passed a progress keyword argument:
+        a callable taking a value between 0 and 1, which raises TaskCancelled
+        once the task is cancelled.
+        """
+        task = Task(self, name or getattr(fn, '__name__', 'task'), on_done, on_error, on_progress)
+        if on_progress is not None:
+            kwargs['progress'] = task.report_progress
+        task.future = self.thread_pool.submit(fn, *args, **kwargs)
+        return self.track(task)
+
+    def submit_cpu(self, fn, *args, name=None, on_done=None, on_error=None, **kwargs):
+        """Run fn(*args, **kwargs) in the process pool and return its Task."""
+        task = Task(self, name or getattr(fn, '__name__', 'task'), on_done, on_error, None)
+        task.future = self.process_pool.submit(fn, *args, **kwargs)
+        return self.track(task)
+
+    def call_soon(self, fn, *args):
+        """Run fn(*args) on the Tk thread: right away when called there, else on the next poll.
+
+        Meant for notifications published by running jobs; polling continues
+        while the job is pending, so they arrive before its on_done callback.
+        """
+        if threading.current_thread() is threading.main_thread():
+            fn(*args)
+        else:
+            self.call_queue.put((fn, args))
+
+    def track(self, task):
+        self.tasks.append(task)
+        self.notify_busy()
+        if self._poll_id is None:
+            self._poll_id = self.root.after(self.poll_interval, self.poll)
+        return task
+
+    def poll(self):
+        self._poll_id = None
+
+        while True:
+            try:
+                fn, args = self.call_queue.get_nowait()
+            except queue.Empty:
+                break
+            fn(*args)
+
+        while True:
+            try:
+                task, value = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if not task.cancelled and task.on_progress is not None:
+                task.on_progress(value)
+
+        finished = [task for task in self.tasks if task.future.done()]
+        for task in finished:
+            self.tasks.remove(task)
+        if finished:
+            self.notify_busy()
+
+        for task in finished:
+            if task.cancelled or task.future.cancelled():
+                continue
+            error = task.future.exception()
+            if error is None:
+                if task.on_done is not None:
+                    task.on_done(task.future.result())
+            elif isinstance(error, TaskCancelled):
+                continue
+            elif task.on_error is not None:
+                task.on_error(error)
+            else:
+                print(f"Error in background task {task.name}: {error}")
+
+        if self.tasks:
+            self._poll_id = self.root.after(self.poll_interval, self.poll)
+
+    def notify_busy(self):
+        if self.on_busy is not None:
+            self.on_busy(list(self.tasks))
+
+    def cancel_all(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        if self._poll_id is not None:
+            self.root.after_cancel(self._poll_id)
+            self._poll_id = None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
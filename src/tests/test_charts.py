@@ -0,0 +1,79 @@
+import tkinter as tk
+import unittest
+from charts import ChartPanel, fill_periods, lttb
+from reports import Distribution, TimeSeries
+
+
+class TestLttb(unittest.TestCase):
+
+    def test_short_series_are_kept_whole(self):
+        self.assertEqual(list(lttb([3.0, 1.0, 2.0], 10)), [0, 1, 2])
+
+    def test_keeps_the_ends_and_at_most_threshold_points(self):
+        values = [float(i % 7) for i in range(10000)]
+        keep = lttb(values, 500)
+        self.assertEqual(len(keep), 500)
+        self.assertEqual((keep[0], keep[-1]), (0, 9999))
+        self.assertTrue(all(a < b for a, b in zip(keep, keep[1:])))
+
+    def test_keeps_spikes(self):
+        values = [1.0] * 5000
+        values[1234] = 500.0
+        values[3210] = -200.0
+        keep = list(lttb(values, 100))
+        self.assertIn(1234, keep)
+        self.assertIn(3210, keep)
+
+
+class TestFillPeriods(unittest.TestCase):
+
+    def test_empty_periods_are_added_at_zero(self):
+        series = fill_periods(TimeSeries('month', ['2023-11', '2024-02'], [5.0, 7.0], [1, 2]))
+        self.assertEqual(series, TimeSeries('month', ['2023-11', '2023-12', '2024-01', '2024-02'],
+                                            [5.0, 0.0, 0.0, 7.0], [1, 0, 0, 2]))
+
+    def test_weeks_step_by_seven_days(self):
+        series = fill_periods(TimeSeries('week', ['2024-01-01', '2024-01-15'], [1.0, 2.0], [1, 1]))
+        self.assertEqual(series.periods, ['2024-01-01', '2024-01-08', '2024-01-15'])
+        self.assertEqual(series.totals, [1.0, 0.0, 2.0])
+
+
+class TestChartPanel(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.root = tk.Tk()
+        except tk.TclError as e:
+            self.skipTest(f"no display: {e}")
+        self.root.withdraw()
+        self.panel = ChartPanel(self.root, max_points=50)
+
+    def tearDown(self):
+        self.root.destroy()
+
+    def test_time_series_update_one_line_in_place(self):
+        days = [f'2024-01-{day:02d}' for day in range(1, 32)] * 10
+        self.panel.show_timeseries(TimeSeries('day', days, [float(i) for i in range(len(days))], [1] * len(days)))
+        line = self.panel.line
+        self.panel.show_timeseries(TimeSeries('month', ['2024-01', '2024-02'], [10.0, 20.0], [1, 1]))
+        self.assertIs(self.panel.line, line)
+        self.assertEqual(len(self.panel.axes.lines), 1)
+
+        self.panel.show_distribution(Distribution(['Food'], [10.0], [1]))
+        self.assertIsNone(self.panel.line)
+        self.assertEqual(len(self.panel.axes.lines), 0)
+
+    def test_time_series_after_a_pie_fills_the_axes(self):
+        self.panel.show_distribution(Distribution(['Food'], [10.0], [1]))
+        self.panel.show_timeseries(TimeSeries('year', ['2023', '2024'], [1.0, 2.0], [1, 1]))
+        self.assertEqual(self.panel.axes.get_aspect(), 'auto')
+
+    def test_distribution_leaves_out_negative_totals(self):
+        self.panel.show_distribution(Distribution(['Food', 'Refunds'], [10.0, -4.0], [1, 1]))
+        self.assertEqual(len(self.panel.axes.patches), 1)
+        self.panel.show_distribution(Distribution(['Refunds'], [-4.0], [1]))
+        self.assertEqual(len(self.panel.axes.patches), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
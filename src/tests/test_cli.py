@@ -0,0 +1,108 @@
+import contextlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import cli
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, 'expenses.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_cli(self, *argv):
+        """Run the CLI on the test database; return (exit status, JSON records written)."""
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+            status = cli.main(['--db', self.db_file, '--json'] + list(argv))
+        return status, [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_add_then_filter(self):
+        self.assertEqual(self.run_cli('add', '12.5', 'Food', '--date', '2024-01-03', '--description', 'Lunch')[0], 0)
+        self.run_cli('add', '40', 'Rent', '--date', '2024-02-01')
+
+        status, records = self.run_cli('filter', '--category', 'Food')
+        self.assertEqual(status, 0)
+        self.assertEqual(records, [{'id': 1, 'amount': 12.5, 'category': 'Food', 'date': '2024-01-03',
+                                    'description': 'Lunch'}])
+
+    def test_failed_insert_fails_without_output(self):
+        self.run_cli('add', '1', 'Food', '--date', '2024-01-01')
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("CREATE TRIGGER reject BEFORE INSERT ON expenses BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.run_cli('add', '7', 'Food', '--date', '2024-01-02'), (1, []))
+        self.assertEqual(len(self.run_cli('filter')[1]), 1)
+
+    def test_invalid_input_fails_without_output(self):
+        self.assertEqual(self.run_cli('add', 'lots', 'Food'), (1, []))
+        self.assertEqual(self.run_cli('filter', '--start-date', 'yesterday'), (1, []))
+
+    def test_filter_streams_across_pages(self):
+        for day in range(1, 6):
+            self.run_cli('add', str(day), 'Food', '--date', f'2024-01-0{day}')
+        original, cli.PAGE_SIZE = cli.PAGE_SIZE, 2
+        try:
+            status, records = self.run_cli('filter')
+            self.assertEqual([record['amount'] for record in records], [1.0, 2.0, 3.0, 4.0, 5.0])
+            self.assertEqual(len(self.run_cli('filter', '--limit', '3')[1]), 3)
+        finally:
+            cli.PAGE_SIZE = original
+
+    def test_bulk_import_report_and_export(self):
+        csv_file = os.path.join(self.tmpdir.name, 'in.csv')
+        with open(csv_file, 'w', encoding='utf-8') as f:
+            f.write('amount,category,date,description\n'
+                    '10,Food,2024-01-01,Lunch\n20,Rent,2024-02-01,\n5,Food,2024-02-03,Snack\nbad,Food,2024-02-04,\n')
+
+        status, records = self.run_cli('bulk-import', csv_file)
+        self.assertEqual(status, 0)
+        self.assertEqual(records[-1], {'imported': 3, 'duplicates': 0, 'rejected': 1})
+
+        status, records = self.run_cli('report', 'monthly')
+        self.assertEqual(records, [{'period': '2024-01', 'total': 10.0, 'count': 1},
+                                   {'period': '2024-02', 'total': 25.0, 'count': 2}])
+
+        # A refund leaves its category negative, which the pie leaves out
+        self.run_cli('add', '-30', 'Refunds', '--date', '2024-02-05')
+        chart_file = os.path.join(self.tmpdir.name, 'distribution.png')
+        self.assertEqual(self.run_cli('report', 'distribution', '--chart', chart_file)[0], 0)
+        self.assertTrue(os.path.exists(chart_file))
+
+        export_file = os.path.join(self.tmpdir.name, 'food.csv')
+        status, records = self.run_cli('export', 'csv', export_file, '--category', 'Food')
+        self.assertEqual(records, [{'format': 'csv', 'file': export_file, 'rows': 2}])
+        self.assertTrue(os.path.exists(export_file))
+
+
+    def test_archive_then_report(self):
+        self.run_cli('add', '10', 'Food', '--date', '2022-05-01')
+        self.run_cli('add', '20', 'Food', '--date', '2024-01-01')
+
+        status, records = self.run_cli('archive', '2022', '--compact')
+        self.assertEqual(status, 0)
+        self.assertEqual([(record['year'], record['rows']) for record in records], [(2022, 1)])
+        self.assertEqual(self.run_cli('report', 'timeseries', '--bucket', 'year')[1],
+                         [{'period': '2022', 'total': 10.0, 'count': 1}, {'period': '2024', 'total': 20.0, 'count': 1}])
+        self.assertEqual(self.run_cli('archive', '2024')[0], 1)
+
+    def test_snapshot(self):
+        directory = os.path.join(self.tmpdir.name, 'snapshot')
+        self.run_cli('add', '10', 'Food', '--date', '2024-05-01')
+        self.assertEqual(self.run_cli('snapshot', directory)[1],
+                         [{'directory': directory, 'rows': 1, 'written': 1, 'last_id': 1}])
+        self.run_cli('add', '20', 'Food', '--date', '2024-05-02')
+        self.assertEqual(self.run_cli('snapshot', directory)[1],
+                         [{'directory': directory, 'rows': 2, 'written': 1, 'last_id': 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from database import DB_ENV, get_manager, memory_uri, release_manager
+from data import ExpenseModel
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, 'expenses.db')
+        self.manager = get_manager(self.db_file)
+
+    def tearDown(self):
+        release_manager(self.manager)
+        self.tmpdir.cleanup()
+
+    def test_same_file_shares_one_manager(self):
+        other = get_manager(os.path.join(self.tmpdir.name, '.', 'expenses.db'))
+        try:
+            self.assertIs(other, self.manager)
+            self.assertIs(other.connection, self.manager.connection)
+        finally:
+            release_manager(other)
+
+    def test_pragma_profile_is_applied(self):
+        conn = self.manager.connection
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.assertEqual(conn.execute('PRAGMA temp_store').fetchone()[0], 2)  # MEMORY
+
+    def test_worker_threads_get_their_own_connection(self):
+        self.manager.connection.execute('CREATE TABLE t (x INTEGER)')
+        self.manager.connection.commit()
+        seen = []
+
+        def worker():
+            cursor = self.manager.cursor()
+            cursor.execute('INSERT INTO t VALUES (1)')
+            cursor.connection.commit()
+            seen.append(cursor.connection)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(seen[0], self.manager.connection)
+        self.assertEqual(self.manager.cursor().execute('SELECT COUNT(*) FROM t').fetchone()[0], 1)
+
+
+class TestDatabaseLocation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_environment_variable_names_the_default_database(self):
+        db_file = os.path.join(self.tmpdir.name, 'ledger', 'expenses.db')
+        with mock.patch.dict(os.environ, {DB_ENV: db_file}):
+            model = ExpenseModel()
+        try:
+            self.assertEqual(model.db_file, db_file)
+            self.assertTrue(os.path.exists(db_file))
+        finally:
+            model.close_connection()
+
+    def test_memory_database_is_shared_with_worker_threads(self):
+        model = ExpenseModel(':memory:')
+        try:
+            self.assertTrue(model.in_memory)
+            model.add_expense(10.0, 'Food', '2024-01-01', 'Lunch')
+            model.conn.commit()
+            counts = []
+            thread = threading.Thread(target=lambda: counts.append(len(model.get_expenses())))
+            thread.start()
+            thread.join()
+            self.assertEqual(counts, [1])
+        finally:
+            model.close_connection()
+
+    def test_memory_database_writes_wait_for_worker_reads(self):
+        model = ExpenseModel(':memory:')
+        try:
+            model.add_expenses_bulk([(1.0, 'Food', '2024-01-01', 'row %d' % i) for i in range(500)])
+            reading, errors = threading.Event(), []
+
+            def read():
+                try:
+                    cursor = model.cursor.execute('SELECT * FROM expenses')
+                    cursor.fetchmany(10)
+                    reading.set()
+                    time.sleep(0.3)
+                    cursor.fetchall()
+                except sqlite3.Error as e:
+                    errors.append(e)
+                    reading.set()
+
+            thread = threading.Thread(target=read)
+            thread.start()
+            reading.wait()
+            self.assertTrue(model.add_expense(2.0, 'Food', '2024-01-02', 'while reading'))
+            thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(model.count_expenses(), 501)
+        finally:
+            model.close_connection()
+
+    def test_memory_databases_are_separate_unless_named(self):
+        first, second = ExpenseModel(':memory:'), ExpenseModel(':memory:')
+        uri = memory_uri('test-ledger')
+        third, fourth = ExpenseModel(uri), ExpenseModel(uri)
+        try:
+            first.add_expense(10.0, 'Food', '2024-01-01', 'Lunch')
+            third.add_expense(20.0, 'Food', '2024-01-02', 'Dinner')
+            third.conn.commit()
+            self.assertEqual(len(second.get_expenses()), 0)
+            self.assertEqual(len(fourth.get_expenses()), 1)
+        finally:
+            for model in (first, second, third, fourth):
+                model.close_connection()
+
+    def test_memory_session_saves_to_disk(self):
+        db_file = os.path.join(self.tmpdir.name, 'saved.db')
+        model = ExpenseModel(':memory:')
+        try:
+            model.add_expense(10.0, 'Food', '2024-01-01', 'Lunch')
+            self.assertEqual(model.backup_to(db_file), 1)
+        finally:
+            model.close_connection()
+
+        saved = ExpenseModel(db_file)
+        try:
+            self.assertFalse(saved.in_memory)
+            self.assertEqual([tuple(row) for row in saved.get_expenses()], [(10.0, 'Food', '2024-01-01', 'Lunch')])
+        finally:
+            saved.close_connection()
+
+
+if __name__ == '__main__':
+    unittest.main()
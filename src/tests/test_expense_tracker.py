@@ -1,12 +1,22 @@
+import os
+import sqlite3
+import tempfile
 import unittest
+import unittest.mock
 from datetime import datetime
 from controller import ExpenseTrackerController
+import data
+from data import ExpenseModel, ResultCache, SCHEMA_VERSION, archive_directory, export_pdf_file, read_expenses_csv
+from events import CATEGORIES, EXPENSES, CategoryEvent, ExpenseEvent
 
 class TestExpenseTrackerController(unittest.TestCase):
 
     def setUp(self):
-        # Initialize ExpenseTrackerController instance
-        self.controller = ExpenseTrackerController()
+        # Initialize ExpenseTrackerController instance on a database of its own
+        self.controller = ExpenseTrackerController(db_file=':memory:')
+
+    def tearDown(self):
+        self.controller.model.close_connection()
 
     def test_add_expense_valid(self):
         # Test with valid inputs
@@ -55,5 +65,830 @@ class TestExpenseTrackerController(unittest.TestCase):
         with self.assertRaises(Exception):
             self.controller.add_expense(amount, category, date, description)
 
+class TestExpenseModelFilter(unittest.TestCase):
+
+    def setUp(self):
+        # Use a throwaway database so the bundled data/expenses.db is untouched
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.controller = ExpenseTrackerController(self.model)
+        rows = [
+            (50.0, "Groceries", "2024-01-05", "Grocery shopping"),
+            (75.0, "Utilities", "2024-01-10", "Electricity bill"),
+            (55.0, "Groceries", "2024-02-03", "Grocery shopping"),
+            (200.0, "Insurance", "2024-03-01", "Car insurance"),
+        ]
+        for row in rows:
+            self.model.add_expense(*row)
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_filter_by_category_and_date(self):
+        expenses = self.controller.filter_expenses("Groceries", "2024-02-01", "2024-12-31", "", "")
+        self.assertEqual(expenses, [(55.0, "Groceries", "2024-02-03", "Grocery shopping")])
+
+    def test_filter_by_amount_range(self):
+        expenses = self.controller.filter_expenses("All", "", "", "60", "100")
+        self.assertEqual(expenses, [(75.0, "Utilities", "2024-01-10", "Electricity bill")])
+
+    def test_filter_without_bounds_returns_everything(self):
+        self.assertEqual(len(self.controller.filter_expenses("All", "", "", "", "")), 4)
+
+    def test_filter_uses_indexes(self):
+        clause, params = self.model.build_filter_clause("Groceries", "2024-01-01", "2024-12-31")
+        plan = self.model.cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM expenses' + clause, params).fetchall()
+        self.assertIn('idx_expenses_category_date', ' '.join(row[-1] for row in plan))
+
+class TestExpenseModelMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, 'expenses.db')
+
+        # A database as written by releases that stored '%m/%d/%Y' dates
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('CREATE TABLE expenses (id INTEGER PRIMARY KEY, amount REAL, category TEXT, date TEXT, description TEXT)')
+        conn.executemany('INSERT INTO expenses (amount, category, date, description) VALUES (?, ?, ?, ?)', [
+            (10.0, "Dining", "06/21/2024", "Lunch"),
+            (20.0, "Dining", "2024-06-22", "Dinner"),
+            (30.0, "Dining", "2024/06/23", "Brunch"),
+        ])
+        conn.commit()
+        conn.close()
+
+        self.model = ExpenseModel(self.db_file)
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_dates_are_normalized(self):
+        dates = [row[2] for row in self.model.get_expenses()]
+        self.assertEqual(dates, ["2024-06-21", "2024-06-22", "2024-06-23"])
+
+    def test_impossible_dates_keep_their_text(self):
+        db_file = os.path.join(self.tmpdir.name, 'typo.db')
+        conn = sqlite3.connect(db_file)
+        conn.execute('CREATE TABLE expenses (id INTEGER PRIMARY KEY, amount REAL, category TEXT, date TEXT, description TEXT)')
+        conn.executemany('INSERT INTO expenses (amount, category, date, description) VALUES (?, ?, ?, ?)',
+                         [(5.0, "Dining", "13/45/2024", "Typo"), (6.0, "Dining", "06/21/2024", "Lunch")])
+        conn.commit()
+        conn.close()
+
+        with unittest.mock.patch('builtins.print') as printed:
+            model = ExpenseModel(db_file)
+        try:
+            dates = [row[0] for row in model.cursor.execute('SELECT date FROM expenses ORDER BY id')]
+            self.assertEqual(dates, ['13/45/2024', '2024-06-21'])
+            printed.assert_any_call("Warning: 1 expenses have unrecognized dates and were left unchanged.")
+        finally:
+            model.close_connection()
+
+    def test_schema_version_is_recorded(self):
+        version = self.model.cursor.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, SCHEMA_VERSION)
+
+    def test_insert_rejects_non_iso_dates(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.model.cursor.execute("INSERT INTO expenses (amount, category_id, date, description) VALUES (1, NULL, '06/24/2024', '')")
+
+    def test_triggers_of_version_5_are_replaced(self):
+        # Version 5 let NULL dates through
+        self.model.cursor.execute('DROP TRIGGER expenses_date_format_insert')
+        self.model.cursor.execute('''CREATE TRIGGER expenses_date_format_insert BEFORE INSERT ON expenses
+                                     WHEN date(NEW.date) IS NOT NEW.date
+                                     BEGIN SELECT RAISE(ABORT, 'expense date must be in YYYY-MM-DD format'); END''')
+        self.model.cursor.execute('PRAGMA user_version = 5')
+        self.model.conn.commit()
+        self.model.close_connection()
+
+        self.model = ExpenseModel(self.db_file)
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.model.cursor.execute("INSERT INTO expenses (amount, category_id, date, description) VALUES (1, NULL, NULL, '')")
+
+    def test_controller_stores_iso_dates(self):
+        controller = ExpenseTrackerController(self.model)
+        controller.add_expense(5.0, "Dining", "2024-06-25", "Coffee")
+        self.assertEqual(self.model.get_expenses()[-1][2], "2024-06-25")
+
+class TestBulkImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.controller = ExpenseTrackerController(self.model)
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_bulk_insert_reports_rejected_rows(self):
+        rows = [
+            ("12.5", "Dining", "2024-05-01", "Lunch"),
+            ("abc", "Dining", "2024-05-02", "Bad amount"),
+            ("7", "Transport", "2024-13-01", "Bad date"),
+            ("3", "Transport", "2024-05-03", ""),
+        ]
+        inserted, errors = self.controller.add_expenses_bulk(rows, batch_size=2)
+        self.assertEqual(inserted, 2)
+        self.assertEqual([error.index for error in errors], [1, 2])
+        self.assertEqual(len(self.model.get_expenses()), 2)
+
+    def test_model_isolates_rows_rejected_by_database(self):
+        rows = [(1.0, "Dining", "2024-05-01", ""), (2.0, "Dining", "05/02/2024", "")]
+        inserted, errors = self.model.add_expenses_bulk(rows)
+        self.assertEqual(inserted, 1)
+        self.assertEqual(errors[0].index, 1)
+
+    def test_null_dates_are_rejected(self):
+        inserted, errors = self.model.add_expenses_bulk([(1.0, "Dining", None, "no date"), (2.0, "Dining", "2024-05-01", "")])
+        self.assertEqual(inserted, 1)
+        self.assertEqual([error.index for error in errors], [0])
+        self.assertEqual(self.model.get_monthly_totals(), [("2024-05", 2.0, 1)])
+        self.assertEqual(self.model.check_summaries(), [])
+
+    def test_import_bundled_csv(self):
+        csv_file = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'expenses.csv')
+        inserted, errors = self.controller.import_expenses_csv(csv_file, batch_size=7)
+        self.assertEqual(errors, [])
+        self.assertEqual(inserted, 30)
+        self.assertEqual(self.model.get_expenses()[0], (50.0, "Groceries", "2024-01-05", "Grocery shopping"))
+
+class TestExpensePaging(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.controller = ExpenseTrackerController(self.model)
+        rows = [(float(i), "Dining" if i % 2 else "Transport", "2024-03-%02d" % (i % 28 + 1), "") for i in range(50)]
+        self.model.add_expenses_bulk(rows)
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_pages_follow_keys_in_both_directions(self):
+        pages = self.controller.get_expense_pages()
+        first = pages.page(limit=20)
+        second = pages.page(after_key=first[-1][0], limit=20)
+        self.assertEqual([row[0] for row in first + second], list(range(1, 41)))
+        self.assertEqual(pages.page(before_key=second[0][0], limit=5), first[-5:])
+
+    def test_filtered_pages(self):
+        pages = self.controller.get_expense_pages(category="Dining", min_amount="10")
+        self.assertEqual(pages.count(), 20)
+        self.assertEqual(pages.key_at(0), 12)
+        self.assertTrue(all(row[2] == "Dining" for row in pages.page(limit=100)))
+
+class TestSummaryTables(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.model.add_expenses_bulk([
+            (10.0, "Dining", "2024-01-05", ""),
+            (20.0, "Dining", "2024-02-05", ""),
+            (30.0, "Transport", "2024-02-06", ""),
+        ])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_triggers_track_inserts_updates_and_deletes(self):
+        self.assertEqual(self.model.get_category_totals(), [("Dining", 30.0, 2), ("Transport", 30.0, 1)])
+        self.assertEqual(self.model.get_monthly_totals(), [("2024-01", 10.0, 1), ("2024-02", 50.0, 2)])
+
+        self.model.cursor.execute("UPDATE expenses SET category_id = (SELECT id FROM categories WHERE name = 'Transport'), "
+                                  "date = '2024-03-01' WHERE amount = 10")
+        self.model.cursor.execute("DELETE FROM expenses WHERE amount = 20")
+        self.model.conn.commit()
+
+        self.assertEqual(self.model.get_category_totals(), [("Transport", 40.0, 2)])
+        self.assertEqual(self.model.get_monthly_totals(), [("2024-02", 30.0, 1), ("2024-03", 10.0, 1)])
+        self.assertEqual(self.model.check_summaries(), [])
+
+    def test_rebuild_repairs_drift(self):
+        self.model.cursor.execute("UPDATE category_totals SET total = 0 WHERE category_id = (SELECT id FROM categories WHERE name = 'Dining')")
+        self.model.cursor.execute("DELETE FROM monthly_totals")
+        self.model.conn.commit()
+        self.assertEqual(len(self.model.check_summaries()), 3)
+
+        self.model.rebuild_summaries()
+        self.assertEqual(self.model.check_summaries(), [])
+
+class TestCsvExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.controller = ExpenseTrackerController(self.model)
+        self.model.add_expenses_bulk([(float(i), "Dining" if i % 2 else "Rent", "2024-04-%02d" % (i % 28 + 1), "row %d" % i)
+                                      for i in range(1, 101)])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_export_streams_in_chunks_and_reports_progress(self):
+        file_path = os.path.join(self.tmpdir.name, 'export.csv')
+        progress = []
+        written = self.model.export_to_csv(file_path, chunk_size=30, progress=progress.append)
+        self.assertEqual(written, 100)
+        self.assertEqual(progress, [0.3, 0.6, 0.9, 1.0])
+        with open(file_path, encoding='utf-8') as f:
+            self.assertEqual(f.readline().strip(), 'id,amount,category,date,description')
+            self.assertEqual(f.readline().strip(), '1,1.0,Dining,2024-04-02,row 1')
+
+    def test_unwritable_path_reports_the_real_error(self):
+        file_path = os.path.join(self.tmpdir.name, 'missing', 'export.csv')
+        with self.assertRaises(FileNotFoundError) as raised:
+            self.model.export_to_csv(file_path)
+        # Raised by open() itself, not by the clean-up of a file never created
+        self.assertIsNone(raised.exception.__context__)
+
+    def test_filtered_gzip_export_round_trips(self):
+        file_path = os.path.join(self.tmpdir.name, 'export.csv.gz')
+        written = self.controller.export_to_csv(file_path, category="Rent", max_amount="20")
+        self.assertEqual(written, 10)
+        rows = list(read_expenses_csv(file_path))
+        self.assertEqual(rows[0], ('2.0', 'Rent', '2024-04-03', 'row 2'))
+        self.assertTrue(all(row[1] == 'Rent' for row in rows))
+
+    def test_failed_export_removes_partial_file(self):
+        file_path = os.path.join(self.tmpdir.name, 'export.csv')
+
+        def cancel(fraction):
+            raise RuntimeError("cancelled")
+
+        with self.assertRaises(RuntimeError):
+            self.model.export_to_csv(file_path, chunk_size=10, progress=cancel)
+        self.assertFalse(os.path.exists(file_path))
+
+
+class TestPdfExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.model.add_expenses_bulk([(float(i), "Dining" if i % 2 else "Rent", "2024-%02d-01" % (i % 12 + 1), "row %d" % i)
+                                      for i in range(1, 26)])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_report_has_summary_chart_and_row_pages(self):
+        file_path = os.path.join(self.tmpdir.name, 'report.pdf')
+        progress = []
+        written = self.model.export_to_pdf(file_path, rows_per_page=10, progress=progress.append)
+        self.assertEqual(written, 25)
+        self.assertEqual(progress, [0.4, 0.8, 1.0])
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        # summary + charts + three pages of rows
+        self.assertEqual(content.count(b'/Type /Page') - content.count(b'/Type /Pages'), 5)
+
+    def test_negative_category_totals_are_left_out_of_the_pie(self):
+        self.model.add_expense(-30.0, "Refunds", "2024-03-01", "returned order")
+        file_path = os.path.join(self.tmpdir.name, 'report.pdf')
+        self.assertEqual(self.model.export_to_pdf(file_path, rows_per_page=10), 26)
+        self.assertTrue(os.path.exists(file_path))
+
+    def test_process_pool_job_raises_reported_failures(self):
+        file_path = os.path.join(self.tmpdir.name, 'report.pdf')
+        self.assertEqual(export_pdf_file(self.model.db_file, file_path), 25)
+
+        def fail(model, file_path):
+            print("Error exporting to PDF: disk I/O error")
+
+        with unittest.mock.patch.object(ExpenseModel, "export_to_pdf", fail):
+            with self.assertRaisesRegex(RuntimeError, 'disk I/O error'):
+                export_pdf_file(self.model.db_file, file_path)
+
+    def test_failed_export_removes_partial_file(self):
+        file_path = os.path.join(self.tmpdir.name, 'report.pdf')
+
+        def cancel(fraction):
+            raise RuntimeError("cancelled")
+
+        with self.assertRaises(RuntimeError):
+            self.model.export_to_pdf(file_path, rows_per_page=10, progress=cancel)
+        self.assertFalse(os.path.exists(file_path))
+
+
+class TestSqliteExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.model.add_category("Dining")
+        self.model.add_category("Rent")
+        self.model.add_expenses_bulk([(float(i), "Dining" if i % 2 else "Rent", "2024-04-%02d" % (i % 28 + 1), "row %d" % i)
+                                      for i in range(1, 101)])
+        self.model.cursor.execute('DELETE FROM expenses WHERE id = 1')
+        self.model.conn.commit()
+        self.file_path = os.path.join(self.tmpdir.name, 'export.db')
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def read_export(self, query):
+        conn = sqlite3.connect(self.file_path)
+        try:
+            return conn.execute(query).fetchall()
+        finally:
+            conn.close()
+
+    def test_full_backup_keeps_ids_and_categories(self):
+        progress = []
+        self.assertEqual(self.model.export_to_sqlite(self.file_path, progress=progress.append), 99)
+        self.assertEqual(progress[-1], 1.0)
+        self.assertEqual(self.read_export('SELECT MIN(id), MAX(id), COUNT(*) FROM expenses'), [(2, 100, 99)])
+        self.assertEqual(self.read_export('SELECT name FROM categories ORDER BY id'), [('Dining',), ('Rent',)])
+        self.assertEqual(self.read_export('PRAGMA journal_mode'), [('delete',)])
+
+    def test_filtered_export_copies_matching_rows(self):
+        written = self.model.export_to_sqlite(self.file_path, category="Rent", max_amount=20)
+        self.assertEqual(written, 10)
+        rows = self.read_export('SELECT id, category FROM expense_details ORDER BY id')
+        self.assertEqual([row[0] for row in rows], list(range(2, 21, 2)))
+        self.assertEqual(self.read_export("SELECT total, count FROM category_totals"), [(110.0, 10)])
+
+    def test_incremental_export_appends_new_rows(self):
+        self.model.export_to_sqlite(self.file_path, max_amount=50)
+        self.model.add_expense(5.0, "Dining", "2024-05-01", "new")
+        written = self.model.export_to_sqlite(self.file_path, incremental=True, chunk_size=7)
+        self.assertEqual(written, 51)
+        self.assertEqual(self.read_export('SELECT COUNT(*), MAX(id) FROM expenses'), [(100, 101)])
+
+    def test_backup_completes_while_another_connection_writes(self):
+        writer = sqlite3.connect(self.model.db_file)
+        progress = []
+
+        def write_during_backup(fraction):
+            progress.append(fraction)
+            writer.execute("INSERT INTO expenses (amount, category_id, date, description) "
+                           "VALUES (1, 1, '2024-05-01', 'concurrent')")
+            writer.commit()
+
+        # One page per step, so the writes land between steps
+        data.BACKUP_STEP_PAGES, step_pages = 1, data.BACKUP_STEP_PAGES
+        try:
+            self.assertEqual(self.model.export_to_sqlite(self.file_path, progress=write_during_backup), 99)
+        finally:
+            data.BACKUP_STEP_PAGES = step_pages
+            writer.close()
+        self.assertGreater(len(progress), 5)
+        self.assertEqual(progress[-1], 1.0)
+        self.assertEqual(self.read_export('SELECT COUNT(*) FROM expenses'), [(99,)])
+
+
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = ExpenseModel(os.path.join(self.tmpdir.name, 'source.db'))
+        self.source.add_category("Travel")
+        self.source.add_expenses_bulk([(float(i), "Travel" if i % 2 else "Rent", "2024-04-%02d" % (i % 28 + 1), "row %d" % i)
+                                       for i in range(1, 51)])
+        self.target = ExpenseModel(os.path.join(self.tmpdir.name, 'target.db'))
+        self.target.add_expenses_bulk([(float(i), "Travel" if i % 2 else "Rent", "2024-04-%02d" % (i % 28 + 1), "row %d" % i)
+                                       for i in range(1, 21)])
+
+    def tearDown(self):
+        self.source.close_connection()
+        self.target.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_sqlite_import_skips_existing_expenses(self):
+        file_path = os.path.join(self.tmpdir.name, 'export.db')
+        self.source.export_to_sqlite(file_path)
+        progress = []
+        result = self.target.import_expenses(file_path, batch_size=15, progress=progress.append)
+        self.assertEqual((result.imported, result.duplicates, result.errors), (30, 20, []))
+        self.assertEqual(progress[-1], 1.0)
+        self.assertEqual(self.target.count_expenses(), 50)
+        self.assertIn("Travel", self.target.get_categories())
+        self.assertEqual(self.target.check_summaries(), [])
+
+        # Importing the same file again changes nothing
+        self.assertEqual(self.target.import_expenses(file_path).imported, 0)
+        self.assertEqual(self.target.count_expenses(), 50)
+
+    def test_csv_import_validates_and_keeps_repeats(self):
+        file_path = os.path.join(self.tmpdir.name, 'import.csv')
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("amount,category,date,description\n"
+                    "1.00,Rent,04/02/2024,row 1\n"  # legacy date; row 1 exists, but as Travel
+                    "2,Rent,2024-04-03,row 2\n"     # duplicate of an existing row
+                    "7.5,Food,2024-05-01,lunch\n"
+                    "7.5,Food,2024-05-01,lunch\n"
+                    "abc,Food,2024-05-01,bad amount\n"
+                    "3,Food,someday,bad date\n")
+        result = self.target.import_expenses(file_path)
+        self.assertEqual((result.imported, result.duplicates), (3, 1))
+        self.assertEqual([error.index for error in result.errors], [4, 5])
+        rows = self.target.filter_expenses(category="Food")
+        self.assertEqual([row[:3] for row in rows], [(7.5, 'Food', '2024-05-01')] * 2)
+
+    def test_repeated_expenses_are_matched_as_a_multiset(self):
+        latte = (3.5, "Coffee", "2024-05-02", "latte")
+        for _ in range(3):
+            self.source.add_expense(*latte)
+        file_path = os.path.join(self.tmpdir.name, 'export.db')
+        self.source.export_to_sqlite(file_path)
+        csv_path = os.path.join(self.tmpdir.name, 'export.csv')
+        self.source.export_to_csv(csv_path)
+
+        empty = ExpenseModel(os.path.join(self.tmpdir.name, 'empty.db'))
+        try:
+            # Copies split across batches still count
+            result = empty.import_expenses(file_path, batch_size=52)
+            self.assertEqual((result.imported, result.duplicates), (53, 0))
+            self.assertEqual(empty.count_expenses(category="Coffee"), 3)
+            self.assertEqual(empty.import_expenses(csv_path).imported, 0)
+            self.assertEqual(empty.check_summaries(), [])
+        finally:
+            empty.close_connection()
+
+        # One latte already there: two more are added, from CSV as from SQLite
+        self.target.add_expense(*latte)
+        result = self.target.import_expenses(csv_path)
+        self.assertEqual((result.imported, result.duplicates), (32, 21))
+        self.assertEqual(self.target.count_expenses(category="Coffee"), 3)
+
+    def test_rows_without_hash_are_matched(self):
+        # As written by a program that does not know about content_hash
+        self.target.cursor.execute("INSERT INTO expenses (amount, category_id, date, description) "
+                                   "VALUES (99, (SELECT id FROM categories WHERE name = 'Rent'), '2024-06-01', 'external')")
+        self.target.conn.commit()
+        self.source.add_expense(99.0, 'Rent', '2024-06-01', 'external')
+        file_path = os.path.join(self.tmpdir.name, 'export.db')
+        self.source.export_to_sqlite(file_path)
+        result = self.target.import_expenses(file_path)
+        self.assertEqual(result.duplicates, 21)
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.model.add_expenses_bulk([
+            (12.0, "Transport", "2024-03-01", "Uber ride home"),
+            (30.0, "Transport", "2024-03-05", "Uber to the airport, uber again on return"),
+            (8.0, "Dining", "2024-03-07", "Uber Eats burger"),
+            (45.0, "Groceries", "2024-03-09", "Weekly shop"),
+            (60.0, "Dining", "2024-04-02", "Dinner with friends"),
+        ])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def descriptions(self, query, **filters):
+        return [row[3] for row in self.model.search_expenses(query, **filters)]
+
+    def test_prefixes_match_and_rank(self):
+        results = self.descriptions("ube")
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], "Uber to the airport, uber again on return")
+        self.assertEqual(self.descriptions("ube rid"), ["Uber ride home"])
+        # Categories are searched too
+        self.assertEqual(sorted(self.descriptions("dining")), ["Dinner with friends", "Uber Eats burger"])
+        self.assertEqual(self.model.count_search_results("ube"), 3)
+
+    def test_filters_narrow_the_matches(self):
+        self.assertEqual(self.descriptions("uber", category="Dining"), ["Uber Eats burger"])
+        self.assertEqual(self.descriptions("din", start_date="2024-04-01"), ["Dinner with friends"])
+        self.assertEqual(self.model.count_search_results("uber", max_amount=20), 2)
+
+    def test_syntax_is_not_passed_through(self):
+        self.assertEqual(self.descriptions('"uber" OR NEAR('), [])
+        self.assertEqual(self.descriptions("  "), [])
+        self.assertEqual(self.model.count_search_results("*"), 0)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.model.cursor.execute("UPDATE expenses SET description = 'Taxi ride home' WHERE description = 'Uber ride home'")
+        self.model.cursor.execute("DELETE FROM expenses WHERE description = 'Uber Eats burger'")
+        self.model.conn.commit()
+        self.assertEqual(self.descriptions("uber"), ["Uber to the airport, uber again on return"])
+        self.assertEqual(self.descriptions("taxi"), ["Taxi ride home"])
+
+    def test_existing_rows_are_indexed_on_upgrade(self):
+        file_path = os.path.join(self.tmpdir.name, 'old.db')
+        conn = sqlite3.connect(file_path)
+        conn.execute('CREATE TABLE expenses (id INTEGER PRIMARY KEY, amount REAL, category TEXT, date TEXT, description TEXT)')
+        conn.execute("INSERT INTO expenses (amount, category, date, description) VALUES (5, 'Dining', '2024-01-02', 'Bagel')")
+        conn.commit()
+        conn.close()
+        model = ExpenseModel(file_path)
+        try:
+            self.assertEqual(model.search_expenses("bag"), [(5.0, 'Dining', '2024-01-02', 'Bagel')])
+        finally:
+            model.close_connection()
+
+    def test_controller_pages_results(self):
+        controller = ExpenseTrackerController(self.model)
+        pages = controller.get_search_pages("uber", "All", "", "", "", "")
+        self.assertEqual(pages.count(), 3)
+        first = pages.page(limit=2)
+        self.assertEqual([row[0] for row in first], [0, 1])
+        rest = pages.page(after_key=first[-1][0], limit=2)
+        self.assertEqual([row[4] for row in first + rest], self.descriptions("uber"))
+        self.assertEqual(pages.page(before_key=2, limit=5), first)
+        with self.assertRaises(ValueError):
+            controller.search_expenses("uber", min_amount="lots")
+
+class TestCategories(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.model.add_expenses_bulk([
+            (10.0, "Dining", "2024-01-05", "Pizza"),
+            (20.0, "Dining", "2024-02-05", "Sushi"),
+            (30.0, "Transport", "2024-02-06", "Train"),
+        ])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def write_legacy_database(self, file_path, rows):
+        # Layout of schema version 4: category names on every row, hashes that include them
+        conn = sqlite3.connect(file_path)
+        conn.execute('CREATE TABLE expenses (id INTEGER PRIMARY KEY, amount REAL, category TEXT, date TEXT, '
+                     'description TEXT, content_hash INTEGER)')
+        conn.execute('CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+        conn.executemany('INSERT INTO expenses (amount, category, date, description, content_hash) '
+                         'VALUES (?, ?, ?, ?, 12345)', rows)
+        conn.execute("INSERT INTO categories (name) VALUES ('Books')")
+        conn.execute('PRAGMA user_version = 4')
+        conn.commit()
+        conn.close()
+
+    def test_expenses_store_category_ids(self):
+        columns = [row[1] for row in self.model.cursor.execute('PRAGMA table_info(expenses)')]
+        self.assertNotIn('category', columns)
+        self.assertEqual(self.model.get_categories(), ["Dining", "Transport"])
+        ids = self.model.cursor.execute('SELECT category_id FROM expenses ORDER BY id').fetchall()
+        self.assertEqual(ids, [(1,), (1,), (2,)])
+
+    def test_legacy_database_is_migrated(self):
+        file_path = os.path.join(self.tmpdir.name, 'legacy.db')
+        self.write_legacy_database(file_path, [(5.0, "Books", "2024-03-01", "Novel"), (7.0, "Games", "2024-03-02", "")])
+        model = ExpenseModel(file_path)
+        try:
+            self.assertEqual(model.get_categories(), ["Books", "Games"])
+            self.assertEqual(model.filter_expenses(category="Games"), [(7.0, "Games", "2024-03-02", "")])
+            self.assertEqual(model.get_category_totals(), [("Books", 5.0, 1), ("Games", 7.0, 1)])
+            self.assertEqual(model.search_expenses("gam"), [(7.0, "Games", "2024-03-02", "")])
+            self.assertEqual(model.check_summaries(), [])
+            self.assertEqual(model.cursor.execute('SELECT COUNT(*) FROM expenses WHERE content_hash = 12345').fetchone(), (0,))
+        finally:
+            model.close_connection()
+
+    def test_rename_changes_only_the_category_row(self):
+        self.model.rename_category("Dining", "Restaurants")
+        self.assertEqual(self.model.get_categories(), ["Restaurants", "Transport"])
+        self.assertEqual(len(self.model.filter_expenses(category="Restaurants")), 2)
+        self.assertEqual(self.model.filter_expenses(category="Dining"), [])
+        self.assertEqual(self.model.get_category_totals(), [("Restaurants", 30.0, 2), ("Transport", 30.0, 1)])
+        self.assertEqual(len(self.model.search_expenses("restaurants")), 2)
+        self.assertEqual(self.model.search_expenses("dining"), [])
+        # The renamed expenses still count as duplicates of themselves
+        file_path = os.path.join(self.tmpdir.name, 'export.csv')
+        self.model.export_to_csv(file_path)
+        self.assertEqual(self.model.import_expenses(file_path).imported, 0)
+
+        self.model.rename_category("Restaurants", "Transport")  # taken, nothing changes
+        self.assertEqual(self.model.get_categories(), ["Restaurants", "Transport"])
+
+    def test_remove_reassigns_expenses(self):
+        self.model.remove_category("Dining", replacement="Food")
+        self.assertEqual(self.model.get_categories(), ["Transport", "Food"])
+        self.assertEqual(self.model.get_category_totals(), [("Food", 30.0, 2), ("Transport", 30.0, 1)])
+        self.model.remove_category("Transport")
+        self.assertEqual(self.model.get_category_totals(), [("", 30.0, 1), ("Food", 30.0, 2)])
+        self.assertEqual(self.model.filter_expenses(max_amount=30, min_amount=30), [(30.0, None, "2024-02-06", "Train")])
+        self.assertEqual(self.model.check_summaries(), [])
+
+    def test_cache_avoids_queries_and_notices_other_writers(self):
+        statements = []
+        self.model.get_categories()
+        self.model.conn.set_trace_callback(statements.append)
+        try:
+            for _ in range(3):
+                self.model.get_categories()
+            self.model.filter_expenses(category="Dining")
+        finally:
+            self.model.conn.set_trace_callback(None)
+        self.assertFalse([statement for statement in statements if 'FROM categories' in statement], statements)
+
+        other = sqlite3.connect(self.model.db_file)
+        other.execute("INSERT INTO categories (name) VALUES ('Books')")
+        other.commit()
+        other.close()
+        self.assertEqual(self.model.get_categories(), ["Dining", "Transport", "Books"])
+
+    def test_legacy_export_is_deduplicated(self):
+        file_path = os.path.join(self.tmpdir.name, 'legacy.db')
+        self.write_legacy_database(file_path, [(10.0, "Dining", "2024-01-05", "Pizza"), (10.0, "Other", "2024-01-05", "Pizza")])
+        result = self.model.import_expenses(file_path)
+        self.assertEqual((result.imported, result.duplicates), (1, 1))
+        self.assertEqual(self.model.get_categories(), ["Dining", "Transport", "Books", "Other"])
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.controller = ExpenseTrackerController(self.model)
+        self.events = []
+        self.controller.events.subscribe(CATEGORIES, self.events.append)
+        self.controller.events.subscribe(EXPENSES, self.events.append)
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_category_changes_publish_deltas(self):
+        statements = []
+        self.model.conn.set_trace_callback(statements.append)
+        try:
+            self.controller.add_category("Books")
+        finally:
+            self.model.conn.set_trace_callback(None)
+        # One write, and no re-read of the categories table
+        self.assertEqual([s for s in statements if 'categories' in s],
+                         ["INSERT INTO categories (name) VALUES ('Books')"])
+
+        self.controller.add_category("Books")  # already there: nothing happens
+        self.controller.rename_category("Books", "Novels")
+        self.controller.remove_category("Novels", replacement="Reading")
+        self.assertEqual(self.events, [CategoryEvent('added', "Books"),
+                                       CategoryEvent('renamed', "Novels", old_name="Books"),
+                                       CategoryEvent('added', "Reading"),
+                                       CategoryEvent('removed', "Novels", replacement="Reading")])
+
+    def test_expense_changes_publish_deltas(self):
+        self.controller.add_expense("12.5", "Dining", "2024-05-01", "Lunch")
+        self.assertEqual(self.events, [CategoryEvent('added', "Dining"),
+                                       ExpenseEvent('added', 1, [(12.5, "Dining", "2024-05-01", "Lunch")])])
+
+        del self.events[:]
+        self.controller.add_expenses_bulk([("1", "Dining", "2024-05-02", ""), ("x", "Dining", "2024-05-02", "")])
+        self.assertEqual(self.events, [ExpenseEvent('added', 1)])
+
+        del self.events[:]
+        with self.assertRaises(ValueError):
+            self.controller.add_expense("", "Dining", "2024-05-01", "")
+        self.assertEqual(self.events, [])
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, 'expenses.db')
+        self.model = ExpenseModel(self.db_file)
+        self.model.add_expenses_bulk([(10.0, "Dining", "2024-01-05", "Lunch"),
+                                      (30.0, "Transport", "2024-02-06", "Taxi")])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_repeated_reads_are_served_from_the_cache(self):
+        first = self.model.filter_expenses(category="Dining")
+        first.append("changed by the caller")
+        with unittest.mock.patch('reports.expense_timeseries') as timeseries:
+            self.model.plot_monthly_expenses()
+            self.model.plot_monthly_expenses()
+        self.assertEqual(timeseries.call_count, 1)
+        # Same query spelled differently, and not affected by the caller's change
+        self.assertEqual(self.model.filter_expenses("Dining", None, '', None, None), [(10.0, "Dining", "2024-01-05", "Lunch")])
+        self.assertEqual([key[0] for key in self.model.result_cache.entries].count('filter_expenses'), 1)
+
+    def test_writes_through_the_model_invalidate(self):
+        self.assertEqual(self.model.count_expenses(category="Dining"), 1)
+        self.model.add_expense(5.0, "Dining", "2024-03-01", "Coffee")
+        self.assertEqual(self.model.count_expenses(category="Dining"), 2)
+        self.model.rename_category("Dining", "Food")
+        self.assertEqual(self.model.plot_expense_distribution().labels, ["Transport", "Food"])
+
+    def test_commits_by_other_connections_invalidate(self):
+        self.assertEqual(self.model.plot_monthly_expenses().totals, [10.0, 30.0])
+        # Stands in for another process writing to the same file
+        other = sqlite3.connect(self.db_file)
+        other.execute("UPDATE expenses SET amount = 15.0 WHERE description = 'Lunch'")
+        other.commit()
+        other.close()
+        self.assertEqual(self.model.plot_monthly_expenses().totals, [15.0, 30.0])
+
+    def test_uncommitted_writes_bypass_the_cache(self):
+        self.assertEqual(len(self.model.get_expenses()), 2)
+        self.model.cursor.execute("DELETE FROM expenses WHERE description = 'Taxi'")
+        self.assertEqual(len(self.model.get_expenses()), 1)
+        self.model.conn.rollback()
+        self.assertEqual(len(self.model.get_expenses()), 2)
+
+    def test_least_recently_used_results_are_evicted(self):
+        cache = ResultCache(max_entries=2, max_rows=5)
+        cache.get('a', 1)
+        cache.put('a', 1, [1])
+        cache.put('b', 1, [2])
+        cache.get('a', 1)
+        cache.put('c', 1, [3])
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        cache.put('d', 1, list(range(6)))
+        self.assertNotIn('d', cache.entries)
+        self.assertEqual(cache.get('a', 2), (False, None))
+        self.assertEqual(len(cache.entries), 0)
+
+
+class TestArchives(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, 'expenses.db')
+        self.model = ExpenseModel(self.db_file)
+        rows = [(10.0 + i, ('Rent', 'Food', 'Travel')[i % 3], f'{2021 + i % 3}-{1 + i % 12:02d}-{1 + i % 28:02d}',
+                 f'Taxi ride {i}' if i % 4 == 0 else f'Expense {i}') for i in range(60)]
+        self.model.add_expenses_bulk(rows + [(5.0, 'Food', '2023-12-31', 'Last one')])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def answers(self):
+        model = self.model
+        # Unordered queries list the archives first now, so their rows are sorted
+        return [sorted(model.get_expenses()), sorted(model.filter_expenses('Food', '2021-03-01', '2022-06-30')),
+                model.get_expenses_page(limit=1000), model.count_expenses(start_date='2022-01-01'),
+                model.get_expense_id_at(30), sorted(model.search_expenses('taxi', limit=100)),
+                model.count_search_results('taxi'), model.plot_expense_distribution(),
+                model.get_monthly_totals(), model.get_category_totals(),
+                model.get_expense_timeseries('week', by_category=True)]
+
+    def test_archived_years_are_still_queried(self):
+        before = self.answers()
+        self.assertEqual(self.model.archive_year(2021), 20)
+        self.assertEqual(self.model.archive_year(2022), 20)
+
+        self.assertEqual(self.model.conn.execute('SELECT COUNT(*) FROM main.expenses').fetchone()[0], 21)
+        self.assertEqual([(archive.year, archive.rows) for archive in self.model.get_archives()], [(2021, 20), (2022, 20)])
+        self.assertTrue(os.path.isfile(os.path.join(archive_directory(self.db_file), 'expenses-2021.db')))
+        self.assertEqual(self.answers(), before)
+
+        # The next run finds them in the archives table
+        self.model.close_connection()
+        self.model = ExpenseModel(self.db_file)
+        self.assertEqual(self.answers(), before)
+
+    def test_partitions_outside_the_date_range_are_skipped(self):
+        self.model.archive_year(2021)
+        self.model.archive_year(2022)
+        self.assertEqual(self.model.partitions(), ['archive_2021', 'archive_2022', 'main'])
+        self.assertEqual(self.model.partitions(start_date='2022-03-01'), ['archive_2022', 'main'])
+        self.assertEqual(self.model.partitions(start_date='2023-01-01'), ['main'])
+        self.assertEqual(self.model.expense_source('expenses', start_date='2023-01-01'), 'expenses')
+
+    def test_archives_are_read_only(self):
+        self.model.archive_year(2021)
+        with self.assertRaises(sqlite3.OperationalError):
+            self.model.conn.execute('DELETE FROM archive_2021.expenses')
+        self.assertFalse(self.model.remove_category('Rent'))
+        self.assertIn('Rent', self.model.get_categories())
+
+    def test_expenses_added_to_an_archived_year_stay_in_main(self):
+        self.model.archive_year(2021)
+        self.model.add_expense(1.0, 'Food', '2021-07-01', 'Late receipt')
+        self.model.add_expense(2.0, 'Food', '2024-01-01', 'New year')
+        self.assertEqual(self.model.archive_year(2021), 0)
+        self.assertEqual(self.model.get_archives()[0].rows, 20)
+        self.assertEqual(self.model.count_expenses(start_date='2021-01-01', end_date='2021-12-31'), 21)
+
+    def test_refuses_the_current_year_and_the_last_expense(self):
+        self.assertIsNone(self.model.archive_year(datetime.now().year))
+        self.assertIsNone(self.model.archive_year(2023))
+        self.assertEqual(self.model.get_archives(), [])
+
+    def test_imports_and_exports_see_the_archives(self):
+        export = os.path.join(self.tmpdir.name, 'export.db')
+        self.model.archive_year(2021)
+        self.assertEqual(self.model.export_to_sqlite(export), 61)
+        result = self.model.import_expenses(export)
+        self.assertEqual((result.imported, result.duplicates), (0, 61))
+
+    def test_compact_archives(self):
+        self.model.archive_year(2021)
+        self.assertGreaterEqual(self.model.compact_archives(), 0)
+        self.assertEqual(self.model.count_expenses(), 61)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import instrumentation
+from controller import ExpenseTrackerController
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.controller = ExpenseTrackerController(db_file=':memory:')
+        self.controller.add_expenses_bulk([(10.0, 'Food', '2024-01-01', 'Lunch'),
+                                           (20.0, 'Rent', '2024-01-02', 'Flat')])
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+        self.controller.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_nothing_is_collected_while_disabled(self):
+        self.controller.load_expenses()
+        self.assertEqual(instrumentation.snapshot(), {'timings': {}, 'counters': {}, 'slow_queries': []})
+
+    def test_methods_rows_and_bytes_are_counted(self):
+        instrumentation.enable()
+        self.controller.load_expenses()
+        self.controller.load_expenses()
+        file_path = os.path.join(self.tmpdir.name, 'expenses.csv')
+        self.controller.export_to_csv(file_path)
+
+        stats = instrumentation.snapshot()
+        self.assertEqual(stats['timings']['ExpenseTrackerController.load_expenses']['calls'], 2)
+        self.assertEqual(stats['timings']['ExpenseModel.get_expenses']['calls'], 2)
+        # The second load is answered by the result cache
+        self.assertEqual(stats['counters']['rows_fetched'], 4)
+        self.assertEqual(stats['counters']['cache_hits'], 1)
+        self.assertEqual(stats['counters']['bytes_exported'], os.path.getsize(file_path))
+        self.assertGreater(stats['counters']['sql_statements'], 0)
+
+    def test_slow_queries_are_logged_with_their_plan(self):
+        with mock.patch('builtins.print'):
+            instrumentation.enable(slow_ms=0)
+            self.controller.filter_expenses('Food', '', '', '', '')
+
+        queries = instrumentation.snapshot()['slow_queries']
+        select = next(query for query in queries if query['sql'].startswith('SELECT amount'))
+        self.assertEqual(select['method'], 'ExpenseTrackerController.filter_expenses')
+        self.assertTrue(any('idx_expenses_category_date' in line for line in select['plan']))
+
+    def test_enable_reads_the_slow_query_threshold_from_the_environment(self):
+        # As cli.py --profile does, without EXPENSE_TRACKER_PROFILE set
+        with mock.patch.object(instrumentation, 'slow_query_ms', instrumentation.DEFAULT_SLOW_QUERY_MS), \
+                mock.patch.dict(os.environ, {instrumentation.SLOW_QUERY_ENV: '0'}), mock.patch('builtins.print'):
+            instrumentation.enable()
+            self.assertEqual(instrumentation.slow_query_ms, 0)
+            self.controller.filter_expenses('Food', '', '', '', '')
+            self.assertTrue(instrumentation.snapshot()['slow_queries'])
+
+            instrumentation.enable(slow_ms=250)
+            self.assertEqual(instrumentation.slow_query_ms, 250)
+
+    def test_dump_writes_json_and_cprofile_stats(self):
+        instrumentation.enable(profile=True)
+        self.controller.load_expenses()
+        instrumentation.disable()
+
+        json_file = os.path.join(self.tmpdir.name, 'stats.json')
+        instrumentation.dump(json_file)
+        with open(json_file, encoding='utf-8') as f:
+            self.assertIn('ExpenseTrackerController.load_expenses', json.load(f)['timings'])
+
+        prof_file = os.path.join(self.tmpdir.name, 'stats.prof')
+        instrumentation.dump(prof_file)
+        self.assertGreater(os.path.getsize(prof_file), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+import reports
+from data import ExpenseModel
+
+
+class TestReports(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.model.add_expenses_bulk([
+            (10.0, "Dining", "2024-01-01", ""),      # Monday
+            (5.0, "Dining", "2024-01-07", ""),       # Sunday, same week
+            (20.0, "Transport", "2024-01-08", ""),   # next Monday
+            (40.0, "Rent", "2024-02-01", ""),
+            (25.0, "Dining", "2025-03-01", ""),
+        ])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def test_distribution_is_sorted_by_total(self):
+        distribution = reports.expense_distribution(self.model)
+        self.assertEqual(distribution.labels, ["Dining", "Rent", "Transport"])
+        self.assertEqual(distribution.totals, [40.0, 40.0, 20.0])
+        self.assertEqual(distribution.counts, [3, 1, 1])
+        self.assertAlmostEqual(sum(distribution.shares()), 1.0)
+
+    def test_positive_part_of_distribution(self):
+        distribution = reports.Distribution(["Rent", "Dining", "Refunds"], [40.0, 0.0, -15.0], [1, 2, 1])
+        self.assertEqual(distribution.positive(), reports.Distribution(["Rent"], [40.0], [1]))
+
+    def test_filtered_distribution(self):
+        distribution = reports.expense_distribution(self.model, start_date="2024-01-05", end_date="2024-12-31")
+        self.assertEqual(dict(zip(distribution.labels, distribution.totals)), {"Dining": 5.0, "Transport": 20.0, "Rent": 40.0})
+
+    def test_buckets(self):
+        weekly = reports.expense_timeseries(self.model, 'week')
+        self.assertEqual(weekly.periods, ["2024-01-01", "2024-01-08", "2024-01-29", "2025-02-24"])
+        self.assertEqual(weekly.totals, [15.0, 20.0, 40.0, 25.0])
+
+        yearly = reports.expense_timeseries(self.model, 'year')
+        self.assertEqual(list(zip(yearly.periods, yearly.totals)), [("2024", 75.0), ("2025", 25.0)])
+
+        with self.assertRaises(ValueError):
+            reports.expense_timeseries(self.model, 'fortnight')
+
+    def test_monthly_summary_matches_group_by(self):
+        from_summary = reports.expense_timeseries(self.model, 'month')
+        scanned = reports.expense_timeseries(self.model, 'month', min_amount=0)
+        self.assertEqual(from_summary, scanned)
+
+    def test_category_timeseries_fills_empty_cells(self):
+        series = reports.category_timeseries(self.model, 'year')
+        self.assertEqual(series.periods, ["2024", "2025"])
+        self.assertEqual(series.series("Dining"), [15.0, 25.0])
+        self.assertEqual(series.series("Rent"), [40.0, 0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
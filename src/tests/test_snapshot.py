@@ -0,0 +1,111 @@
+import os
+import random
+import tempfile
+import unittest
+import numpy as np
+from data import ExpenseModel
+from snapshot import Snapshot, refresh_snapshot, column_file
+from store import ExpenseStore, to_days
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        self.directory = os.path.join(self.tmpdir.name, 'snapshot')
+        rng = random.Random(11)
+        self.model.add_expenses_bulk([(round(rng.uniform(1, 100), 2), rng.choice(["Dining", "Rent", "Travel", ""]),
+                                       "202%d-%02d-%02d" % (rng.randint(3, 5), rng.randint(1, 12), rng.randint(1, 28)),
+                                       rng.choice(["lunch", "taxi", "rent", "café"])) for _ in range(300)])
+
+    def tearDown(self):
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def assert_matches_database(self, snapshot):
+        rows = self.model.conn.execute('''SELECT id, amount, IFNULL(category_id, 0), date, description
+                                          FROM expenses ORDER BY id''').fetchall()
+        ids, amounts, category_ids, dates, descriptions = zip(*rows)
+        self.assertEqual(snapshot.rows, len(rows))
+        self.assertEqual(snapshot.ids.tolist(), list(ids))
+        np.testing.assert_array_equal(snapshot.amounts, np.array(amounts, dtype=float))
+        self.assertEqual(snapshot.category_ids.tolist(), list(category_ids))
+        self.assertEqual(snapshot.days.tolist(), to_days(dates).tolist())
+        self.assertEqual(snapshot.descriptions().tolist(), list(descriptions))
+        self.assertEqual(snapshot.categories, self.model.get_category_names())
+
+    def test_snapshot_matches_the_database(self):
+        self.model.conn.execute("INSERT INTO expenses (amount, date, description) VALUES (NULL, '2024-02-29', NULL)")
+        self.model.conn.commit()
+        self.assertEqual(refresh_snapshot(self.model, self.directory), 301)
+        snapshot = Snapshot(self.directory)
+        self.assert_matches_database(snapshot)
+        self.assertIsInstance(snapshot.amounts.base, np.memmap)
+        names = snapshot.category_list()
+        self.assertEqual({names[code] for code in snapshot.category_ids.tolist()}, {"Dining", "Rent", "Travel", None})
+
+    def test_refresh_appends_new_expenses_only(self):
+        refresh_snapshot(self.model, self.directory)
+        before = Snapshot(self.directory)
+        self.assertEqual(refresh_snapshot(self.model, self.directory), 0)
+
+        self.model.add_expense(7.5, "Books", "2025-02-01", "novel")
+        self.model.rename_category("Dining", "Eating out")
+        self.assertEqual(refresh_snapshot(self.model, self.directory), 1)
+        after = Snapshot(self.directory)
+        self.assertEqual(after.generation, before.generation)
+        self.assert_matches_database(after)
+        # A snapshot opened earlier still reads the rows it had
+        self.assertEqual(before.rows, 300)
+        self.assertEqual(before.ids.tolist(), after.ids[:300].tolist())
+
+    def test_changed_expenses_rewrite_the_snapshot(self):
+        refresh_snapshot(self.model, self.directory)
+        before = Snapshot(self.directory)
+        self.model.remove_category("Rent", "Travel")
+        self.assertEqual(refresh_snapshot(self.model, self.directory), 300)
+        after = Snapshot(self.directory)
+        self.assertEqual(after.generation, before.generation + 1)
+        self.assert_matches_database(after)
+        self.assertFalse(os.path.exists(column_file(self.directory, 'ids', before.generation)))
+
+    def test_archived_expenses_are_included(self):
+        self.model.add_expense(1.0, "Dining", "2025-12-31", "last")
+        refresh_snapshot(self.model, self.directory)
+        self.assertGreater(self.model.archive_year(2023), 0)
+        # Moving rows to an archive changes nothing the snapshot holds
+        self.assertEqual(refresh_snapshot(self.model, self.directory), 0)
+        self.assertEqual(Snapshot(self.directory).generation, 0)
+        self.assertEqual(refresh_snapshot(self.model, self.directory, full=True), 301)
+        self.assertEqual(Snapshot(self.directory).rows, 301)
+
+    def test_unfinished_refresh_is_discarded(self):
+        refresh_snapshot(self.model, self.directory)
+        with open(column_file(self.directory, 'amounts', 0), 'ab') as f:
+            f.write(b'\xff' * 12)
+        self.model.add_expense(2.0, "Dining", "2025-01-01", "tea")
+        self.assertEqual(refresh_snapshot(self.model, self.directory), 1)
+        self.assert_matches_database(Snapshot(self.directory))
+
+    def test_store_reads_the_snapshot(self):
+        store = ExpenseStore(self.model, snapshot_dir=self.directory)
+        try:
+            for filters in ({}, {'category': "Rent"}, {'start_date': "2024-02-01", 'end_date': "2024-08-31"},
+                            {'category': "Unknown"}):
+                self.assertEqual(sorted(store.filter_expenses(**filters), key=repr),
+                                 sorted(self.model.filter_expenses(**filters), key=repr), filters)
+            expected = self.model.plot_expense_distribution()
+            actual = store.plot_expense_distribution()
+            self.assertEqual(sorted(zip(actual.labels, actual.counts)), sorted(zip(expected.labels, expected.counts)))
+
+            store.add_expense(4.0, "Books", "2024-06-01", "atlas")
+            self.assertEqual(store.filter_expenses(category="Books"), [(4.0, "Books", "2024-06-01", "atlas")])
+            self.model.add_expense(5.0, "Books", "2024-06-02", "map")
+            self.assertEqual(len(store.filter_expenses(category="Books")), 2)
+            self.assertEqual(Snapshot(self.directory).rows, 302)
+        finally:
+            store.close()
+
+if __name__ == '__main__':
+    unittest.main()
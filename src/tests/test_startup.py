@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import unittest
+
+SRC = os.path.join(os.path.dirname(__file__), '..')
+
+# Modules that must only load when a chart, report or export asks for them
+HEAVY_MODULES = ('pandas', 'matplotlib', 'numpy', 'ttkthemes', 'pdf_report', 'multiprocessing')
+
+
+def imported_modules(statement):
+    """Return the names of all modules loaded by running statement in a fresh interpreter."""
+    code = f"{statement}\nimport sys\nprint('\\n'.join(sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], cwd=SRC, capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_main_loads_only_tkinter_before_the_first_frame(self):
+        modules = imported_modules('import main')
+        deferred = {'gui', 'controller', 'data', 'tkcalendar', 'sv_ttk'} | set(HEAVY_MODULES)
+        self.assertEqual(sorted(modules & deferred), [])
+
+    def test_gui_and_model_leave_heavy_modules_unloaded(self):
+        modules = imported_modules('import gui, controller, data')
+        self.assertEqual(sorted(modules & set(HEAVY_MODULES)), [])
+
+    def test_cli_loads_neither_tkinter_nor_heavy_modules(self):
+        modules = imported_modules('import cli')
+        self.assertEqual(sorted(modules & ({'tkinter', 'gui'} | set(HEAVY_MODULES))), [])
+
+    def test_pdf_export_loads_matplotlib_on_demand(self):
+        modules = imported_modules('import data\n'
+                                   'model = data.ExpenseModel(":memory:")\n'
+                                   'import tempfile, os\n'
+                                   'model.export_to_pdf(os.path.join(tempfile.mkdtemp(), "report.pdf"))')
+        self.assertIn('matplotlib', modules)
+        self.assertNotIn('matplotlib.pyplot', modules)
+
+if __name__ == '__main__':
+    unittest.main()
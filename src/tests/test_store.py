@@ -0,0 +1,93 @@
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from data import ExpenseModel
+from store import ExpenseStore
+from controller import ExpenseTrackerController
+
+
+class TestExpenseStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model = ExpenseModel(os.path.join(self.tmpdir.name, 'expenses.db'))
+        rng = random.Random(7)
+        self.model.add_expenses_bulk([(round(rng.uniform(1, 100), 2), rng.choice(["Dining", "Rent", "Travel"]),
+                                       "202%d-%02d-%02d" % (rng.randint(3, 5), rng.randint(1, 12), rng.randint(1, 28)),
+                                       "row %d" % i) for i in range(500)])
+        self.store = ExpenseStore(self.model)
+
+    def tearDown(self):
+        self.store.close()
+        self.model.close_connection()
+        self.tmpdir.cleanup()
+
+    def assert_same_distribution(self, expected, actual):
+        self.assertEqual(sorted(expected.labels), sorted(actual.labels))
+        for label, total, count in zip(expected.labels, expected.totals, expected.counts):
+            index = actual.labels.index(label)
+            self.assertAlmostEqual(actual.totals[index], total)
+            self.assertEqual(actual.counts[index], count)
+
+    def test_filters_match_the_database(self):
+        for filters in ({}, {'category': "Rent"}, {'start_date': "2024-02-01", 'end_date': "2024-08-31"},
+                        {'min_amount': 10, 'max_amount': 20.5}, {'category': "Dining", 'start_date': "2025-01-01"},
+                        {'category': "Unknown"}):
+            self.assertEqual(sorted(self.store.filter_expenses(**filters)),
+                             sorted(self.model.filter_expenses(**filters)), filters)
+
+    def test_aggregations_match_the_database(self):
+        filters = {'start_date': "2024-01-01", 'max_amount': 70}
+        self.assert_same_distribution(self.model.plot_expense_distribution(**filters),
+                                      self.store.plot_expense_distribution(**filters))
+        for bucket in ('day', 'week', 'month', 'year'):
+            expected = self.model.get_expense_timeseries(bucket, **filters)
+            actual = self.store.get_expense_timeseries(bucket, **filters)
+            self.assertEqual(actual.periods, expected.periods, bucket)
+            self.assertEqual(actual.counts, expected.counts, bucket)
+            for a, b in zip(actual.totals, expected.totals):
+                self.assertAlmostEqual(a, b)
+
+        expected = self.model.get_expense_timeseries('month', by_category=True)
+        actual = self.store.get_expense_timeseries('month', by_category=True)
+        self.assertEqual((actual.periods, actual.categories), (expected.periods, expected.categories))
+        for row_a, row_b in zip(actual.totals, expected.totals):
+            for a, b in zip(row_a, row_b):
+                self.assertAlmostEqual(a, b)
+
+    def test_add_expense_appends_without_reload(self):
+        self.store.filter_expenses()
+        self.store.load = lambda: self.fail("the store reloaded after its own write")
+        for i in range(20):
+            self.store.add_expense(1.5, "Books", "2024-06-01", "new %d" % i)
+        rows = self.store.filter_expenses(category="Books")
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(rows[0], (1.5, "Books", "2024-06-01", "new 0"))
+        self.assertEqual(self.model.count_expenses(category="Books"), 20)
+        self.assertEqual(self.store.size, 520)
+
+    def test_writes_from_other_connections_invalidate(self):
+        self.assertEqual(len(self.store.filter_expenses(category="Books")), 0)
+        self.model.add_expense(3.0, "Books", "2024-06-01", "")
+        self.assertEqual(len(self.store.filter_expenses(category="Books")), 1)
+
+        other = sqlite3.connect(self.model.db_file)
+        other.execute("DELETE FROM expenses WHERE category_id = (SELECT id FROM categories WHERE name = 'Books')")
+        other.commit()
+        other.close()
+        self.assertEqual(len(self.store.filter_expenses(category="Books")), 0)
+
+    def test_controller_uses_store_when_enabled(self):
+        controller = ExpenseTrackerController(self.model, use_store=True)
+        try:
+            controller.add_expense("4", "Books", "2024-06-01", "via controller")
+            self.assertEqual(controller.filter_expenses("Books", "", "", "", ""),
+                             [(4.0, "Books", "2024-06-01", "via controller")])
+            self.assertEqual(controller.plot_expense_distribution(category="Books").totals, [4.0])
+        finally:
+            controller.store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import math
+import threading
+import unittest
+from tasks import TaskRunner
+
+
+class ManualRoot:
+    """Stands in for a Tk root: after() callbacks run when the test calls run_pending()."""
+
+    def __init__(self):
+        self.pending = []
+
+    def after(self, delay, callback):
+        self.pending.append(callback)
+        return len(self.pending)
+
+    def after_cancel(self, after_id):
+        pass
+
+    def run_pending(self):
+        callbacks, self.pending = self.pending, []
+        for callback in callbacks:
+            callback()
+
+
+class TestTaskRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.root = ManualRoot()
+        self.busy = []
+        self.runner = TaskRunner(self.root, on_busy=lambda tasks: self.busy.append(len(tasks)))
+
+    def tearDown(self):
+        self.runner.shutdown()
+
+    def finish(self, task):
+        task.future.exception(timeout=30)
+        while self.runner.tasks:
+            self.root.run_pending()
+
+    def test_result_is_delivered_by_polling(self):
+        results = []
+        task = self.runner.submit(sum, [1, 2, 3], on_done=results.append)
+        self.finish(task)
+        self.assertEqual(results, [6])
+        self.assertEqual(self.busy, [1, 0])
+
+    def test_progress_and_cancellation(self):
+        started = threading.Event()
+        release = threading.Event()
+        progress = []
+        results = []
+
+        def job(progress):
+            progress(0.5)
+            started.set()
+            release.wait(5)
+            progress(1.0)
+            return 'done'
+
+        task = self.runner.submit(job, on_done=results.append, on_progress=progress.append)
+        started.wait(5)
+        self.root.run_pending()
+        self.assertEqual(progress, [0.5])
+
+        task.cancel()
+        release.set()
+        self.finish(task)
+        self.assertEqual(results, [])
+        self.assertEqual(progress, [0.5])
+
+    def test_errors_go_to_on_error(self):
+        errors = []
+        task = self.runner.submit(int, 'not a number', on_error=errors.append)
+        self.finish(task)
+        self.assertIsInstance(errors[0], ValueError)
+
+    def test_call_soon_hands_calls_to_the_tk_thread(self):
+        calls = []
+        self.runner.call_soon(calls.append, 'direct')
+        self.assertEqual(calls, ['direct'])
+
+        def job():
+            self.runner.call_soon(calls.append, threading.current_thread() is threading.main_thread())
+            return 'done'
+
+        task = self.runner.submit(job, on_done=calls.append)
+        self.finish(task)
+        # Delivered by the poll, before the job's own result
+        self.assertEqual(calls, ['direct', False, 'done'])
+
+    def test_cpu_jobs_run_in_process_pool(self):
+        results = []
+        task = self.runner.submit_cpu(math.factorial, 10, on_done=results.append)
+        self.finish(task)
+        self.assertEqual(results, [3628800])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+class VirtualTreeview(ttk.Frame):
+    """A Treeview that only ever holds the rows currently on screen.
+
+    Rows come from a source object providing count(), page(after_key=None,
+    before_key=None, limit=...) and key_at(offset), such as
+    controller.ExpensePages. Each row's first element is its key and is not
+    displayed. A bounded buffer of fetched rows around the visible window is
+    kept in memory and extended one page at a time as the user scrolls; jumps
+    with the scrollbar fetch a fresh page at the target position.
+    """
+
+    def __init__(self, parent, columns, height=20, page_size=200):
+        super().__init__(parent)
+        self.height = height
+        self.page_size = page_size
+
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', height=height)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, minwidth=0, width=100)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+
+        self.tree.grid(row=0, column=0, sticky=(tk.N, tk.S, tk.W, tk.E))
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.columnconfigure(0, weight=1)
+
+        self.tree.bind('<MouseWheel>', self.on_mousewheel)
+        self.tree.bind('<Button-4>', lambda event: self.scroll_by(-3))
+        self.tree.bind('<Button-5>', lambda event: self.scroll_by(3))
+        self.tree.bind('<Prior>', lambda event: self.scroll_by(-self.height))
+        self.tree.bind('<Next>', lambda event: self.scroll_by(self.height))
+        self.tree.bind('<Home>', lambda event: self.scroll_to(0))
+        self.tree.bind('<End>', lambda event: self.scroll_to(self.total))
+
+        self.source = None
+        self.total = 0
+        self.offset = 0
+        self.buffer = []
+        self.buffer_start = 0
+
+    def set_source(self, source, total=None):
+        """Show rows from source; pass total if it was already counted elsewhere."""
+        self.source = source
+        self.refresh(total)
+
+    def clear(self):
+        self.set_source(None)
+
+    def refresh(self, total=None):
+        """Re-count the source and redraw from the top, e.g. after rows were added."""
+        if total is None:
+            total = self.source.count() if self.source is not None else 0
+        self.total = total
+        self.buffer = []
+        self.buffer_start = 0
+        self.scroll_to(0)
+
+    def rows_appended(self, count):
+        """Account for count rows added after the last one, staying where the user is."""
+        if self.source is None:
+            return
+        self.total += count
+        self.render()
+
+    def reload(self):
+        """Fetch the visible rows again, e.g. after they were edited, staying where the user is."""
+        if self.source is None:
+            return
+        self.buffer = []
+        self.buffer_start = 0
+        self.render()
+
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == 'scroll':
+            step = self.height if args[2] == 'pages' else 1
+            self.scroll_by(int(args[1]) * step)
+
+    def on_mousewheel(self, event):
+        # Windows reports multiples of 120, macOS small deltas
+        self.scroll_by(-3 if event.delta > 0 else 3)
+        return 'break'
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.offset + rows)
+        return 'break'
+
+    def scroll_to(self, offset):
+        self.offset = max(0, min(offset, self.total - self.height))
+        self.render()
+        return 'break'
+
+    def render(self):
+        stop = min(self.offset + self.height, self.total)
+        self.fill_buffer(self.offset, stop)
+        rows = self.buffer[self.offset - self.buffer_start:stop - self.buffer_start]
+
+        # Reuse the existing items so scrolling never creates or destroys widgets
+        items = self.tree.get_children()
+        for item, row in zip(items, rows):
+            self.tree.item(item, values=row[1:])
+        for row in rows[len(items):]:
+            self.tree.insert("", tk.END, values=row[1:])
+        if len(items) > len(rows):
+            self.tree.delete(*items[len(rows):])
+
+        if self.total:
+            self.scrollbar.set(self.offset / self.total, stop / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def fill_buffer(self, start, stop):
+        """Make sure rows start..stop are buffered, fetching as few pages as possible."""
+        if self.source is None or start >= stop:
+            return
+
+        buffer_stop = self.buffer_start + len(self.buffer)
+        if self.buffer and self.buffer_start <= start < buffer_stop + self.page_size and stop > buffer_stop:
+            # Scrolled just past the end: extend forwards
+            while self.buffer_start + len(self.buffer) < stop:
+                rows = self.source.page(after_key=self.buffer[-1][0], limit=self.page_size)
+                if not rows:
+                    break
+                self.buffer.extend(rows)
+        elif self.buffer and self.buffer_start - self.page_size <= start < self.buffer_start and stop <= buffer_stop:
+            # Scrolled just past the start: extend backwards
+            while self.buffer_start > start:
+                rows = self.source.page(before_key=self.buffer[0][0], limit=self.page_size)
+                if not rows:
+                    break
+                self.buffer[:0] = rows
+                self.buffer_start -= len(rows)
+        elif not (self.buffer and self.buffer_start <= start and stop <= buffer_stop):
+            # Jumped somewhere new: start a fresh buffer at the target row
+            after_key = self.source.key_at(start - 1) if start > 0 else None
+            self.buffer = self.source.page(after_key=after_key, limit=max(self.page_size, stop - start))
+            self.buffer_start = start
+
+        # Drop rows more than a page away from the window
+        keep_from = max(self.buffer_start, start - self.page_size)
+        keep_to = min(self.buffer_start + len(self.buffer), stop + self.page_size)
+        self.buffer = self.buffer[keep_from - self.buffer_start:keep_to - self.buffer_start]
+        self.buffer_start = keep_from